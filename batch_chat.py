@@ -0,0 +1,311 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, List, Optional
+from logger_config import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("batch_chat")
+
+# 默认同时执行的会话数
+DEFAULT_PARALLELISM = 4
+# 保留的任务记录数量（任务结果保存在内存中，数量不宜过大）
+MAX_JOB_HISTORY = 20
+# 任务状态和结果在Redis中的键前缀和保留时间（秒），任意工作进程都可以查询
+JOB_KEY_PREFIX = "chat_batch_job:"
+RESULTS_KEY_PREFIX = "chat_batch_results:"
+JOB_STATUS_TTL = 86400
+# 结果写入Redis的批量：累计条数或距上次写入的秒数达到其一时，在一个管道中提交
+DEFAULT_SAVE_BATCH = 50
+DEFAULT_SAVE_INTERVAL = 1.0
+
+class BatchItem:
+    """
+    批量对话中的一项
+    """
+
+    __slots__ = ("index", "item_id", "session_id", "user_host", "message")
+
+    def __init__(self, index: int, message: str, session_id: str = "default", user_host: str = "unknown",
+                 item_id=None):
+        self.index = index
+        self.message = message
+        self.session_id = session_id
+        self.user_host = user_host
+        # 客户端自带的标识，原样返回，便于对应结果
+        self.item_id = item_id
+
+    @property
+    def session_key(self) -> str:
+        """与/chat接口相同的会话键"""
+        return f"{self.user_host}_{self.session_id}"
+
+    def result(self, **fields) -> dict:
+        """生成该项的结果"""
+        result = {"index": self.index, "session_id": self.session_id, "userHost": self.user_host}
+        if self.item_id is not None:
+            result["id"] = self.item_id
+        result.update(fields)
+        return result
+
+def parse_items(body: bytes, ndjson: bool = False) -> List[BatchItem]:
+    """
+    解析批量请求的请求体
+
+    参数:
+        body: JSON对象 {"items": [...]}、JSON数组，或ndjson为True时每行一个JSON对象
+        ndjson: 是否按NDJSON解析
+
+    返回:
+        按输入顺序排列的BatchItem
+
+    异常:
+        ValueError: 请求体或某一项格式错误（信息中包含出错的序号）
+    """
+    if ndjson:
+        raw = []
+        for line_number, line in enumerate(body.decode("utf-8").splitlines(), 1):
+            if line.strip():
+                try:
+                    raw.append(json.loads(line))
+                except ValueError:
+                    raise ValueError(f"第{line_number}行不是合法的JSON")
+    else:
+        try:
+            data = json.loads(body or b"null")
+        except ValueError:
+            raise ValueError("请求体不是合法的JSON")
+        raw = data.get("items") if isinstance(data, dict) else data
+        if not isinstance(raw, list):
+            raise ValueError("请求体应为包含items数组的对象或JSON数组")
+
+    items = []
+    for index, entry in enumerate(raw):
+        if not isinstance(entry, dict):
+            raise ValueError(f"第{index}项应为JSON对象")
+        message = entry.get("message")
+        if not isinstance(message, str) or not message:
+            raise ValueError(f"第{index}项缺少message")
+        items.append(BatchItem(
+            index,
+            message,
+            str(entry.get("session_id", "default")),
+            str(entry.get("userHost", "unknown")),
+            entry.get("id")
+        ))
+    return items
+
+async def run_batch(items: List[BatchItem], run_item: Callable[[BatchItem], Awaitable[dict]],
+                    parallelism: int = DEFAULT_PARALLELISM):
+    """
+    并发执行批量对话，按完成顺序逐个产出结果
+
+    同一会话的各项按输入顺序依次执行（后一项的上下文包含前一项的回答），
+    不同会话之间最多parallelism个同时执行。生成器被关闭时（例如客户端断开）取消尚未完成的项。
+
+    参数:
+        run_item: 执行一项并返回结果的函数，应自行处理错误；抛出的异常会转换为错误结果
+        parallelism: 同时执行的会话数上限
+    """
+    groups = OrderedDict()
+    for item in items:
+        groups.setdefault(item.session_key, []).append(item)
+    pending = deque(groups.values())
+    results = asyncio.Queue()
+
+    async def worker():
+        while pending:
+            for item in pending.popleft():
+                try:
+                    result = await run_item(item)
+                except Exception as e:
+                    logger.error(f"批量对话第{item.index}项执行失败: {str(e)}")
+                    result = item.result(status="error", message=str(e) or type(e).__name__)
+                results.put_nowait(result)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(max(parallelism, 1), len(pending)))]
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+class BatchJob:
+    """
+    一个后台批量对话任务的状态和结果
+    """
+
+    def __init__(self, total: int, parallelism: int):
+        self.job_id = uuid.uuid4().hex
+        self.total = total
+        self.parallelism = parallelism
+        self.status = "pending"
+        self.succeeded = 0
+        self.failed = 0
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        # 按完成顺序排列的结果
+        self.results = []
+        # 已写入Redis的结果数
+        self.saved = 0
+
+    @property
+    def completed(self) -> int:
+        return len(self.results)
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "total": self.total,
+            "completed": self.completed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "parallelism": self.parallelism,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+class BatchJobManager:
+    """
+    后台批量对话任务
+
+    输入过大、不适合保持一个流式连接的批量请求作为后台任务执行，客户端按偏移量分页拉取结果。
+    结果和状态保存在执行任务的进程内（保留最近MAX_JOB_HISTORY个已结束的任务和全部执行中的任务），同时按批追加到Redis
+    （每save_batch条或每save_interval秒一次管道提交），多个工作进程时由其他进程处理的查询也能读到。
+    """
+
+    def __init__(self, max_history: int = MAX_JOB_HISTORY, save_batch: int = DEFAULT_SAVE_BATCH,
+                 save_interval: float = DEFAULT_SAVE_INTERVAL):
+        self.max_history = max_history
+        self.save_batch = max(save_batch, 1)
+        self.save_interval = save_interval
+        self.jobs = OrderedDict()
+        self._tasks = {}
+
+    def start(self, items: List[BatchItem], run_item: Callable[[BatchItem], Awaitable[dict]],
+              parallelism: int = DEFAULT_PARALLELISM, get_client: Callable = lambda: None) -> BatchJob:
+        """
+        启动一个后台任务并立即返回任务对象
+
+        参数:
+            get_client: 返回当前Redis客户端的函数（Redis不可用时返回None，结果只保存在进程内）
+        """
+        job = BatchJob(len(items), parallelism)
+        self.jobs[job.job_id] = job
+        self._trim()
+        task = asyncio.create_task(self._run(job, items, run_item, get_client))
+        self._tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.job_id, None))
+        return job
+
+    def _trim(self):
+        # 只淘汰已结束的任务（结果仍可从Redis读取）；执行中的任务不淘汰，否则无法再查询和取消
+        excess = len(self.jobs) - self.max_history
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished_at is not None][:excess]:
+            del self.jobs[job_id]
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        取消本进程中正在执行的任务，已完成的项保留
+
+        返回:
+            任务是否由本进程执行且尚未结束
+        """
+        task = self._tasks.get(job_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    async def _load(self, job_id: str, redis_client) -> Optional[dict]:
+        if redis_client is None:
+            return None
+        value = await redis_client.get(JOB_KEY_PREFIX + job_id)
+        return json.loads(value) if value is not None else None
+
+    async def aget_status(self, job_id: str, redis_client=None) -> Optional[dict]:
+        """
+        查询任务状态，本进程中没有时从Redis读取（任务可能由其他工作进程执行）
+        """
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return await self._load(job_id, redis_client)
+
+    async def aget_results(self, job_id: str, offset: int = 0, limit: int = 100,
+                           redis_client=None) -> Optional[List[dict]]:
+        """
+        按完成顺序分页读取任务结果
+
+        返回:
+            结果列表，任务不存在时返回None
+        """
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.results[offset:offset + limit]
+        if await self._load(job_id, redis_client) is None:
+            return None
+        values = await redis_client.lrange(RESULTS_KEY_PREFIX + job_id, offset, offset + limit - 1)
+        return [json.loads(value) for value in values]
+
+    async def _save(self, job: BatchJob, redis_client):
+        if redis_client is None:
+            return
+        results = job.results[job.saved:]
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                if results:
+                    key = RESULTS_KEY_PREFIX + job.job_id
+                    pipe.rpush(key, *(json.dumps(result, ensure_ascii=False) for result in results))
+                    pipe.expire(key, JOB_STATUS_TTL)
+                pipe.set(JOB_KEY_PREFIX + job.job_id, json.dumps(job.to_dict(), ensure_ascii=False),
+                         ex=JOB_STATUS_TTL)
+                await pipe.execute()
+            job.saved += len(results)
+        except Exception as e:
+            logger.warning(f"保存批量任务 {job.job_id} 的结果失败: {str(e) or type(e).__name__}")
+
+    async def _run(self, job: BatchJob, items: List[BatchItem], run_item, get_client: Callable):
+        job.status = "running"
+        logger.info("开始批量对话任务 %s，共 %s 项，并发 %s", job.job_id, job.total, job.parallelism)
+        await self._save(job, get_client())
+        last_save = time.monotonic()
+        try:
+            async for result in run_batch(items, run_item, job.parallelism):
+                job.results.append(result)
+                if result.get("status") == "success":
+                    job.succeeded += 1
+                else:
+                    job.failed += 1
+                if job.completed - job.saved >= self.save_batch or time.monotonic() - last_save >= self.save_interval:
+                    await self._save(job, get_client())
+                    last_save = time.monotonic()
+            job.status = "done"
+            logger.info("批量对话任务 %s 完成，成功 %s 项，失败 %s 项", job.job_id, job.succeeded, job.failed)
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            logger.info("批量对话任务 %s 已取消，已完成 %s 项", job.job_id, job.completed)
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"批量对话任务 {job.job_id} 失败: {str(e)}")
+        finally:
+            job.finished_at = time.time()
+            await self._save(job, get_client())
+            self._trim()
+
+    def stats(self) -> dict:
+        """返回进程内任务的数量"""
+        return {
+            "jobs": len(self.jobs),
+            "running": len(self._tasks)
+        }
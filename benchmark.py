@@ -0,0 +1,554 @@
+"""
+对话服务的压测与基准测试
+
+默认在进程内启动模拟的OpenAI兼容服务（stub_llm_server）和对话服务（main.app），以指定并发驱动
+/chat、/history、/redis-data，输出可在不同提交之间比较的JSON结果。Redis可以使用内存中的
+fakeredis（默认，需要安装fakeredis）、本地Redis（--redis-url），或者不使用Redis（--redis none，本地模式）。
+
+用法:
+    python benchmark.py --output before.json
+    python benchmark.py --scenarios long_sessions,short_sessions --concurrency 32 --output after.json --compare before.json
+    python benchmark.py --redis-url redis://127.0.0.1:6379/0 --keys 100000
+    python benchmark.py --target http://127.0.0.1:8000 --redis-url redis://127.0.0.1:6379/0
+
+场景:
+    long_sessions: concurrency个会话并发，每个会话连续进行--long-turns轮对话
+    short_sessions: 共--short-sessions个会话，每个会话--short-turns轮，以concurrency并发
+    history_polling: 预先写入--history-size条消息的会话，并发轮询 GET /history（每次返回完整一页）
+    history_polling_etag: 同上，客户端携带If-None-Match（大多命中304）
+    redis_data: 预先写入--keys个键，每个并发客户端用游标分页遍历一次 GET /redis-data
+
+每个场景输出吞吐量、延迟（p50/p95/p99）、/chat的首token延迟、每个请求的Redis往返次数
+（来自/metrics中redis_command_duration_seconds的计数）以及服务进程的常驻内存。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+# 基准测试使用的user_host，数据清理时只删除该用户的会话
+BENCH_USER_HOST = "bench"
+# redis_data场景预先写入的键的前缀
+BENCH_KEY_PREFIX = "bench:key:"
+
+SCENARIOS = ("long_sessions", "short_sessions", "history_polling", "history_polling_etag", "redis_data")
+
+# 比较结果时列出的指标：(路径, 是否越大越好)
+COMPARED_METRICS = (
+    ("throughput_rps", True),
+    ("latency.p50", False),
+    ("latency.p95", False),
+    ("latency.p99", False),
+    ("ttft.p50", False),
+    ("ttft.p95", False),
+    ("redis_round_trips_per_request", False),
+    ("rss_mb", False),
+)
+
+def percentiles(samples: List[float]) -> Optional[dict]:
+    """
+    计算样本的分位数（最近秩法）
+
+    返回:
+        包含count、mean、p50、p95、p99、max（毫秒）的字典，没有样本时返回None
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50": round(rank(0.50) * 1000, 3),
+        "p95": round(rank(0.95) * 1000, 3),
+        "p99": round(rank(0.99) * 1000, 3),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+def parse_metrics(text: str) -> Dict[str, float]:
+    """
+    从Prometheus文本中读取基准测试需要的几个值（同名指标的各标签取和）
+    """
+    wanted = {
+        "redis_command_duration_seconds_count": "redis_round_trips",
+        "process_resident_memory_bytes": "rss_bytes",
+        "process_max_resident_memory_bytes": "max_rss_bytes",
+    }
+    values = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name_part, _, value = line.rpartition(" ")
+        name = name_part.split("{", 1)[0]
+        if name in wanted:
+            values[wanted[name]] = values.get(wanted[name], 0.0) + float(value)
+    return values
+
+def git_revision() -> Optional[str]:
+    """返回当前提交（工作区有改动时加上-dirty），不在git仓库中时返回None"""
+    try:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=directory, capture_output=True,
+                              text=True, timeout=5, check=True).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+class Recorder:
+    """收集一个场景中每个请求的耗时和结果"""
+
+    def __init__(self):
+        self.latencies = []
+        self.ttfts = []
+        self.errors = 0
+        self.statuses = {}
+
+    def add(self, latency: float, status: int, ok: bool = True, ttft: Optional[float] = None):
+        self.latencies.append(latency)
+        if ttft is not None:
+            self.ttfts.append(ttft)
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if not ok:
+            self.errors += 1
+
+class Benchmark:
+    """
+    基准测试的执行器
+
+    参数:
+        client: 指向对话服务的httpx.AsyncClient
+        args: 命令行参数
+        seed_client: 用于预先写入数据的同步Redis客户端，None时在本地模式下写入进程内存储
+    """
+
+    def __init__(self, client, args, seed_client=None):
+        self.client = client
+        self.args = args
+        self.seed_client = seed_client
+        self.run_id = f"{int(time.time())}{random.randint(0, 9999):04d}"
+
+    async def scrape(self) -> Dict[str, float]:
+        response = await self.client.get("/metrics")
+        response.raise_for_status()
+        return parse_metrics(response.text)
+
+    async def run(self, name: str) -> dict:
+        """执行一个场景并汇总结果"""
+        recorder = Recorder()
+        extra = await getattr(self, f"prepare_{name}")()
+        if extra.get("skipped"):
+            return extra
+        before = await self.scrape()
+        started = time.perf_counter()
+        await getattr(self, f"scenario_{name}")(recorder, extra)
+        elapsed = time.perf_counter() - started
+        after = await self.scrape()
+
+        requests = len(recorder.latencies)
+        round_trips = after.get("redis_round_trips", 0.0) - before.get("redis_round_trips", 0.0)
+        result = {
+            "requests": requests,
+            "errors": recorder.errors,
+            "statuses": recorder.statuses,
+            "duration_s": round(elapsed, 3),
+            "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+            "latency": percentiles(recorder.latencies),
+            "ttft": percentiles(recorder.ttfts),
+            "redis_round_trips_per_request": round(round_trips / requests, 2) if requests else None,
+            "rss_mb": round(after["rss_bytes"] / 2 ** 20, 1) if "rss_bytes" in after else None,
+            "max_rss_mb": round(after["max_rss_bytes"] / 2 ** 20, 1) if "max_rss_bytes" in after else None,
+        }
+        result.update({key: value for key, value in extra.items() if not key.startswith("_")})
+        return result
+
+    async def gather(self, workers: int, worker):
+        """以workers个并发协程执行worker(index)"""
+        await asyncio.gather(*(worker(index) for index in range(workers)))
+
+    # ---- 对话 ----
+
+    async def chat_turn(self, recorder: Recorder, session_id: str, message: str):
+        """发送一轮对话并读完SSE流，记录首个事件帧的延迟和总耗时"""
+        body = {"message": message, "session_id": session_id, "userHost": BENCH_USER_HOST, "no_cache": True}
+        start = time.perf_counter()
+        ttft = None
+        ok = True
+        status = 0
+        try:
+            async with self.client.stream("POST", "/chat", json=body) as response:
+                status = response.status_code
+                async for line in response.aiter_lines():
+                    if line.startswith("data:"):
+                        if ttft is None:
+                            ttft = time.perf_counter() - start
+                        if line.startswith("data: [ERROR]"):
+                            ok = False
+            ok = ok and status == 200
+        except Exception:
+            ok = False
+        recorder.add(time.perf_counter() - start, status, ok, ttft)
+
+    async def chat_sessions(self, recorder: Recorder, sessions: int, turns: int, prefix: str):
+        queue = asyncio.Queue()
+        for index in range(sessions):
+            queue.put_nowait(f"{prefix}-{self.run_id}-{index}")
+
+        async def worker(_):
+            while not queue.empty():
+                session_id = queue.get_nowait()
+                for turn in range(turns):
+                    await self.chat_turn(recorder, session_id, f"第{turn + 1}个问题：{session_id}")
+
+        await self.gather(min(self.args.concurrency, sessions), worker)
+
+    async def prepare_long_sessions(self) -> dict:
+        return {"sessions": self.args.concurrency, "turns": self.args.long_turns}
+
+    async def scenario_long_sessions(self, recorder: Recorder, extra: dict):
+        await self.chat_sessions(recorder, extra["sessions"], extra["turns"], "long")
+
+    async def prepare_short_sessions(self) -> dict:
+        return {"sessions": self.args.short_sessions, "turns": self.args.short_turns}
+
+    async def scenario_short_sessions(self, recorder: Recorder, extra: dict):
+        await self.chat_sessions(recorder, extra["sessions"], extra["turns"], "short")
+
+    # ---- 历史记录 ----
+
+    def seed_history(self, session_ids: List[str], size: int) -> bool:
+        """
+        为每个会话直接写入size条消息（不经过模型），返回是否写入成功
+        """
+        from langchain_core.messages import AIMessage, HumanMessage
+        from chat_history import encode_message, queue_append
+
+        messages = [HumanMessage(content=f"历史问题 {i}") if i % 2 == 0 else AIMessage(content=f"历史回答 {i} " * 8)
+                    for i in range(size)]
+        if self.seed_client is not None:
+            items = [encode_message(message) for message in messages]
+            pipe = self.seed_client.pipeline(transaction=False)
+            for session_id in session_ids:
+                for offset in range(0, len(items), 1000):
+                    queue_append(pipe, f"{BENCH_USER_HOST}_{session_id}", items[offset:offset + 1000],
+                                 user_host=BENCH_USER_HOST)
+            pipe.execute()
+            return True
+        if self.args.target is None:
+            import main
+            for session_id in session_ids:
+                main.local_store.append(f"{BENCH_USER_HOST}_{session_id}", messages)
+            return True
+        return False
+
+    async def prepare_history(self) -> dict:
+        session_ids = [f"history-{self.run_id}-{index}" for index in range(self.args.concurrency)]
+        if not self.seed_history(session_ids, self.args.history_size):
+            return {"skipped": "对外部服务压测时需要 --redis-url 才能预先写入历史记录"}
+        return {"sessions": len(session_ids), "history_size": self.args.history_size,
+                "page_size": self.args.history_page, "_session_ids": session_ids}
+
+    async def poll_history(self, recorder: Recorder, extra: dict, use_etag: bool):
+        async def worker(index):
+            session_id = extra["_session_ids"][index % len(extra["_session_ids"])]
+            params = {"session_id": session_id, "user_host": BENCH_USER_HOST, "limit": self.args.history_page}
+            etag = None
+            for _ in range(self.args.polls):
+                headers = {"If-None-Match": etag} if use_etag and etag else None
+                start = time.perf_counter()
+                try:
+                    response = await self.client.get("/history", params=params, headers=headers)
+                    status = response.status_code
+                    ok = status in (200, 304)
+                    etag = response.headers.get("etag", etag)
+                except Exception:
+                    status, ok = 0, False
+                recorder.add(time.perf_counter() - start, status, ok)
+
+        await self.gather(self.args.concurrency, worker)
+
+    async def prepare_history_polling(self) -> dict:
+        return await self.prepare_history()
+
+    async def scenario_history_polling(self, recorder: Recorder, extra: dict):
+        await self.poll_history(recorder, extra, use_etag=False)
+
+    async def prepare_history_polling_etag(self) -> dict:
+        return await self.prepare_history()
+
+    async def scenario_history_polling_etag(self, recorder: Recorder, extra: dict):
+        await self.poll_history(recorder, extra, use_etag=True)
+
+    # ---- 键空间遍历 ----
+
+    async def prepare_redis_data(self) -> dict:
+        if self.seed_client is None:
+            return {"skipped": "redis_data场景需要Redis（fakeredis或--redis-url）"}
+        prefix = f"{BENCH_KEY_PREFIX}{self.run_id}:"
+        pipe = self.seed_client.pipeline(transaction=False)
+        for index in range(self.args.keys):
+            pipe.set(f"{prefix}{index}", f"value-{index}")
+            if len(pipe) >= 1000:
+                pipe.execute()
+        pipe.execute()
+        return {"keys": self.args.keys, "page_size": self.args.redis_data_page, "_pattern": prefix + "*"}
+
+    async def scenario_redis_data(self, recorder: Recorder, extra: dict):
+        keys_seen = []
+
+        async def worker(_):
+            cursor = None
+            seen = 0
+            while cursor != 0:
+                params = {"pattern": extra["_pattern"], "cursor": cursor or 0, "count": self.args.redis_data_page,
+                          "max_keys": self.args.redis_data_page}
+                start = time.perf_counter()
+                try:
+                    response = await self.client.get("/redis-data", params=params)
+                    lines = [json.loads(line) for line in response.text.splitlines() if line]
+                    last = lines[-1] if lines else {}
+                    ok = response.status_code == 200 and "cursor" in last
+                    cursor = last.get("cursor", 0)
+                    seen += last.get("returned", 0)
+                    status = response.status_code
+                except Exception:
+                    status, ok, cursor = 0, False, 0
+                recorder.add(time.perf_counter() - start, status, ok)
+            keys_seen.append(seen)
+
+        started = time.perf_counter()
+        await self.gather(self.args.concurrency, worker)
+        elapsed = time.perf_counter() - started
+        extra["keys_per_second"] = round(sum(keys_seen) / elapsed, 1) if elapsed else 0.0
+        extra["keys_returned"] = sum(keys_seen)
+
+def compare(results: dict, baseline: dict) -> str:
+    """
+    将本次结果与基线逐项比较，返回文本表格（变化为相对基线的百分比，标注变好或变差）
+    """
+    def lookup(data: dict, path: str):
+        for part in path.split("."):
+            if not isinstance(data, dict):
+                return None
+            data = data.get(part)
+        return data
+
+    lines = [f"基线: {baseline.get('meta', {}).get('git')}  本次: {results['meta'].get('git')}"]
+    old_config = baseline.get("meta", {}).get("config", {})
+    changed = sorted(key for key, value in results["meta"]["config"].items() if old_config.get(key) != value)
+    if changed:
+        lines.append(f"注意: 两次运行的参数不同（{', '.join(changed)}），结果可能不可比")
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous or current.get("skipped") or previous.get("skipped"):
+            continue
+        lines.append(f"[{name}]")
+        for path, higher_is_better in COMPARED_METRICS:
+            old, new = lookup(previous, path), lookup(current, path)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            verdict = ""
+            if abs(change) >= 5:
+                verdict = "变好" if (change > 0) == higher_is_better else "变差"
+            lines.append(f"  {path:<32} {old:>12} -> {new:<12} {change:+7.1f}% {verdict}")
+    return "\n".join(lines)
+
+def configure_environment(args, llm_base: str):
+    """
+    在导入main之前设置进程内对话服务的环境变量（已显式设置的保持不变）
+    """
+    os.environ["OPENAI_API_BASE"] = llm_base
+    os.environ.pop("LLM_ENDPOINTS", None)
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # 写入缓冲只保存在内存中，避免不同次运行之间相互影响
+    os.environ.setdefault("REDIS_WRITE_BUFFER_PATH", "")
+    os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    if args.redis_url:
+        url = urlparse(args.redis_url)
+        os.environ["REDIS_HOST"] = url.hostname or "127.0.0.1"
+        os.environ["REDIS_PORT"] = str(url.port or 6379)
+        os.environ["REDIS_USERNAME"] = url.username or ""
+        if url.password:
+            os.environ["REDIS_PASSWORD"] = url.password
+        os.environ["REDIS_DB"] = url.path.lstrip("/") or "0"
+    elif args.redis == "none":
+        # 连接一个不会监听的端口，熔断器保持打开，服务以本地模式运行
+        os.environ["REDIS_HOST"] = "127.0.0.1"
+        os.environ["REDIS_PORT"] = "1"
+        os.environ["REDIS_PROBE_TIMEOUT"] = "0.2"
+
+def create_seed_client(args):
+    """
+    创建预先写入数据使用的同步Redis客户端；使用fakeredis时同时让对话服务连接同一个内存实例
+
+    返回:
+        同步Redis客户端，本地模式时返回None
+    """
+    if args.redis_url:
+        import redis
+        return redis.Redis.from_url(args.redis_url, decode_responses=True)
+    if args.redis == "none":
+        return None
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit("--redis fake 需要安装fakeredis（pip install fakeredis），或使用 --redis-url / --redis none")
+    if args.target:
+        raise SystemExit("对外部服务压测时请使用 --redis-url 指定该服务使用的Redis")
+
+    import redis_pool
+
+    server = fakeredis.FakeServer()
+    redis_pool.create_redis_pool = lambda: fakeredis.FakeAsyncRedis(server=server, decode_responses=True).connection_pool
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+def cleanup(seed_client):
+    """删除基准测试写入真实Redis的会话和键"""
+    from chat_history import USER_SESSIONS_KEY_PREFIX
+    from redis_cleanup import queue_delete_sessions
+
+    deleted = 0
+    # 基准测试的会话记录在bench用户的会话索引中（按前缀匹配会误删userHost以"bench_"开头的其他用户）
+    index_key = USER_SESSIONS_KEY_PREFIX + BENCH_USER_HOST
+    session_ids = list(seed_client.sscan_iter(index_key, count=1000))
+    for offset in range(0, len(session_ids), 1000):
+        pipe = seed_client.pipeline(transaction=False)
+        queue_delete_sessions(pipe, session_ids[offset:offset + 1000], BENCH_USER_HOST)
+        deleted += pipe.execute()[0]
+    deleted += seed_client.unlink(index_key)
+    batch = []
+    for key in seed_client.scan_iter(match=BENCH_KEY_PREFIX + "*", count=1000):
+        batch.append(key)
+        if len(batch) >= 1000:
+            deleted += seed_client.unlink(*batch)
+            batch = []
+    if batch:
+        deleted += seed_client.unlink(*batch)
+    print(f"已清理 {deleted} 个基准测试键", file=sys.stderr)
+
+async def wait_ready(client, expect_redis: bool, timeout: float = 30.0):
+    """等待服务就绪（使用Redis时等到存储模式切换为redis）"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get("/health/ready")
+            body = response.json()
+            if response.status_code == 200 and (not expect_redis or body.get("storage_mode") == "redis"):
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.1)
+    raise SystemExit("等待对话服务就绪超时")
+
+async def run_benchmark(args, base_url: str, seed_client) -> dict:
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+        await wait_ready(client, expect_redis=seed_client is not None)
+        benchmark = Benchmark(client, args, seed_client)
+        results = {}
+        for name in args.scenarios:
+            print(f"运行场景 {name} ...", file=sys.stderr)
+            results[name] = await benchmark.run(name)
+        return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="对话服务的压测与基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"逗号分隔的场景，可选: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发客户端数")
+    parser.add_argument("--long-turns", type=int, default=20, help="long_sessions场景每个会话的轮数")
+    parser.add_argument("--short-sessions", type=int, default=200, help="short_sessions场景的会话数")
+    parser.add_argument("--short-turns", type=int, default=2, help="short_sessions场景每个会话的轮数")
+    parser.add_argument("--history-size", type=int, default=500, help="history_polling场景每个会话的消息数")
+    parser.add_argument("--history-page", type=int, default=50, help="每次GET /history的limit")
+    parser.add_argument("--polls", type=int, default=100, help="history_polling场景每个客户端的请求数")
+    parser.add_argument("--keys", type=int, default=20000, help="redis_data场景预先写入的键数")
+    parser.add_argument("--redis-data-page", type=int, default=500, help="每次GET /redis-data的count和max_keys")
+    parser.add_argument("--ttft", type=float, default=0.05, help="模拟模型的首token延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="模拟模型的输出速度")
+    parser.add_argument("--reply-tokens", type=int, default=40, help="模拟模型每次回答的token数")
+    parser.add_argument("--redis", choices=("fake", "none"), default="fake",
+                        help="未指定--redis-url时：fake使用内存中的fakeredis，none不使用Redis（本地模式）")
+    parser.add_argument("--redis-url", help="使用真实Redis，例如 redis://127.0.0.1:6379/0（结束时删除基准测试写入的键）")
+    parser.add_argument("--keep-data", action="store_true", help="结束时保留写入真实Redis的数据")
+    parser.add_argument("--target", help="对已运行的服务压测（例如 http://127.0.0.1:8000），此时不启动进程内服务")
+    parser.add_argument("--request-timeout", type=float, default=120.0, help="单个请求的超时秒数")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    parser.add_argument("--output", help="结果JSON文件路径，不指定时输出到标准输出")
+    parser.add_argument("--compare", help="与之前保存的结果JSON比较")
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景: {', '.join(sorted(unknown))}")
+    args.concurrency = max(args.concurrency, 1)
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    servers = []
+    try:
+        if args.target:
+            base_url = args.target.rstrip("/")
+            seed_client = create_seed_client(args) if args.redis_url else None
+        else:
+            from stub_llm_server import create_app, make_reply, serve_in_thread
+
+            stub = create_app(ttft=args.ttft, token_interval=1.0 / max(args.tokens_per_second, 0.001),
+                              reply=make_reply(args.reply_tokens))
+            stub_server, stub_port = serve_in_thread(stub)
+            servers.append(stub_server)
+            configure_environment(args, f"http://127.0.0.1:{stub_port}/v1")
+            seed_client = create_seed_client(args)
+
+            import main as chat_server
+            app_server, app_port = serve_in_thread(chat_server.app)
+            servers.append(app_server)
+            base_url = f"http://127.0.0.1:{app_port}"
+
+        scenarios = asyncio.run(run_benchmark(args, base_url, seed_client))
+        if seed_client is not None and args.redis_url and not args.keep_data:
+            cleanup(seed_client)
+    finally:
+        for server in reversed(servers):
+            server.should_exit = True
+
+    results = {
+        "meta": {
+            "git": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": args.target or "in-process",
+            "redis": "url" if args.redis_url else args.redis,
+            "config": {key: value for key, value in vars(args).items()
+                       if key not in ("output", "compare", "redis_url", "target")},
+        },
+        "scenarios": scenarios,
+    }
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(results, json.load(f)), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,620 @@
+import asyncio
+import base64
+import json
+import time
+import weakref
+import zlib
+from typing import List, Optional, Sequence
+import redis
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, message_to_dict, messages_from_dict
+from logger_config import get_module_logger
+from token_counter import count_message_tokens, trim_to_token_budget
+from metrics import stage_timer, observe_stage, HISTORY_REHYDRATIONS
+
+# 获取模块日志记录器
+logger = get_module_logger("chat_history")
+
+# 与langchain的RedisChatMessageHistory保持一致的键前缀
+DEFAULT_KEY_PREFIX = "message_store:"
+
+# 会话版本号的键前缀，每次写入或清空时递增，用于ETag和缓存校验
+VERSION_KEY_PREFIX = "message_version:"
+
+# 归档会话的键前缀：空闲会话的整个消息列表压缩后保存为一个字符串
+ARCHIVE_KEY_PREFIX = "message_archive:"
+
+# 记录各会话最近写入时间的有序集合（成员为会话ID，分数为Unix时间），用于找出空闲会话
+ACTIVITY_KEY = "message_activity"
+
+# 每个用户的会话索引（集合，成员为会话ID），按用户删除会话时使用。会话ID为"{userHost}_{session_id}"，
+# userHost本身可能包含下划线，按前缀匹配会误删其他用户的会话
+USER_SESSIONS_KEY_PREFIX = "user_sessions:"
+
+# 按token预算读取最近消息时，每次LRANGE读取的消息条数
+DEFAULT_WINDOW_CHUNK = 32
+
+# 合并写入时每次MULTI最多包含的写入数，以及第一次写入到提交之间的最长等待（秒）
+DEFAULT_WRITE_BATCH = 100
+DEFAULT_WRITE_DELAY = 0.02
+
+# 紧凑格式的消息类型代码。紧凑格式为JSON数组 [类型代码, 内容, token数]，以"["开头，
+# 与旧格式（以"{"开头的完整message_to_dict JSON）可以共存于同一个列表中
+COMPACT_TYPE_CODES = {"human": "h", "ai": "a", "system": "s"}
+COMPACT_MESSAGE_CLASSES = {"h": HumanMessage, "a": AIMessage, "s": SystemMessage}
+COMPACT_TYPE_NAMES = {code: name for name, code in COMPACT_TYPE_CODES.items()}
+
+# 归档数据的格式标记（zlib压缩后base64编码，连接池使用decode_responses，值必须是文本）
+ARCHIVE_FORMAT_ZLIB = "z1:"
+
+def is_compact(item: str) -> bool:
+    """存储的条目是否为紧凑格式"""
+    return item.startswith("[")
+
+def encode_message(message: BaseMessage, tokens: Optional[int] = None, compact: bool = True) -> str:
+    """
+    序列化一条消息，并在写入时附带计算好的token数
+
+    compact为True时，没有额外字段的human/ai/system文本消息只保存类型、内容和token数；
+    其他消息（例如带工具调用的消息）仍使用完整的message_to_dict格式（tokens字段）
+    """
+    if tokens is None:
+        tokens = count_message_tokens(message)
+    if (compact and message.type in COMPACT_TYPE_CODES and isinstance(message.content, str)
+            and not message.additional_kwargs):
+        return json.dumps([COMPACT_TYPE_CODES[message.type], message.content, tokens],
+                          ensure_ascii=False, separators=(",", ":"))
+    data = message_to_dict(message)
+    data["tokens"] = tokens
+    return json.dumps(data)
+
+def decode_item(item: str):
+    """
+    反序列化一条存储的消息（紧凑格式或旧的完整JSON格式）
+
+    返回:
+        (消息对象, token数)，旧数据没有tokens字段时现场计算
+    """
+    data = json.loads(item)
+    if isinstance(data, list):
+        message = COMPACT_MESSAGE_CLASSES[data[0]](content=data[1])
+        tokens = data[2] if len(data) > 2 else None
+    else:
+        message = messages_from_dict([data])[0]
+        tokens = data.get("tokens")
+    if tokens is None:
+        tokens = count_message_tokens(message)
+    return message, tokens
+
+def parse_entry(item: str) -> Optional[dict]:
+    """
+    将一条存储的消息解析为前端使用的 {"type", "content"} 格式，无法识别时返回None
+    """
+    try:
+        data = json.loads(item)
+    except json.JSONDecodeError as e:
+        logger.warning(f"解析JSON消息失败: {str(e)}")
+        return None
+    if isinstance(data, list) and data and COMPACT_TYPE_NAMES.get(data[0]) in ('human', 'ai'):
+        return {"type": COMPACT_TYPE_NAMES[data[0]], "content": data[1]}
+    if isinstance(data, dict) and data.get('type') in ('human', 'ai'):
+        return {"type": data['type'], "content": data.get('data', {}).get('content', '')}
+    return None
+
+def encode_archive(items: List[str]) -> str:
+    """
+    将一个会话的全部存储条目（LRANGE 0 -1 的顺序）压缩为一个字符串
+    """
+    raw = json.dumps(items, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return ARCHIVE_FORMAT_ZLIB + base64.b64encode(zlib.compress(raw, 9)).decode("ascii")
+
+def decode_archive(blob: str) -> List[str]:
+    """
+    解压encode_archive的结果
+    """
+    if not blob.startswith(ARCHIVE_FORMAT_ZLIB):
+        raise ValueError("无法识别的归档格式")
+    return json.loads(zlib.decompress(base64.b64decode(blob[len(ARCHIVE_FORMAT_ZLIB):])).decode("utf-8"))
+
+# 递增会话版本号。版本号键不存在（新会话，或版本号随列表一起过期、被删除）时从当前时间（微秒）
+# 开始计数，而不是从1开始：同一会话的新版本号总是大于它以前任何一次存在期间的版本号，
+# 会话缓存和ETag使用的(版本号, 长度)不会与已删除的数据重复
+# KEYS: 版本号键；返回新的版本号
+_NEXT_VERSION_SCRIPT = """
+local version = redis.call('INCR', KEYS[1])
+if version == 1 then
+    local now = redis.call('TIME')
+    version = redis.call('INCRBY', KEYS[1], now[1] .. string.sub('000000' .. now[2], -6))
+end
+return version
+"""
+
+def queue_next_version(pipe, session_id: str):
+    """
+    向管道中加入递增会话版本号的命令（见_NEXT_VERSION_SCRIPT），结果为新的版本号
+    """
+    pipe.eval(_NEXT_VERSION_SCRIPT, 1, VERSION_KEY_PREFIX + session_id)
+
+def queue_append(pipe, session_id: str, items: List[str], ttl: Optional[int] = None,
+                 track_activity: bool = False, key_prefix: str = DEFAULT_KEY_PREFIX, user_host: Optional[str] = None):
+    """
+    向管道中加入一次写入的全部命令：LPUSH消息、递增版本号、刷新过期时间、记录写入时间和用户的会话索引
+
+    参数:
+        items: 按时间顺序排列的已序列化消息
+        track_activity: 是否在ACTIVITY_KEY中记录写入时间（启用空闲会话归档时需要）
+        user_host: 会话所属的用户，指定时将会话加入该用户的会话索引
+    """
+    key = key_prefix + session_id
+    version_key = VERSION_KEY_PREFIX + session_id
+    pipe.lpush(key, *items)
+    queue_next_version(pipe, session_id)
+    if ttl:
+        pipe.expire(key, ttl)
+        pipe.expire(version_key, ttl)
+    if track_activity:
+        pipe.zadd(ACTIVITY_KEY, {session_id: time.time()})
+    if user_host is not None:
+        index_key = USER_SESSIONS_KEY_PREFIX + user_host
+        pipe.sadd(index_key, session_id)
+        if ttl:
+            pipe.expire(index_key, ttl)
+
+class HistoryWriteBatcher:
+    """
+    将多个会话的历史写入合并为一次MULTI往返
+
+    写入先进入待提交队列，达到max_batch条或等待max_delay秒后在一个事务管道中提交，
+    每次写入的命令与单独写入时完全相同（见queue_append）。使用raise_on_error=False执行，
+    单个会话的命令出错只影响该次写入；连接失败或熔断时该批的所有写入都收到同一个异常，
+    由调用方按Redis故障处理。适合批量对话这类吞吐优先的场景，交互请求仍单独提交。
+    """
+
+    def __init__(self, max_batch: int = DEFAULT_WRITE_BATCH, max_delay: float = DEFAULT_WRITE_DELAY):
+        self.max_batch = max(max_batch, 1)
+        self.max_delay = max_delay
+        self._client = None
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self._stats = {"writes": 0, "batches": 0, "errors": 0}
+
+    async def asubmit(self, redis_client, session_id: str, items: List[str], ttl: Optional[int] = None,
+                      track_activity: bool = False, key_prefix: str = DEFAULT_KEY_PREFIX,
+                      user_host: Optional[str] = None):
+        """
+        提交一次写入并等待所在批次执行完成（参数同queue_append）
+
+        返回:
+            (写入后列表的长度, 写入后的版本号)
+        """
+        if self._pending and redis_client is not self._client:
+            # 连接池已重建，先提交旧客户端上的写入
+            self._flush()
+        future = asyncio.get_running_loop().create_future()
+        self._client = redis_client
+        self._pending.append((session_id, items, ttl, track_activity, key_prefix, user_host, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        # 写入在独立任务中提交，等待方被取消不影响同批的其他写入
+        task = asyncio.create_task(self._execute(self._client, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, redis_client, batch):
+        offsets = []
+        try:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                for session_id, items, ttl, track_activity, key_prefix, user_host, _ in batch:
+                    offsets.append(len(pipe))
+                    queue_append(pipe, session_id, items, ttl, track_activity, key_prefix, user_host)
+                results = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            self._stats["errors"] += len(batch)
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self._stats["batches"] += 1
+        self._stats["writes"] += len(batch)
+        for offset, (*_, future) in zip(offsets, batch):
+            length, version = results[offset], results[offset + 1]
+            if future.done():
+                continue
+            error = next((r for r in (length, version) if isinstance(r, Exception)), None)
+            if error is not None:
+                self._stats["errors"] += 1
+                future.set_exception(error)
+            else:
+                future.set_result((length, version))
+
+    def stats(self) -> dict:
+        """返回合并写入的次数和批次数"""
+        return {
+            "pending": len(self._pending),
+            "avg_batch_size": round(self._stats["writes"] / self._stats["batches"], 2) if self._stats["batches"] else 0,
+            **self._stats
+        }
+
+# 将归档的消息恢复到列表尾部（归档的消息都早于列表中已有的消息），并删除归档
+# KEYS: 消息列表、归档键、写入时间集合；ARGV: 读取到的归档内容、当前时间、会话ID、归档中的条目（最新在前）
+# 归档已被其他进程恢复或替换时不做任何修改，返回0
+_REHYDRATE_SCRIPT = """
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+    return 0
+end
+local ttl = redis.call('PTTL', KEYS[2])
+for i = 4, #ARGV, 1000 do
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+redis.call('DEL', KEYS[2])
+if ttl > 0 and redis.call('PTTL', KEYS[1]) < 0 then
+    redis.call('PEXPIRE', KEYS[1], ttl)
+end
+redis.call('ZADD', KEYS[3], ARGV[2], ARGV[3])
+return 1
+"""
+
+def trim_entries_to_budget(entries: list, token_budget: int) -> List[BaseMessage]:
+    """
+    从按时间顺序排列的 (消息, token数) 列表中，返回预算内的最近消息
+    """
+    kept = []
+    total = 0
+    for message, tokens in reversed(entries):
+        total += tokens
+        if total > token_budget:
+            break
+        kept.append(message)
+    kept.reverse()
+    return kept
+
+async def aget_context_messages(message_history: BaseChatMessageHistory, token_budget: Optional[int] = None) -> List[BaseMessage]:
+    """
+    获取发送给模型的上下文消息
+
+    参数:
+        message_history: 会话历史
+        token_budget: token预算，为None时返回全部历史
+
+    返回:
+        按时间顺序排列的消息
+    """
+    if token_budget is None:
+        return await message_history.aget_messages()
+    if hasattr(message_history, "aget_recent_messages"):
+        return await message_history.aget_recent_messages(token_budget)
+    return trim_to_token_budget(await message_history.aget_messages(), token_budget)
+
+# 同步接口使用的客户端只复制异步连接池的连接参数（异步连接的解析器、重试对象不能用于同步连接）
+_SYNC_CONNECTION_KWARGS = ("host", "port", "db", "username", "password", "socket_timeout", "socket_connect_timeout",
+                           "encoding", "decode_responses", "client_name")
+_sync_clients = weakref.WeakKeyDictionary()
+
+def sync_client_for(redis_client) -> redis.Redis:
+    """
+    返回与异步客户端连接同一个Redis的同步客户端，按异步连接池缓存
+    """
+    pool = redis_client.connection_pool
+    client = _sync_clients.get(pool)
+    if client is None:
+        kwargs = pool.connection_kwargs
+        client = _sync_clients[pool] = redis.Redis(
+            **{name: kwargs[name] for name in _SYNC_CONNECTION_KWARGS if name in kwargs})
+    return client
+
+class AsyncRedisChatMessageHistory(BaseChatMessageHistory):
+    """
+    基于redis.asyncio共享连接池的会话历史
+
+    使用LPUSH写入，列表头部为最新消息。每条消息默认以紧凑格式保存，compact为False时
+    使用与langchain_community的RedisChatMessageHistory兼容的message_to_dict JSON，两种格式均可读取。
+    空闲后被归档的会话（见history_archive）在下次读取时自动恢复为列表。
+
+    同步接口（messages、add_messages、clear）通过同步客户端执行相同的命令，供LangChain的同步调用链
+    和脚本使用；它们会阻塞事件循环，服务内部只使用异步接口。
+    """
+
+    def __init__(self, redis_client, session_id: str, key_prefix: str = DEFAULT_KEY_PREFIX, ttl: Optional[int] = None,
+                 cache=None, compact: bool = True, track_activity: bool = False, write_batcher=None,
+                 user_host: Optional[str] = None, sync_client=None):
+        self.redis_client = redis_client
+        # 同步接口使用的客户端，默认按异步客户端的连接参数创建
+        self.sync_client = sync_client
+        self.session_id = session_id
+        # 会话所属的用户，写入时维护该用户的会话索引
+        self.user_host = user_host
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+        self.compact = compact
+        # 是否记录写入时间，供空闲会话归档使用
+        self.track_activity = track_activity
+        # 可选的进程内会话缓存（SessionCache），读取时用版本号和长度校验
+        self.cache = cache
+        # 可选的合并写入器（HistoryWriteBatcher），设置后写入与其他会话的写入合并提交
+        self.write_batcher = write_batcher
+        # 最近一次写入后的会话版本号
+        self.version = None
+        # 最近一次读取的上下文消息的token数（使用写入时记录的token数，不重新计算）
+        self.context_tokens = None
+
+    @property
+    def key(self) -> str:
+        """Redis中存储该会话的键名"""
+        return self.key_prefix + self.session_id
+
+    @property
+    def version_key(self) -> str:
+        """Redis中存储该会话版本号的键名"""
+        return VERSION_KEY_PREFIX + self.session_id
+
+    @property
+    def archive_key(self) -> str:
+        """会话被归档后，Redis中存储压缩消息的键名"""
+        return ARCHIVE_KEY_PREFIX + self.session_id
+
+    async def arehydrate(self) -> bool:
+        """
+        将归档的会话恢复为消息列表（版本号不变，内容与归档前一致）
+
+        返回:
+            是否由本次调用完成恢复
+        """
+        blob = await self.redis_client.get(self.archive_key)
+        if blob is None:
+            return False
+        items = decode_archive(blob)
+        restored = await self.redis_client.eval(
+            _REHYDRATE_SCRIPT, 3, self.key, self.archive_key, ACTIVITY_KEY,
+            blob, time.time(), self.session_id, *items
+        )
+        if restored:
+            HISTORY_REHYDRATIONS.inc()
+            logger.info("已恢复归档的会话 %s，共 %s 条消息", self.session_id, len(items))
+        return bool(restored)
+
+    async def aget_state(self):
+        """
+        一次往返读取会话的列表长度和版本号，不读取消息内容（会话已归档时先恢复）
+
+        返回:
+            (列表长度, 版本号)，旧会话没有版本号时为0
+        """
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.llen(self.key)
+            pipe.get(self.version_key)
+            pipe.exists(self.archive_key)
+            length, version, archived = await pipe.execute()
+        if archived and await self.arehydrate():
+            return await self.aget_state()
+        return length, int(version or 0)
+
+    async def aget_items(self, start: int, end: int) -> List[str]:
+        """
+        按LRANGE下标读取原始存储条目（下标0为最新消息）
+        """
+        return await self.redis_client.lrange(self.key, start, end)
+
+    async def aget_entries(self, start: int, end: int) -> List[dict]:
+        """
+        按LRANGE下标区间返回前端格式的消息（下标0为最新消息，end包含在内）
+        """
+        entries = [parse_entry(item) for item in await self.aget_items(start, end)]
+        return [entry for entry in entries if entry is not None]
+
+    def _sync(self) -> redis.Redis:
+        if self.sync_client is None:
+            self.sync_client = sync_client_for(self.redis_client)
+        return self.sync_client
+
+    def rehydrate(self) -> bool:
+        """arehydrate的同步版本"""
+        client = self._sync()
+        blob = client.get(self.archive_key)
+        if blob is None:
+            return False
+        items = decode_archive(blob)
+        restored = client.eval(
+            _REHYDRATE_SCRIPT, 3, self.key, self.archive_key, ACTIVITY_KEY,
+            blob, time.time(), self.session_id, *items
+        )
+        if restored:
+            HISTORY_REHYDRATIONS.inc()
+            logger.info("已恢复归档的会话 %s，共 %s 条消息", self.session_id, len(items))
+        return bool(restored)
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """按时间顺序返回会话中的全部消息（同步读取，不经过会话缓存）"""
+        with self._sync().pipeline(transaction=True) as pipe:
+            pipe.lrange(self.key, 0, -1)
+            pipe.exists(self.archive_key)
+            items, archived = pipe.execute()
+        if archived and self.rehydrate():
+            return self.messages
+        return [decode_item(item)[0] for item in items[::-1]]
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """
+        同步追加消息，命令与aadd_messages相同（不经过合并写入器），写入后使会话缓存失效
+        """
+        if not messages:
+            return
+        encoded = [encode_message(m, count_message_tokens(m), self.compact) for m in messages]
+        with self._sync().pipeline(transaction=True) as pipe:
+            queue_append(pipe, self.session_id, encoded, self.ttl, self.track_activity, self.key_prefix,
+                         self.user_host)
+            results = pipe.execute()
+        self.version = results[1]
+        if self.cache is not None:
+            self.cache.invalidate(self.key)
+
+    def add_message(self, message: BaseMessage) -> None:
+        """同步追加一条消息"""
+        self.add_messages([message])
+
+    def clear(self) -> None:
+        """aclear的同步版本"""
+        with self._sync().pipeline(transaction=True) as pipe:
+            pipe.delete(self.key, self.archive_key)
+            queue_next_version(pipe, self.session_id)
+            pipe.zrem(ACTIVITY_KEY, self.session_id)
+            results = pipe.execute()
+        self.version = results[1]
+        if self.cache is not None:
+            self.cache.invalidate(self.key)
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        """按时间顺序返回会话中的全部消息"""
+        entries = await self.aget_cached_entries()
+        self.context_tokens = sum(tokens for _, tokens in entries)
+        return [message for message, _ in entries]
+
+    async def aget_cached_entries(self) -> list:
+        """
+        返回按时间顺序排列的 (消息, token数) 列表
+
+        启用缓存时先用一次LLEN + GET版本号往返校验缓存，命中则不读取列表；
+        未命中时在一个MULTI中读取完整列表和版本号并写入缓存。
+        """
+        if self.cache is not None:
+            with stage_timer("redis_lookup"):
+                length, version = await self.aget_state()
+            entries = self.cache.get(self.key, version, length)
+            if entries is not None:
+                return entries
+
+        with stage_timer("redis_lookup"):
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.lrange(self.key, 0, -1)
+                pipe.get(self.version_key)
+                pipe.exists(self.archive_key)
+                items, version, archived = await pipe.execute()
+        if archived and await self.arehydrate():
+            return await self.aget_cached_entries()
+        with stage_timer("history_decode"):
+            entries = [decode_item(item) for item in items[::-1]]
+        if self.cache is not None:
+            self.cache.put(self.key, int(version or 0), entries)
+        return list(entries)
+
+    async def aget_recent_messages(self, token_budget: int, chunk_size: int = DEFAULT_WINDOW_CHUNK) -> List[BaseMessage]:
+        """
+        只读取列表中最新的、总token数不超过预算的消息
+
+        列表头部为最新消息，从头部开始分段LRANGE，使用写入时记录的token数累加，
+        达到预算即停止，不会读取或重新计算整段历史。启用缓存时改为在校验后的
+        缓存消息上计算，稳定对话每轮只需一次校验往返。
+
+        参数:
+            token_budget: token预算
+            chunk_size: 每次LRANGE读取的条数
+
+        返回:
+            按时间顺序排列的消息
+        """
+        if self.cache is not None:
+            entries = await self.aget_cached_entries()
+            kept = trim_entries_to_budget(entries, token_budget)
+            self.context_tokens = sum(tokens for _, tokens in entries[len(entries) - len(kept):])
+            return kept
+
+        kept = []
+        total = 0
+        start = 0
+        # 分别累计Redis往返和反序列化的耗时
+        lookup_time = decode_time = 0.0
+        mark = time.perf_counter()
+        try:
+            while True:
+                if start == 0:
+                    # 读取第一段时顺带检查会话是否已归档
+                    async with self.redis_client.pipeline(transaction=False) as pipe:
+                        pipe.lrange(self.key, 0, chunk_size - 1)
+                        pipe.exists(self.archive_key)
+                        items, archived = await pipe.execute()
+                    if archived and await self.arehydrate():
+                        items = await self.redis_client.lrange(self.key, 0, chunk_size - 1)
+                else:
+                    items = await self.redis_client.lrange(self.key, start, start + chunk_size - 1)
+                now = time.perf_counter()
+                lookup_time += now - mark
+                mark = now
+                for item in items:
+                    message, tokens = decode_item(item)
+                    if total + tokens > token_budget:
+                        kept.reverse()
+                        return kept
+                    total += tokens
+                    kept.append(message)
+                now = time.perf_counter()
+                decode_time += now - mark
+                mark = now
+                if len(items) < chunk_size:
+                    break
+                start += chunk_size
+            kept.reverse()
+            return kept
+        finally:
+            self.context_tokens = total
+            observe_stage("redis_lookup", lookup_time)
+            observe_stage("history_decode", decode_time + time.perf_counter() - mark)
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> int:
+        """
+        追加消息（按时间顺序传入），LPUSH与EXPIRE在同一个MULTI事务中一次往返提交，
+        设置了write_batcher时与其他会话的写入合并在同一个事务中
+
+        返回:
+            写入后列表的长度
+        """
+        if not messages:
+            return 0
+        entries = [(m, count_message_tokens(m)) for m in messages]
+        encoded = [encode_message(m, tokens, self.compact) for m, tokens in entries]
+        if self.write_batcher is not None:
+            length, self.version = await self.write_batcher.asubmit(
+                self.redis_client, self.session_id, encoded, self.ttl, self.track_activity, self.key_prefix,
+                self.user_host)
+        else:
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                queue_append(pipe, self.session_id, encoded, self.ttl, self.track_activity, self.key_prefix,
+                             self.user_host)
+                results = await pipe.execute()
+            length, self.version = results[0], results[1]
+
+        # 在缓存的列表上原地追加
+        if self.cache is not None:
+            self.cache.append(self.key, self.version - 1, self.version, length - len(messages), entries)
+        return length
+
+    async def aadd_turn(self, user_message: BaseMessage, ai_message: BaseMessage) -> int:
+        """
+        一次性提交一轮对话的用户消息和AI响应
+
+        返回:
+            写入后列表的长度
+        """
+        return await self.aadd_messages([user_message, ai_message])
+
+    async def aclear(self) -> None:
+        """删除该会话的全部消息（包括归档），并递增版本号使已有的ETag和缓存失效"""
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(self.key, self.archive_key)
+            queue_next_version(pipe, self.session_id)
+            pipe.zrem(ACTIVITY_KEY, self.session_id)
+            results = await pipe.execute()
+        self.version = results[1]
+        if self.cache is not None:
+            self.cache.invalidate(self.key)
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+from logger_config import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("chat_socket")
+
+# 默认配置：服务端心跳间隔、客户端无任何消息后关闭连接的秒数、每个连接保留的会话数、会话上下文空闲回收秒数
+DEFAULT_HEARTBEAT_INTERVAL = 20.0
+DEFAULT_IDLE_TIMEOUT = 60.0
+DEFAULT_MAX_SESSIONS = 32
+DEFAULT_SESSION_IDLE = 600.0
+
+# 因空闲关闭连接时使用的关闭码（1001：going away）
+IDLE_CLOSE_CODE = 1001
+
+class SocketSession:
+    """
+    一个WebSocket连接中的会话上下文
+
+    会话键只在第一次使用时计算；会话历史对象在存储后端不变时跨轮复用（其中的版本号、
+    上下文token数和进程内会话缓存保持有效）；限流被拒绝后记录可重试的时间，
+    在此之前的消息直接在本地拒绝，不再访问Redis。
+    """
+
+    __slots__ = ("session_id", "user_host", "session_key", "message_history", "storage",
+                 "limited_until", "limit_name", "last_used", "active_turns")
+
+    def __init__(self, session_id: str, user_host: str):
+        self.session_id = session_id
+        self.user_host = user_host
+        # 与/chat接口相同的会话键
+        self.session_key = f"{user_host}_{session_id}"
+        self.message_history = None
+        # 创建message_history时的存储后端（Redis客户端，本地模式为None）
+        self.storage = None
+        self.limited_until = 0.0
+        self.limit_name = None
+        self.last_used = time.monotonic()
+        self.active_turns = 0
+
+    def history(self, storage, factory: Callable[[str, str], object]):
+        """
+        返回会话历史对象，存储后端变化（熔断切换、连接池重建）或尚未创建时用factory重新创建
+
+        参数:
+            storage: 当前的存储后端标识
+            factory: 按会话键和用户创建会话历史的函数
+        """
+        if self.message_history is None or storage is not self.storage:
+            self.message_history = factory(self.session_key, self.user_host)
+            self.storage = storage
+        return self.message_history
+
+    def retry_after(self) -> float:
+        """距离限流可重试还有多少秒，0表示未被限流"""
+        return max(0.0, self.limited_until - time.monotonic())
+
+class ChatSocket:
+    """
+    一个对话WebSocket连接的状态：多路复用的会话上下文、进行中的轮次和心跳
+
+    - 会话按(userHost, session_id)保存在连接内，最多max_sessions个，超出时回收最久未使用且
+      没有进行中轮次的会话；空闲超过session_idle秒的会话在心跳时回收
+    - 每轮对话在独立任务中执行，以turn_id标识，可以通过cancel按turn_id或(userHost, session_id)取消
+    - 每heartbeat_interval秒发送一次ping，客户端超过idle_timeout秒没有发送任何消息时关闭连接
+      并取消进行中的轮次
+    多个轮次并发发送帧，发送通过锁串行化。
+    """
+
+    def __init__(self, websocket, user_host: str = "unknown",
+                 heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 max_sessions: int = DEFAULT_MAX_SESSIONS, session_idle: float = DEFAULT_SESSION_IDLE):
+        self.websocket = websocket
+        self.user_host = user_host
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max(max_sessions, 1)
+        self.session_idle = session_idle
+        self.sessions = OrderedDict()
+        # turn_id -> (会话, 任务)
+        self.turns = {}
+        self.closed = False
+        # 是否因客户端长时间没有消息而被关闭
+        self.idle_closed = False
+        self.last_activity = time.monotonic()
+        self._send_lock = asyncio.Lock()
+        self._heartbeat = None
+
+    def start(self):
+        """启动心跳任务"""
+        if self._heartbeat is None and self.heartbeat_interval > 0:
+            self._heartbeat = asyncio.create_task(self._run_heartbeat())
+
+    async def send(self, frame: dict) -> bool:
+        """
+        发送一帧JSON，连接已关闭时忽略
+
+        返回:
+            是否已发送
+        """
+        if self.closed:
+            return False
+        try:
+            async with self._send_lock:
+                await self.websocket.send_text(json.dumps(frame, ensure_ascii=False))
+            return True
+        except Exception:
+            # 连接已断开，由接收循环负责清理
+            self.closed = True
+            return False
+
+    async def receive(self) -> Optional[dict]:
+        """
+        接收一帧JSON消息并记录活动时间
+
+        返回:
+            消息对象，无法解析时返回None（已向客户端发送错误）
+        """
+        text = await self.websocket.receive_text()
+        self.last_activity = time.monotonic()
+        try:
+            frame = json.loads(text)
+        except ValueError:
+            frame = None
+        if not isinstance(frame, dict):
+            await self.send({"type": "error", "message": "消息应为JSON对象"})
+            return None
+        return frame
+
+    def session(self, session_id: str, user_host: Optional[str] = None) -> Optional[SocketSession]:
+        """
+        返回会话上下文，不存在时创建
+
+        返回:
+            会话上下文，会话数已满且都有进行中的轮次时返回None
+        """
+        key = (user_host or self.user_host, session_id)
+        session = self.sessions.get(key)
+        if session is None:
+            if len(self.sessions) >= self.max_sessions and not self._evict():
+                return None
+            session = self.sessions[key] = SocketSession(session_id, key[0])
+        else:
+            self.sessions.move_to_end(key)
+        session.last_used = time.monotonic()
+        return session
+
+    def _evict(self) -> bool:
+        for key, session in self.sessions.items():
+            if not session.active_turns:
+                del self.sessions[key]
+                return True
+        return False
+
+    def start_turn(self, session: SocketSession, run: Callable[[str], Awaitable[None]],
+                   turn_id: Optional[str] = None) -> Optional[str]:
+        """
+        在后台任务中执行一轮对话
+
+        参数:
+            run: 接收turn_id、执行该轮并发送token帧的函数
+            turn_id: 客户端指定的轮次ID，默认自动生成
+
+        返回:
+            轮次ID，与进行中的轮次重复时返回None
+        """
+        turn_id = str(turn_id) if turn_id is not None else uuid.uuid4().hex[:12]
+        if turn_id in self.turns:
+            return None
+        session.active_turns += 1
+        session.last_used = time.monotonic()
+        task = asyncio.create_task(self._run_turn(session, turn_id, run))
+        self.turns[turn_id] = (session, task)
+        return turn_id
+
+    async def _run_turn(self, session: SocketSession, turn_id: str, run):
+        try:
+            await run(turn_id)
+        except asyncio.CancelledError:
+            await self.send({"type": "cancelled", "turn_id": turn_id, "session_id": session.session_id})
+        except Exception as e:
+            logger.error(f"WebSocket对话轮次 {turn_id} 出错: {str(e)}")
+            await self.send({"type": "error", "turn_id": turn_id, "session_id": session.session_id,
+                             "message": "处理您的请求时出现错误，请稍后再试。"})
+        finally:
+            session.active_turns -= 1
+            session.last_used = time.monotonic()
+            self.turns.pop(turn_id, None)
+
+    def cancel(self, turn_id: Optional[str] = None, session_id: Optional[str] = None,
+               user_host: Optional[str] = None) -> int:
+        """
+        取消进行中的轮次：按turn_id取消一轮，或按(userHost, session_id)取消该会话的全部轮次
+
+        参数:
+            user_host: 会话所属的用户，默认为连接的userHost（与session()相同）
+
+        返回:
+            取消的轮次数
+        """
+        key = (user_host or self.user_host, str(session_id))
+        cancelled = 0
+        for current_id, (session, task) in list(self.turns.items()):
+            if (turn_id is not None and current_id == str(turn_id)) or \
+                    (turn_id is None and session_id is not None and (session.user_host, session.session_id) == key):
+                task.cancel()
+                cancelled += 1
+        return cancelled
+
+    async def _run_heartbeat(self):
+        while not self.closed:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            if now - self.last_activity > self.idle_timeout:
+                logger.info("WebSocket连接超过 %s 秒没有消息，关闭连接", self.idle_timeout)
+                self.idle_closed = True
+                await self.close(IDLE_CLOSE_CODE)
+                return
+            for key, session in list(self.sessions.items()):
+                if not session.active_turns and now - session.last_used > self.session_idle:
+                    del self.sessions[key]
+            await self.send({"type": "ping"})
+
+    async def close(self, code: Optional[int] = None):
+        """
+        取消进行中的轮次并释放会话上下文；指定code时主动关闭连接
+        """
+        if self._heartbeat is not None and self._heartbeat is not asyncio.current_task():
+            self._heartbeat.cancel()
+        already_closed, self.closed = self.closed, True
+        for _, task in list(self.turns.values()):
+            task.cancel()
+        if self.turns:
+            await asyncio.gather(*(task for _, task in list(self.turns.values())), return_exceptions=True)
+        self.sessions.clear()
+        if code is not None and not already_closed:
+            try:
+                await self.websocket.close(code)
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        """返回连接内的会话数和进行中的轮次数"""
+        return {"sessions": len(self.sessions), "turns": len(self.turns)}
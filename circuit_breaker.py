@@ -0,0 +1,150 @@
+import asyncio
+import time
+from typing import Callable, List, Optional
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from logger_config import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("circuit_breaker")
+
+# 熔断器状态
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 默认配置：连续失败多少次后熔断、单次调用的超时秒数（0表示不限制）
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_CALL_TIMEOUT = 2.0
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，调用被直接拒绝"""
+
+def is_connection_failure(error: BaseException) -> bool:
+    """
+    判断异常是否表示依赖服务不可用（连接失败或超时）
+
+    命令本身的错误（例如WRONGTYPE）说明服务可达，不计入熔断
+    """
+    return isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError, OSError,
+                              RedisConnectionError, RedisTimeoutError))
+
+class CircuitBreaker:
+    """
+    依赖服务的熔断器
+
+    - closed: 正常调用，连续failure_threshold次连接失败或超时后转为open
+    - open: 直接抛出CircuitOpenError，不等待套接字超时
+    - half_open: 由后台探测任务发起一次试探，成功转为closed，失败回到open
+
+    状态变化时依次调用通过add_listener注册的回调 listener(old_state, new_state)。
+    初始状态为open（尚未确认服务可用），第一次探测成功后关闭。
+    """
+
+    def __init__(self, name: str, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 call_timeout: float = DEFAULT_CALL_TIMEOUT):
+        self.name = name
+        self.failure_threshold = max(failure_threshold, 1)
+        self.call_timeout = call_timeout
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.failures = 0
+        self._listeners: List[Callable[[str, str], None]] = []
+        self._stats = {"opened": 0, "closed": 0, "rejected": 0, "failures": 0, "timeouts": 0}
+
+    @property
+    def closed(self) -> bool:
+        return self.state == CLOSED
+
+    def add_listener(self, listener: Callable[[str, str], None]):
+        """注册状态变化回调"""
+        self._listeners.append(listener)
+
+    def _transition(self, state: str):
+        old = self.state
+        if old == state:
+            return
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self._stats["opened"] += 1
+        elif state == CLOSED:
+            self.failures = 0
+            self._stats["closed"] += 1
+        for listener in self._listeners:
+            try:
+                listener(old, state)
+            except Exception as e:
+                logger.error(f"熔断器 {self.name} 状态回调失败: {str(e)}")
+
+    def trip(self, reason: Optional[str] = None):
+        """立即熔断（例如健康检查失败）"""
+        if self.state != OPEN:
+            logger.warning("熔断器 %s 打开: %s", self.name, reason or "连续失败")
+        self._transition(OPEN)
+
+    def half_open(self):
+        """进入半开状态，开始一次试探"""
+        self._transition(HALF_OPEN)
+
+    def close(self):
+        """试探成功，恢复正常调用"""
+        if self.state != CLOSED:
+            logger.info("熔断器 %s 关闭，已断开 %.1f 秒", self.name, time.monotonic() - self.opened_at)
+        self._transition(CLOSED)
+
+    def record_success(self):
+        """记录一次成功调用，清零连续失败次数"""
+        self.failures = 0
+
+    def record_failure(self, error: Optional[BaseException] = None):
+        """记录一次连接失败或超时，连续失败达到阈值时熔断"""
+        self._stats["failures"] += 1
+        if not self.closed:
+            return
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.trip(f"连续 {self.failures} 次调用失败: {str(error) or type(error).__name__}" if error else None)
+
+    async def call(self, awaitable):
+        """
+        在熔断器保护下执行一次调用
+
+        参数:
+            awaitable: 待执行的协程
+
+        返回:
+            协程的结果；熔断器未关闭时抛出CircuitOpenError，超过call_timeout时抛出asyncio.TimeoutError
+        """
+        if not self.closed:
+            self._stats["rejected"] += 1
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise CircuitOpenError(f"{self.name} 熔断中")
+        try:
+            if self.call_timeout:
+                result = await asyncio.wait_for(awaitable, self.call_timeout)
+            else:
+                result = await awaitable
+        except asyncio.TimeoutError as e:
+            self._stats["timeouts"] += 1
+            self.record_failure(e)
+            raise
+        except Exception as e:
+            if is_connection_failure(e):
+                self.record_failure(e)
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> dict:
+        """返回熔断器状态和计数"""
+        return {
+            "state": self.state,
+            "open_for": time.monotonic() - self.opened_at if not self.closed else 0.0,
+            "consecutive_failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "call_timeout": self.call_timeout,
+            **self._stats
+        }
@@ -0,0 +1,265 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import uuid
+from typing import Callable, Dict, List, Optional
+from logger_config import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("cluster")
+
+# 默认的事件频道
+DEFAULT_CHANNEL = "gpt_server:events"
+# 领导者租约的键前缀
+LEASE_KEY_PREFIX = "leader:"
+# 订阅断开后重新订阅的退避（秒）
+DEFAULT_RECONNECT_BASE_DELAY = 1.0
+DEFAULT_RECONNECT_MAX_DELAY = 30.0
+# 读取订阅消息时的等待秒数（同时决定停止任务的响应时间）
+POLL_TIMEOUT = 1.0
+
+# 由本进程持有时续期，无人持有时获取
+_ACQUIRE_LEASE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if not current then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+_RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def current_node_id() -> str:
+    """返回当前工作进程的标识（主机名:进程号，fork之后重新计算）"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class ClusterBus:
+    """
+    基于Redis发布/订阅的工作进程间事件总线（同一台机器的多个工作进程和多台机器通用）
+
+    - publish(event_type, **data): 广播事件，其他进程按类型调用通过on注册的处理函数，
+      发送者自己不会收到（本地的处理由调用方直接完成）
+    - notify(topic) / wait(topic, timeout): 跨进程唤醒，用于会话锁释放、重复请求的结果发布等
+      原本需要轮询Redis的等待；wait超时后调用方照常轮询一次，消息丢失只会退化为轮询
+
+    每个进程使用一个专用的订阅连接，连接断开后按指数退避重新订阅，重新订阅成功时调用on_connect
+    （Redis恢复的信号，用于让连接管理器立即试探）。发布/订阅不保证送达，事件只能用作提示，
+    正确性仍由Redis中的数据（版本号、锁）保证。
+    """
+
+    def __init__(self, channel: str = DEFAULT_CHANNEL,
+                 base_delay: float = DEFAULT_RECONNECT_BASE_DELAY, max_delay: float = DEFAULT_RECONNECT_MAX_DELAY):
+        self.channel = channel
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.node_id = current_node_id()
+        self.connected = False
+        self._get_client = None
+        self._on_connect = None
+        self._handlers: Dict[str, List[Callable[[dict], None]]] = {}
+        self._waiters: Dict[str, set] = {}
+        self._task = None
+        self._pending = set()
+        self._stats = {"published": 0, "received": 0, "publish_errors": 0, "subscriptions": 0, "notifications": 0}
+
+    def on(self, event_type: str, handler: Callable[[dict], None]):
+        """注册其他进程广播的事件的处理函数"""
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    def start(self, get_client: Callable, on_connect: Optional[Callable[[], None]] = None):
+        """
+        启动订阅任务（在工作进程的事件循环中调用）
+
+        参数:
+            get_client: 返回当前Redis客户端的函数
+            on_connect: 每次订阅成功后调用
+        """
+        self.node_id = current_node_id()
+        self._get_client = get_client
+        self._on_connect = on_connect
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止订阅任务"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._pending):
+            task.cancel()
+
+    async def _run(self):
+        delay = self.base_delay
+        while True:
+            client = self._get_client()
+            if client is None:
+                await asyncio.sleep(self.base_delay)
+                continue
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                self.connected = True
+                self._stats["subscriptions"] += 1
+                delay = self.base_delay
+                logger.info("已订阅集群事件频道 %s（%s）", self.channel, self.node_id)
+                if self._on_connect is not None:
+                    self._on_connect()
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=POLL_TIMEOUT)
+                    if message is not None:
+                        self._dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.connected:
+                    logger.warning(f"集群事件订阅断开: {str(e) or type(e).__name__}")
+            finally:
+                self.connected = False
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            # 全抖动的指数退避，Redis恢复时各工作进程不会同时重新订阅
+            await asyncio.sleep(random.uniform(0, delay))
+            delay = min(self.max_delay, delay * 2)
+
+    def _dispatch(self, data: str):
+        try:
+            event = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        if event.get("origin") == self.node_id:
+            return
+        self._stats["received"] += 1
+        event_type = event.get("type")
+        payload = event.get("data") or {}
+        if event_type == "notify":
+            self._wake(payload.get("topic"))
+            return
+        for handler in self._handlers.get(event_type, ()):
+            try:
+                handler(payload)
+            except Exception as e:
+                logger.error(f"处理集群事件 {event_type} 失败: {str(e)}")
+
+    async def apublish(self, event_type: str, **data) -> bool:
+        """
+        广播一个事件，Redis不可用时放弃（只记录计数）
+
+        返回:
+            是否已发布
+        """
+        client = self._get_client() if self._get_client is not None else None
+        if client is None:
+            return False
+        message = json.dumps({"type": event_type, "origin": self.node_id, "data": data}, ensure_ascii=False)
+        try:
+            await client.publish(self.channel, message)
+        except Exception as e:
+            self._stats["publish_errors"] += 1
+            logger.debug(f"发布集群事件 {event_type} 失败: {str(e) or type(e).__name__}")
+            return False
+        self._stats["published"] += 1
+        return True
+
+    def publish(self, event_type: str, **data):
+        """在后台广播一个事件，不等待发布完成"""
+        task = asyncio.create_task(self.apublish(event_type, **data))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    def _wake(self, topic: Optional[str]):
+        for future in self._waiters.get(topic, ()):
+            if not future.done():
+                future.set_result(None)
+
+    def notify(self, topic: str):
+        """唤醒本进程和其他进程中等待topic的协程"""
+        self._stats["notifications"] += 1
+        self._wake(topic)
+        self.publish("notify", topic=topic)
+
+    async def wait(self, topic: str, timeout: float) -> bool:
+        """
+        等待topic的通知
+
+        返回:
+            收到通知返回True，超时返回False
+        """
+        future = asyncio.get_running_loop().create_future()
+        waiters = self._waiters.setdefault(topic, set())
+        waiters.add(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters.discard(future)
+            if not waiters:
+                self._waiters.pop(topic, None)
+
+    def stats(self) -> dict:
+        """返回订阅状态和消息计数"""
+        return {
+            "node": self.node_id,
+            "channel": self.channel,
+            "connected": self.connected,
+            "waiting_topics": len(self._waiters),
+            **self._stats
+        }
+
+class LeaderLease:
+    """
+    基于Redis的领导者租约，保证后台维护之类的任务在集群中同一时间只由一个工作进程执行
+
+    aacquire在未被持有时获取租约、由本进程持有时续期；持有者退出后租约在ttl秒后过期，
+    由其他进程接替。
+    """
+
+    def __init__(self, name: str, ttl: float):
+        self.key = LEASE_KEY_PREFIX + name
+        self.ttl = ttl
+        self.token = uuid.uuid4().hex
+        self.held = False
+        self._pid = os.getpid()
+
+    async def aacquire(self, redis_client) -> bool:
+        """
+        获取或续期租约
+
+        返回:
+            本进程当前是否持有租约
+        """
+        if self._pid != os.getpid():
+            # 预加载后fork的工作进程各自使用新的令牌
+            self.token = uuid.uuid4().hex
+            self.held = False
+            self._pid = os.getpid()
+        held = bool(await redis_client.eval(_ACQUIRE_LEASE_SCRIPT, 1, self.key, self.token, int(self.ttl * 1000)))
+        if held != self.held:
+            logger.info("%s租约 %s", "获得" if held else "失去", self.key)
+        self.held = held
+        return held
+
+    async def arelease(self, redis_client):
+        """主动释放租约（进程正常退出时调用，其他进程无需等待过期）"""
+        if self.held:
+            self.held = False
+            await redis_client.eval(_RELEASE_LEASE_SCRIPT, 1, self.key, self.token)
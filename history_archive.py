@@ -0,0 +1,239 @@
+import asyncio
+import time
+from typing import Callable
+from redis.exceptions import WatchError
+from logger_config import get_module_logger
+from chat_history import (DEFAULT_KEY_PREFIX, ARCHIVE_KEY_PREFIX, ACTIVITY_KEY, decode_item, encode_message,
+                          is_compact, encode_archive, decode_archive)
+
+# 获取模块日志记录器
+logger = get_module_logger("history_archive")
+
+# 默认配置
+DEFAULT_INTERVAL = 60.0
+DEFAULT_BATCH_SIZE = 100
+# 连续处理多批时，批次之间的间隔（秒），避免占满Redis
+DEFAULT_BATCH_PAUSE = 0.05
+
+def _size(items) -> int:
+    return sum(len(item.encode("utf-8")) for item in items)
+
+class HistoryMaintainer:
+    """
+    会话历史的后台维护任务
+
+    - 迁移（migrate=True）：用SCAN遍历一轮全部消息列表，含旧格式条目的列表在WATCH事务中
+      整体改写为紧凑格式，保留TTL，不修改版本号（内容不变，已有的ETag和会话缓存仍然有效）
+    - 归档（archive_idle_seconds>0）：从ACTIVITY_KEY中取出最近写入早于该时间的会话，
+      在WATCH事务中将整个列表压缩为一个字符串写入message_archive:{会话}并删除列表，
+      下次读取时由AsyncRedisChatMessageHistory自动恢复。启用归档时，遍历的同时为
+      还没有写入时间的旧会话补记当前时间。
+    两种改写期间若会话有新的写入，事务放弃，留到下一轮处理。
+    指定lease（cluster.LeaderLease）时，只有持有租约的工作进程执行维护。
+    """
+
+    def __init__(self, migrate: bool = False, archive_idle_seconds: int = 0, interval: float = DEFAULT_INTERVAL,
+                 batch_size: int = DEFAULT_BATCH_SIZE, batch_pause: float = DEFAULT_BATCH_PAUSE,
+                 key_prefix: str = DEFAULT_KEY_PREFIX, lease=None):
+        self.migrate = migrate
+        self.archive_idle_seconds = archive_idle_seconds
+        self.interval = interval
+        self.batch_size = max(batch_size, 1)
+        self.batch_pause = batch_pause
+        self.key_prefix = key_prefix
+        self.lease = lease
+        # 是否已完成一轮遍历（迁移旧格式、补记旧会话的写入时间）
+        self.scan_done = not (migrate or archive_idle_seconds > 0)
+        self._cursor = 0
+        self._task = None
+        self._stats = {
+            "scanned": 0,
+            "migrated_sessions": 0,
+            "migrated_bytes_before": 0,
+            "migrated_bytes_after": 0,
+            "archived_sessions": 0,
+            "archived_bytes_before": 0,
+            "archived_bytes_after": 0,
+            "conflicts": 0,
+            "errors": 0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.migrate or self.archive_idle_seconds > 0
+
+    def start(self, get_client: Callable, available: Callable[[], bool]):
+        """
+        启动后台任务
+
+        参数:
+            get_client: 返回当前Redis客户端的函数
+            available: Redis当前是否可用（熔断期间跳过本轮）
+        """
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run(get_client, available))
+
+    async def stop(self, redis_client=None):
+        """停止后台任务，持有租约时释放租约"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.lease is not None and redis_client is not None:
+            try:
+                await self.lease.arelease(redis_client)
+            except Exception as e:
+                logger.warning(f"释放维护任务租约失败: {str(e) or type(e).__name__}")
+
+    async def _run(self, get_client: Callable, available: Callable[[], bool]):
+        while True:
+            if available():
+                try:
+                    if self.lease is None or await self.lease.aacquire(get_client()):
+                        await self.arun_once(get_client())
+                except Exception as e:
+                    self._stats["errors"] += 1
+                    logger.warning(f"会话历史维护失败: {str(e) or type(e).__name__}")
+            await asyncio.sleep(self.interval)
+
+    async def arun_once(self, redis_client):
+        """
+        执行一轮维护：完成剩余的遍历，然后归档所有已空闲的会话
+        """
+        while not self.scan_done:
+            await self.ascan_batch(redis_client)
+            await asyncio.sleep(self.batch_pause)
+        if self.archive_idle_seconds > 0:
+            while await self.aarchive_idle(redis_client) >= self.batch_size:
+                await asyncio.sleep(self.batch_pause)
+
+    async def ascan_batch(self, redis_client) -> int:
+        """
+        遍历一批消息列表：迁移旧格式条目，并为没有写入时间的会话补记当前时间
+
+        返回:
+            本批迁移的会话数
+        """
+        self._cursor, keys = await redis_client.scan(self._cursor, match=self.key_prefix + "*",
+                                                     count=self.batch_size)
+        self._stats["scanned"] += len(keys)
+        migrated = 0
+        if self.migrate:
+            for key in keys:
+                if await self.amigrate_key(redis_client, key):
+                    migrated += 1
+        if self.archive_idle_seconds > 0 and keys:
+            now = time.time()
+            await redis_client.zadd(ACTIVITY_KEY, {key[len(self.key_prefix):]: now for key in keys}, nx=True)
+        if self._cursor == 0:
+            self.scan_done = True
+            logger.info("会话历史遍历完成，共迁移 %s 个会话，%s 字节 -> %s 字节",
+                        self._stats["migrated_sessions"], self._stats["migrated_bytes_before"],
+                        self._stats["migrated_bytes_after"])
+        return migrated
+
+    async def amigrate_key(self, redis_client, key: str) -> bool:
+        """
+        将一个消息列表中的旧格式条目改写为紧凑格式（无法解析或不适用紧凑格式的条目保持不变）
+
+        返回:
+            是否改写了该列表
+        """
+        async with redis_client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if await pipe.type(key) != "list":
+                    return False
+                items = await pipe.lrange(key, 0, -1)
+                if all(is_compact(item) for item in items):
+                    return False
+                converted = []
+                for item in items:
+                    if not is_compact(item):
+                        try:
+                            item = encode_message(*decode_item(item))
+                        except Exception:
+                            pass
+                    converted.append(item)
+                ttl = await pipe.pttl(key)
+                pipe.multi()
+                # 按LRANGE的顺序RPUSH，列表顺序不变
+                pipe.delete(key)
+                pipe.rpush(key, *converted)
+                if ttl > 0:
+                    pipe.pexpire(key, ttl)
+                await pipe.execute()
+            except WatchError:
+                self._stats["conflicts"] += 1
+                return False
+        self._stats["migrated_sessions"] += 1
+        self._stats["migrated_bytes_before"] += _size(items)
+        self._stats["migrated_bytes_after"] += _size(converted)
+        return True
+
+    async def aarchive_idle(self, redis_client) -> int:
+        """
+        归档一批空闲会话
+
+        返回:
+            本批检查的会话数（等于batch_size时说明可能还有更多空闲会话）
+        """
+        cutoff = time.time() - self.archive_idle_seconds
+        session_ids = await redis_client.zrangebyscore(ACTIVITY_KEY, "-inf", cutoff, start=0, num=self.batch_size)
+        for session_id in session_ids:
+            await self.aarchive_session(redis_client, session_id)
+        return len(session_ids)
+
+    async def aarchive_session(self, redis_client, session_id: str) -> bool:
+        """
+        将一个会话的消息列表压缩写入归档键并删除列表，保留TTL
+
+        已有未恢复的归档（例如归档后又有回放的写入）时，新消息与旧归档合并；
+        列表不存在（已过期或被删除）时只清除写入时间记录。
+
+        返回:
+            是否归档了该会话
+        """
+        key = self.key_prefix + session_id
+        archive_key = ARCHIVE_KEY_PREFIX + session_id
+        async with redis_client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key, archive_key)
+                items = await pipe.lrange(key, 0, -1)
+                if not items:
+                    pipe.multi()
+                    pipe.zrem(ACTIVITY_KEY, session_id)
+                    await pipe.execute()
+                    return False
+                previous = await pipe.get(archive_key)
+                if previous is not None:
+                    # 列表中的消息都晚于已归档的消息
+                    items = items + decode_archive(previous)
+                blob = encode_archive(items)
+                ttl = await pipe.pttl(key)
+                pipe.multi()
+                pipe.set(archive_key, blob, px=ttl if ttl > 0 else None)
+                pipe.delete(key)
+                pipe.zrem(ACTIVITY_KEY, session_id)
+                await pipe.execute()
+            except WatchError:
+                self._stats["conflicts"] += 1
+                return False
+        self._stats["archived_sessions"] += 1
+        self._stats["archived_bytes_before"] += _size(items)
+        self._stats["archived_bytes_after"] += len(blob)
+        logger.debug("已归档空闲会话 %s，共 %s 条消息", session_id, len(items))
+        return True
+
+    def stats(self) -> dict:
+        """返回迁移和归档统计"""
+        return {
+            "migrate": self.migrate,
+            "archive_idle_seconds": self.archive_idle_seconds,
+            "scan_done": self.scan_done,
+            "leader": self.lease.held if self.lease is not None else None,
+            **self._stats
+        }
@@ -0,0 +1,275 @@
+import asyncio
+import json
+import random
+import time
+from typing import List, Optional
+from logger_config import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("llm_router")
+
+# 默认配置
+DEFAULT_EWMA_ALPHA = 0.2
+DEFAULT_ERROR_PENALTY = 10.0
+DEFAULT_EXPLORE_RATIO = 0.05
+# 尚无延迟样本的端点使用的初始估计（秒）
+DEFAULT_INITIAL_LATENCY = 1.0
+
+def load_endpoint_config(raw: str) -> List[dict]:
+    """
+    解析上游端点配置（JSON列表）
+
+    每一项形如 {"name": "deepseek", "base_url": "https://api.deepseek.com/v1", "model": "deepseek-chat",
+    "api_key_env": "OPENAI_API_KEY", "weight": 1}，其中只有base_url是必填项
+
+    返回:
+        补全默认值后的端点配置列表
+    """
+    items = json.loads(raw)
+    if not isinstance(items, list) or not items:
+        raise ValueError("LLM_ENDPOINTS必须是非空的JSON列表")
+    endpoints = []
+    for index, item in enumerate(items):
+        if not item.get("base_url"):
+            raise ValueError(f"第{index + 1}个端点缺少base_url")
+        endpoints.append({
+            "name": item.get("name") or f"endpoint{index + 1}",
+            "base_url": item["base_url"],
+            "model": item.get("model", "deepseek-chat"),
+            "api_key": item.get("api_key"),
+            "api_key_env": item.get("api_key_env", "OPENAI_API_KEY"),
+            "weight": float(item.get("weight", 1.0))
+        })
+    return endpoints
+
+class Endpoint:
+    """
+    一个上游端点：模型客户端、权重，以及首token延迟和错误率的滑动平均（EWMA）
+    """
+
+    def __init__(self, name: str, llm, weight: float = 1.0, alpha: float = DEFAULT_EWMA_ALPHA):
+        self.name = name
+        self.llm = llm
+        self.weight = max(weight, 0.01)
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+
+    def record_latency(self, seconds: float):
+        """记录一次首token延迟（或被放弃前已等待的时间）"""
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self.alpha * (seconds - self.latency)
+
+    def record_result(self, error: bool):
+        """记录一次请求的成败"""
+        self.requests += 1
+        if error:
+            self.errors += 1
+        self.error_rate += self.alpha * ((1.0 if error else 0.0) - self.error_rate)
+
+    def score(self, error_penalty: float) -> float:
+        """
+        路由评分，越小越好：预估延迟按错误率放大、按权重缩小，并考虑进行中的请求数
+        """
+        latency = self.latency if self.latency is not None else DEFAULT_INITIAL_LATENCY
+        return latency * (1.0 + error_penalty * self.error_rate) * (1 + self.in_flight) / self.weight
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "weight": self.weight,
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors
+        }
+
+class LLMRouter:
+    """
+    多个OpenAI兼容端点之间的路由器，接口与ChatOpenAI的astream/ainvoke兼容
+
+    - 按每个端点的首token延迟和错误率EWMA选择评分最好的端点，少量请求按权重随机探索，
+      使出错或变慢的端点恢复后能重新被选中
+    - 首个token之前出错时自动切换到下一个端点（最多max_attempts个）
+    - hedge_after大于0时，若首个token在该时间内未到达，向另一个端点发起对冲请求，
+      先产出首个token的请求胜出，另一个被取消
+    """
+
+    def __init__(self, endpoints: List[Endpoint], hedge_after: float = 0.0, max_attempts: Optional[int] = None,
+                 error_penalty: float = DEFAULT_ERROR_PENALTY, explore_ratio: float = DEFAULT_EXPLORE_RATIO):
+        if not endpoints:
+            raise ValueError("至少需要一个上游端点")
+        self.endpoints = endpoints
+        self.hedge_after = hedge_after
+        self.max_attempts = max_attempts or len(endpoints)
+        self.error_penalty = error_penalty
+        self.explore_ratio = explore_ratio
+        self._stats = {"hedges": 0, "hedge_wins": 0, "failovers": 0}
+
+        # 供响应缓存键使用的模型参数
+        primary = endpoints[0].llm
+        self.model_name = ",".join(sorted({str(getattr(e.llm, "model_name", e.name)) for e in endpoints}))
+        self.temperature = getattr(primary, "temperature", None)
+        self.openai_api_base = "router"
+
+    def choose(self, exclude=()) -> Optional[Endpoint]:
+        """
+        选择下一个端点，exclude中的端点不参与选择
+        """
+        candidates = [e for e in self.endpoints if e not in exclude]
+        if not candidates:
+            return None
+        if len(candidates) > 1 and random.random() < self.explore_ratio:
+            return random.choices(candidates, weights=[e.weight for e in candidates])[0]
+        return min(candidates, key=lambda e: e.score(self.error_penalty))
+
+    async def ainvoke(self, input, **kwargs):
+        """
+        非流式调用：使用评分最好的端点，出错时切换到下一个端点
+        """
+        tried = []
+        while True:
+            endpoint = self.choose(tried)
+            tried.append(endpoint)
+            endpoint.in_flight += 1
+            start = time.monotonic()
+            try:
+                result = await endpoint.llm.ainvoke(input, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                endpoint.record_result(True)
+                if len(tried) >= self.max_attempts or self.choose(tried) is None:
+                    raise
+                self._stats["failovers"] += 1
+                logger.warning(f"端点 {endpoint.name} 调用失败，切换端点: {str(e)}")
+                continue
+            finally:
+                endpoint.in_flight -= 1
+            endpoint.record_latency(time.monotonic() - start)
+            endpoint.record_result(False)
+            return result
+
+    async def _first_chunk(self, endpoint: Endpoint, input, kwargs):
+        stream = endpoint.llm.astream(input, **kwargs).__aiter__()
+        try:
+            chunk = await stream.__anext__()
+        except StopAsyncIteration:
+            chunk = None
+        except BaseException:
+            await stream.aclose()
+            raise
+        return stream, chunk
+
+    async def _cancel(self, task):
+        task.cancel()
+        # asyncio.wait不抛出请求本身的异常，外层任务被取消时仍照常抛出CancelledError
+        await asyncio.wait([task])
+        if task.cancelled() or task.exception() is not None:
+            return
+        await task.result()[0].aclose()
+
+    async def astream(self, input, **kwargs):
+        """
+        流式调用：选出首个token最先到达的端点，之后只从该端点继续读取
+        """
+        tried = []
+        hedged = []
+        attempts = {}
+        winner = None
+        last_error = None
+        try:
+            try:
+                while winner is None:
+                    # 没有进行中的请求时启动下一个端点（首次请求或出错后切换）
+                    if not attempts:
+                        endpoint = self.choose(tried)
+                        if endpoint is None or len(tried) >= self.max_attempts:
+                            raise last_error or RuntimeError("没有可用的上游端点")
+                        if tried:
+                            self._stats["failovers"] += 1
+                            logger.warning(f"切换到端点 {endpoint.name}")
+                        tried.append(endpoint)
+                        endpoint.in_flight += 1
+                        attempts[asyncio.ensure_future(self._first_chunk(endpoint, input, kwargs))] = (endpoint, time.monotonic())
+
+                    # 只有一个请求在进行且允许对冲时，最多等待hedge_after秒
+                    hedge = (self.hedge_after > 0 and len(attempts) == 1 and len(tried) < self.max_attempts
+                             and self.choose(tried) is not None)
+                    done, _ = await asyncio.wait(attempts, timeout=self.hedge_after if hedge else None,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        endpoint = self.choose(tried)
+                        tried.append(endpoint)
+                        endpoint.in_flight += 1
+                        hedged.append(endpoint)
+                        self._stats["hedges"] += 1
+                        logger.info(f"首个token超过{self.hedge_after}秒未到达，向端点 {endpoint.name} 发起对冲请求")
+                        attempts[asyncio.ensure_future(self._first_chunk(endpoint, input, kwargs))] = (endpoint, time.monotonic())
+                        continue
+
+                    for task in done:
+                        endpoint, start = attempts.pop(task)
+                        endpoint.in_flight -= 1
+                        error = task.exception()
+                        if error is not None:
+                            endpoint.record_result(True)
+                            last_error = error
+                            logger.warning(f"端点 {endpoint.name} 请求失败: {str(error)}")
+                        elif winner is None:
+                            endpoint.record_latency(time.monotonic() - start)
+                            winner = (endpoint, task.result())
+                        else:
+                            # 两个请求同时产出首个token，多余的一个直接关闭
+                            await task.result()[0].aclose()
+            finally:
+                # 先从attempts中取出全部未完成的请求，同步扣减进行中的请求数并取消，再等待它们结束：
+                # 等待期间外层任务再次被取消时，每个端点也只扣减一次
+                losers, attempts = attempts, {}
+                for task, (endpoint, start) in losers.items():
+                    endpoint.in_flight -= 1
+                    if winner is not None:
+                        # 以已等待的时间作为落败请求的延迟样本
+                        endpoint.record_latency(time.monotonic() - start)
+                    task.cancel()
+                for task in losers:
+                    await self._cancel(task)
+        except BaseException:
+            # 已选出的胜者不再使用，关闭其流
+            if winner is not None:
+                await winner[1][0].aclose()
+            raise
+        if winner[0] in hedged:
+            self._stats["hedge_wins"] += 1
+
+        endpoint, (stream, chunk) = winner
+        endpoint.in_flight += 1
+        error = False
+        try:
+            if chunk is not None:
+                yield chunk
+                async for chunk in stream:
+                    yield chunk
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            endpoint.in_flight -= 1
+            endpoint.record_result(error)
+            await stream.aclose()
+
+    def stats(self) -> dict:
+        """返回各端点的延迟、错误率和对冲统计"""
+        return {
+            "hedge_after": self.hedge_after,
+            "endpoints": [e.stats() for e in self.endpoints],
+            **self._stats
+        }
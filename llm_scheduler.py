@@ -0,0 +1,276 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Optional
+from logger_config import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("llm_scheduler")
+
+# 默认配置
+DEFAULT_MAX_INFLIGHT = 16
+DEFAULT_MIN_INFLIGHT = 1
+DEFAULT_MAX_QUEUE_WAIT = 30.0
+DEFAULT_DECREASE_FACTOR = 0.5
+DEFAULT_DECREASE_COOLDOWN = 1.0
+# 批量请求最多占用的并发名额比例，其余名额留给交互请求
+DEFAULT_BATCH_SHARE = 0.5
+
+# 请求优先级：交互请求优先放行，批量请求只使用空闲且不超过batch_share的名额
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+class SchedulerTimeout(Exception):
+    """排队等待超过max_queue_wait仍未获得执行名额"""
+
+def parse_retry_after(value) -> Optional[float]:
+    """
+    解析Retry-After响应头（秒数），无法解析时返回None
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def classify_error(error: BaseException):
+    """
+    判断上游错误是否表示过载
+
+    返回:
+        (是否过载, Retry-After秒数)；429和超时视为过载
+    """
+    status_code = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status_code is None and response is not None:
+        status_code = getattr(response, "status_code", None)
+    if status_code == 429:
+        headers = getattr(response, "headers", None) or {}
+        return True, parse_retry_after(headers.get("retry-after"))
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)) or "Timeout" in type(error).__name__:
+        return True, None
+    return False, None
+
+class AdmissionScheduler:
+    """
+    上游模型调用的准入调度器
+
+    - 限制同时进行的补全数量，超出的请求进入队列
+    - 按user_host轮询出队，单个用户的突发请求不会饿死其他用户
+    - 排队超过max_queue_wait抛出SchedulerTimeout
+    - 自适应并发（AIMD）：遇到429或超时时按decrease_factor收缩，成功时逐步恢复到max_inflight；
+      上游返回Retry-After时在该时间内暂停放行
+    - 两级优先级：有交互请求排队时不放行批量请求，批量请求同时占用的名额不超过
+      当前上限的batch_share，新到的交互请求总有名额可用
+    """
+
+    def __init__(self, max_inflight: int = DEFAULT_MAX_INFLIGHT, min_inflight: int = DEFAULT_MIN_INFLIGHT,
+                 max_queue_wait: float = DEFAULT_MAX_QUEUE_WAIT, decrease_factor: float = DEFAULT_DECREASE_FACTOR,
+                 decrease_cooldown: float = DEFAULT_DECREASE_COOLDOWN, batch_share: float = DEFAULT_BATCH_SHARE):
+        self.max_inflight = max_inflight
+        self.min_inflight = min_inflight
+        self.max_queue_wait = max_queue_wait
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.batch_share = batch_share
+        self.limit = float(max_inflight)
+        self.in_flight = 0
+        self.batch_in_flight = 0
+        self.paused_until = 0.0
+        # 各优先级按user_host分组的等待队列
+        self._queues = {INTERACTIVE: OrderedDict(), BATCH: OrderedDict()}
+        self._queued = 0
+        self._batch_queued = 0
+        self._last_decrease = 0.0
+        self._resume_handle = None
+        self._stats = {
+            "admitted": 0,
+            "timeouts": 0,
+            "successes": 0,
+            "overloads": 0,
+            "errors": 0,
+            "cancelled": 0,
+            "total_wait": 0.0,
+            "max_wait": 0.0
+        }
+
+    @property
+    def capacity(self) -> int:
+        """当前允许的并发数"""
+        return max(self.min_inflight, int(self.limit))
+
+    @property
+    def batch_capacity(self) -> int:
+        """批量请求当前最多可占用的并发数（至少为1，避免批量请求被完全饿死）"""
+        return max(1, int(self.capacity * self.batch_share))
+
+    def _has_room(self, priority: str) -> bool:
+        if self.in_flight >= self.capacity:
+            return False
+        return priority != BATCH or self.batch_in_flight < self.batch_capacity
+
+    def _resume(self):
+        self._resume_handle = None
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        if now < self.paused_until:
+            if self._queued and self._resume_handle is None:
+                self._resume_handle = asyncio.get_running_loop().call_later(self.paused_until - now, self._resume)
+            return
+        while True:
+            if self._queues[INTERACTIVE] and self._has_room(INTERACTIVE):
+                priority = INTERACTIVE
+            elif self._queues[BATCH] and self._has_room(BATCH):
+                priority = BATCH
+            else:
+                break
+            # 轮询：取出队首用户的第一个等待者，该用户仍有等待者时放回队尾
+            queues = self._queues[priority]
+            user_host, waiters = queues.popitem(last=False)
+            future = waiters.popleft()
+            self._queued -= 1
+            if priority == BATCH:
+                self._batch_queued -= 1
+            if waiters:
+                queues[user_host] = waiters
+            if future.done():
+                continue
+            self.in_flight += 1
+            if priority == BATCH:
+                self.batch_in_flight += 1
+            future.set_result(None)
+
+    async def acquire(self, user_host: str, priority: str = INTERACTIVE, timeout: Optional[float] = None):
+        """
+        获取一个执行名额，必要时排队等待
+
+        参数:
+            priority: INTERACTIVE 或 BATCH
+            timeout: 最长排队秒数，None表示使用max_queue_wait
+        """
+        start = time.monotonic()
+        timeout = self.max_queue_wait if timeout is None else timeout
+        # 交互请求只需没有其他交互请求排队；批量请求需要没有任何请求排队
+        queued = self._queued - self._batch_queued if priority == INTERACTIVE else self._queued
+        if not queued and self._has_room(priority) and start >= self.paused_until:
+            self.in_flight += 1
+            if priority == BATCH:
+                self.batch_in_flight += 1
+            self._stats["admitted"] += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(user_host, deque()).append(future)
+        self._queued += 1
+        if priority == BATCH:
+            self._batch_queued += 1
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # 超时的同时已被放行，归还名额（未调用上游，不调整并发上限）
+                self.abandon(priority)
+            else:
+                future.cancel()
+                self._remove_waiter(user_host, future, priority)
+            if isinstance(e, asyncio.TimeoutError):
+                self._stats["timeouts"] += 1
+                raise SchedulerTimeout(f"排队等待超过{timeout}秒")
+            raise
+
+        wait = time.monotonic() - start
+        self._stats["admitted"] += 1
+        self._stats["total_wait"] += wait
+        self._stats["max_wait"] = max(self._stats["max_wait"], wait)
+
+    def _remove_waiter(self, user_host: str, future, priority: str = INTERACTIVE):
+        queues = self._queues[priority]
+        waiters = queues.get(user_host)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(future)
+            self._queued -= 1
+            if priority == BATCH:
+                self._batch_queued -= 1
+        except ValueError:
+            return
+        if not waiters:
+            del queues[user_host]
+
+    def _free(self, priority: str):
+        self.in_flight -= 1
+        if priority == BATCH:
+            self.batch_in_flight -= 1
+
+    def abandon(self, priority: str = INTERACTIVE):
+        """
+        归还执行名额但不调整并发上限，用于调用被取消（例如客户端断开）、无法判断上游状态的情况
+        """
+        self._free(priority)
+        self._stats["cancelled"] += 1
+        self._dispatch()
+
+    def release(self, error: Optional[BaseException] = None, priority: str = INTERACTIVE):
+        """
+        归还执行名额，并根据结果调整并发上限
+        """
+        self._free(priority)
+        if error is None:
+            self._stats["successes"] += 1
+            # 加性增：每个“并发窗口”的成功请求使上限加1
+            self.limit = min(float(self.max_inflight), self.limit + 1.0 / self.capacity)
+        else:
+            overloaded, retry_after = classify_error(error)
+            if overloaded:
+                self._stats["overloads"] += 1
+                now = time.monotonic()
+                if now - self._last_decrease >= self.decrease_cooldown:
+                    self._last_decrease = now
+                    self.limit = max(float(self.min_inflight), self.limit * self.decrease_factor)
+                    logger.warning(f"上游过载，并发上限降为 {self.capacity}")
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+                    logger.warning(f"上游要求 {retry_after} 秒后重试，暂停放行")
+            else:
+                self._stats["errors"] += 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_host: str, priority: str = INTERACTIVE, timeout: Optional[float] = None):
+        """
+        在一个执行名额内调用上游模型
+        """
+        await self.acquire(user_host, priority, timeout)
+        try:
+            yield
+        except asyncio.CancelledError:
+            self.abandon(priority)
+            raise
+        except Exception as e:
+            self.release(e, priority)
+            raise
+        else:
+            self.release(priority=priority)
+
+    def stats(self) -> dict:
+        """返回队列深度、等待时间和并发上限"""
+        admitted = self._stats["admitted"]
+        return {
+            "limit": self.capacity,
+            "max_inflight": self.max_inflight,
+            "in_flight": self.in_flight,
+            "queue_depth": self._queued,
+            "queued_users": len(self._queues[INTERACTIVE]) + len(self._queues[BATCH]),
+            "batch_limit": self.batch_capacity,
+            "batch_in_flight": self.batch_in_flight,
+            "batch_queue_depth": self._batch_queued,
+            "paused_for": max(0.0, self.paused_until - time.monotonic()),
+            "avg_wait": self._stats["total_wait"] / admitted if admitted else 0.0,
+            **self._stats
+        }
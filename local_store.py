@@ -0,0 +1,227 @@
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage
+from logger_config import get_module_logger
+from token_counter import count_message_tokens
+
+# 获取模块日志记录器
+logger = get_module_logger("local_store")
+
+# 默认容量限制
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_MAX_MESSAGES = 50000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024  # 64MB
+DEFAULT_SESSION_TTL = 3600
+
+# 每条消息除内容外的估算内存开销（字节）
+MESSAGE_OVERHEAD_BYTES = 256
+
+def message_size(message: BaseMessage) -> int:
+    """
+    估算一条消息占用的内存字节数
+    """
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return len(content.encode("utf-8")) + MESSAGE_OVERHEAD_BYTES
+
+class LocalSession:
+    """
+    一个本地会话：按时间顺序保存 (消息, token数, 字节数)
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.bytes = 0
+        self.version = 0
+        self.last_access = time.monotonic()
+
+class LocalSessionStore:
+    """
+    Redis不可用时使用的进程内会话存储
+
+    以 {user_host}_{session_id} 为键，按最近访问顺序保存会话，
+    空闲超过ttl的会话过期删除；会话数、消息总数或字节总数超出上限时
+    按LRU顺序淘汰最久未访问的会话，保证进程内存占用可预测。
+    """
+
+    def __init__(self, max_sessions: int = DEFAULT_MAX_SESSIONS, max_messages: int = DEFAULT_MAX_MESSAGES,
+                 max_bytes: int = DEFAULT_MAX_BYTES, ttl: Optional[int] = DEFAULT_SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._messages = 0
+        self._bytes = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evicted_sessions": 0,
+            "evicted_messages": 0
+        }
+
+    def _expired(self, session: LocalSession, now: float) -> bool:
+        return bool(self.ttl) and now - session.last_access > self.ttl
+
+    def _drop(self, key: str):
+        session = self._sessions.pop(key)
+        self._messages -= len(session.entries)
+        self._bytes -= session.bytes
+        return session
+
+    def _purge_expired(self, now: float):
+        # 会话按最近访问排序，过期的会话都在头部
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if not self._expired(session, now):
+                break
+            self._drop(key)
+            self._stats["expired"] += 1
+
+    def _get(self, key: str, create: bool = False) -> Optional[LocalSession]:
+        now = time.monotonic()
+        self._purge_expired(now)
+        session = self._sessions.get(key)
+        if session is None:
+            self._stats["misses"] += 1
+            if not create:
+                return None
+            session = LocalSession()
+            self._sessions[key] = session
+        else:
+            self._stats["hits"] += 1
+            self._sessions.move_to_end(key)
+        session.last_access = now
+        return session
+
+    def _over_capacity(self) -> bool:
+        return (len(self._sessions) > self.max_sessions
+                or self._messages > self.max_messages
+                or self._bytes > self.max_bytes)
+
+    def _evict(self, protected_key: str):
+        # 先淘汰其他最久未访问的会话
+        while self._over_capacity() and len(self._sessions) > 1:
+            key = next(iter(self._sessions))
+            if key == protected_key:
+                self._sessions.move_to_end(key)
+                key = next(iter(self._sessions))
+            session = self._drop(key)
+            self._stats["evicted_sessions"] += 1
+            self._stats["evicted_messages"] += len(session.entries)
+            logger.info(f"本地会话存储已满，淘汰会话 {key}")
+        # 只剩当前会话仍超限时，丢弃它最旧的消息
+        session = self._sessions.get(protected_key)
+        while session and session.entries and self._over_capacity():
+            _, _, size = session.entries.pop(0)
+            session.bytes -= size
+            self._messages -= 1
+            self._bytes -= size
+            self._stats["evicted_messages"] += 1
+
+    def get_entries(self, key: str) -> list:
+        """
+        返回会话的 (消息, token数, 字节数) 列表（按时间顺序），会话不存在时返回空列表
+        """
+        session = self._get(key)
+        return list(session.entries) if session else []
+
+    def get_state(self, key: str):
+        """
+        返回 (消息条数, 版本号)
+        """
+        session = self._get(key)
+        return (len(session.entries), session.version) if session else (0, 0)
+
+    def append(self, key: str, messages: Sequence[BaseMessage]) -> int:
+        """
+        追加消息，返回会话当前的消息条数
+        """
+        session = self._get(key, create=True)
+        for message in messages:
+            size = message_size(message)
+            session.entries.append((message, count_message_tokens(message), size))
+            session.bytes += size
+            self._messages += 1
+            self._bytes += size
+        session.version += 1
+        self._evict(key)
+        return len(session.entries)
+
+    def clear(self, key: str):
+        """删除会话"""
+        if key in self._sessions:
+            self._drop(key)
+
+    def stats(self) -> dict:
+        """返回存储占用和淘汰统计"""
+        self._purge_expired(time.monotonic())
+        return {
+            "sessions": len(self._sessions),
+            "messages": self._messages,
+            "bytes": self._bytes,
+            "max_sessions": self.max_sessions,
+            "max_messages": self.max_messages,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            **self._stats
+        }
+
+class LocalChatMessageHistory(BaseChatMessageHistory):
+    """
+    LocalSessionStore中单个会话的历史视图，接口与AsyncRedisChatMessageHistory一致
+    """
+
+    def __init__(self, store: LocalSessionStore, session_id: str):
+        self.store = store
+        self.session_id = session_id
+        # 最近一次读取的上下文消息的token数
+        self.context_tokens = None
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return [message for message, _, _ in self.store.get_entries(self.session_id)]
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.store.append(self.session_id, messages)
+
+    def clear(self) -> None:
+        self.store.clear(self.session_id)
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        entries = self.store.get_entries(self.session_id)
+        self.context_tokens = sum(tokens for _, tokens, _ in entries)
+        return [message for message, _, _ in entries]
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> int:
+        return self.store.append(self.session_id, messages)
+
+    async def aadd_turn(self, user_message: BaseMessage, ai_message: BaseMessage) -> int:
+        return self.store.append(self.session_id, [user_message, ai_message])
+
+    async def aclear(self) -> None:
+        self.store.clear(self.session_id)
+
+    async def aget_recent_messages(self, token_budget: int) -> List[BaseMessage]:
+        """使用写入时记录的token数，返回预算内的最近消息（按时间顺序）"""
+        kept = []
+        total = 0
+        for message, tokens, _ in reversed(self.store.get_entries(self.session_id)):
+            if total + tokens > token_budget:
+                break
+            total += tokens
+            kept.append(message)
+        kept.reverse()
+        self.context_tokens = total
+        return kept
+
+    async def aget_state(self):
+        return self.store.get_state(self.session_id)
+
+    async def aget_entries(self, start: int, end: int) -> List[dict]:
+        """按下标区间返回前端格式的消息（下标0为最新消息，end包含在内）"""
+        entries = self.store.get_entries(self.session_id)[::-1][start:end + 1]
+        return [{"type": message.type, "content": message.content} for message, _, _ in entries
+                if message.type in ("human", "ai")]
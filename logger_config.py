@@ -1,6 +1,13 @@
+import atexit
+import copy
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import sys
 
 # 日志级别映射
@@ -18,10 +25,177 @@ DEFAULT_LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 DEFAULT_LOG_DIR = "logs"
 DEFAULT_MAX_BYTES = 10 * 1024 * 1024  # 10MB
 DEFAULT_BACKUP_COUNT = 5
+# 启用请求ID（LOG_REQUEST_ID=1）且未设置LOG_FORMAT时使用的日志格式
+DEFAULT_REQUEST_ID_LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+# 当前请求的ID，由HTTP中间件设置，请求触发的后台任务会继承
+request_id_var = ContextVar("request_id", default="-")
+
+def request_id_enabled() -> bool:
+    """是否在日志中记录请求ID"""
+    return os.getenv("LOG_REQUEST_ID", "0").lower() in ("1", "true", "yes")
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "0").lower() in ("1", "true", "yes")
+
+class RequestIdFilter(logging.Filter):
+    """
+    为每条日志记录附加当前请求ID（request_id字段），日志格式中可使用 %(request_id)s
+    """
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """
+    按调用位置限速的采样过滤器
+
+    同一代码位置（文件 + 行号）每秒最多输出rate条max_level及以下级别的日志，超出的直接丢弃，
+    下一个时间窗口输出的第一条日志会注明省略的条数。警告及以上级别不受影响。
+    """
+
+    def __init__(self, rate: int, max_level: int = logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.max_level = max_level
+        # 调用位置 -> (窗口开始时间, 窗口内已输出条数, 已省略条数)
+        self._sites = {}
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.pathname, record.lineno)
+        window, count, suppressed = self._sites.get(key, (record.created, 0, 0))
+        if record.created - window >= 1.0:
+            window, count = record.created, 0
+        if count >= self.rate:
+            self._sites[key] = (window, count, suppressed + 1)
+            return False
+        self._sites[key] = (window, count + 1, 0)
+        if suppressed:
+            record.msg = f"{record.msg}（已省略该位置的 {suppressed} 条日志）"
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """
+    将日志记录格式化为单行JSON，包含时间、级别、记录器、消息和请求ID
+    """
+
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-")
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+class LazyQueueHandler(QueueHandler):
+    """
+    只做最少工作的QueueHandler
+
+    在调用线程中只合并消息参数（避免参数对象之后被修改），时间格式化、异常堆栈渲染和JSON序列化
+    都留给后台线程完成。与标准QueueHandler不同，记录在同一进程内传递，因此保留exc_info。
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class _DispatchHandler(logging.Handler):
+    """
+    后台线程中按记录器名称把日志分发给各自的处理器（各模块写入各自的日志文件）
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.routes = {}
+
+    def emit(self, record):
+        for handler in self.routes.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+# 异步日志模式下共享的队列、监听线程和分发处理器
+_queue_handler = None
+_dispatch_handler = None
+_queue_listener = None
+_console_handler = None
+_async_lock = threading.Lock()
+
+def async_logging_enabled() -> bool:
+    """是否使用后台线程写日志（LOG_ASYNC=1）"""
+    return _env_flag("LOG_ASYNC")
+
+def create_formatter() -> logging.Formatter:
+    """
+    根据LOG_FORMAT创建格式化器，LOG_FORMAT=json时输出JSON
+    """
+    log_format = os.getenv("LOG_FORMAT", DEFAULT_REQUEST_ID_LOG_FORMAT if request_id_enabled() else DEFAULT_LOG_FORMAT)
+    if log_format.lower() == "json":
+        return JsonFormatter()
+    return logging.Formatter(log_format)
+
+def _get_queue_handler():
+    """
+    获取异步模式共享的QueueHandler，首次调用时启动后台监听线程
+    """
+    global _queue_handler, _dispatch_handler, _queue_listener
+
+    with _async_lock:
+        if _queue_handler is None:
+            log_queue = queue.SimpleQueue()
+            _dispatch_handler = _DispatchHandler()
+            _queue_listener = QueueListener(log_queue, _dispatch_handler, respect_handler_level=False)
+            _queue_listener.start()
+            atexit.register(shutdown_logging)
+            _queue_handler = LazyQueueHandler(log_queue)
+            # 请求ID是上下文变量，必须在调用线程中读取
+            _queue_handler.addFilter(RequestIdFilter())
+        return _queue_handler
+
+def shutdown_logging():
+    """
+    停止后台日志线程，写完队列中剩余的日志（进程退出时自动调用）
+    """
+    global _queue_listener
+
+    with _async_lock:
+        if _queue_listener is not None:
+            _queue_listener.stop()
+            _queue_listener = None
+
+def _restart_listener_after_fork():
+    """
+    fork出的子进程中没有父进程的后台线程，使用新的队列和锁重新启动监听线程
+    """
+    global _queue_listener, _async_lock
+
+    _async_lock = threading.Lock()
+    if _queue_listener is not None:
+        log_queue = queue.SimpleQueue()
+        _queue_handler.queue = log_queue
+        _queue_listener = QueueListener(log_queue, _dispatch_handler, respect_handler_level=False)
+        _queue_listener.start()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
 
 def setup_logger(name=None, log_level=None, log_to_file=True, log_dir=None, max_bytes=None, backup_count=None):
     """
     配置并返回一个日志记录器
+
+    LOG_ASYNC=1 时记录器只挂一个QueueHandler，控制台和文件输出在后台线程中完成；
+    LOG_SAMPLE_RATE 大于0时，同一代码位置每秒最多输出该数量的INFO及以下级别日志。
     
     参数:
         name: 日志记录器名称，默认为根记录器
@@ -34,6 +208,8 @@ def setup_logger(name=None, log_level=None, log_to_file=True, log_dir=None, max_
     返回:
         配置好的日志记录器
     """
+    global _console_handler
+
     # 获取日志记录器
     logger = logging.getLogger(name)
     
@@ -51,13 +227,21 @@ def setup_logger(name=None, log_level=None, log_to_file=True, log_dir=None, max_
     logger.setLevel(log_level)
     
     # 创建格式化器
-    log_format = os.getenv("LOG_FORMAT", DEFAULT_LOG_FORMAT)
-    formatter = logging.Formatter(log_format)
+    formatter = create_formatter()
+    request_id_filter = RequestIdFilter()
+    use_async = async_logging_enabled()
+    handlers = []
     
-    # 添加控制台处理器
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    # 添加控制台处理器（异步模式下所有记录器共用一个）
+    if use_async and _console_handler is not None:
+        console_handler = _console_handler
+    else:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(formatter)
+        console_handler.addFilter(request_id_filter)
+        if use_async:
+            _console_handler = console_handler
+    handlers.append(console_handler)
     
     # 添加文件处理器（如果启用）
     if log_to_file:
@@ -85,7 +269,22 @@ def setup_logger(name=None, log_level=None, log_to_file=True, log_dir=None, max_
             backupCount=backup_count
         )
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        file_handler.addFilter(request_id_filter)
+        handlers.append(file_handler)
+
+    if use_async:
+        # 日志I/O交给后台线程，事件循环线程只负责入队
+        queue_handler = _get_queue_handler()
+        _dispatch_handler.routes[logger.name] = handlers
+        logger.addHandler(queue_handler)
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+
+    # 对高频日志按调用位置限速
+    sample_rate = int(os.getenv("LOG_SAMPLE_RATE", 0))
+    if sample_rate > 0:
+        logger.addFilter(SamplingFilter(sample_rate))
     
     return logger
 
@@ -1,14 +1,40 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
+import time
+# 冷启动计时起点（模块开始导入的时间）
+STARTUP_BEGAN = time.perf_counter()
+
+from fastapi import FastAPI, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from typing import Optional
 from langchain_openai import ChatOpenAI
-from langchain_community.chat_message_histories import RedisChatMessageHistory
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import HumanMessage, AIMessage
 import os
 from dotenv import load_dotenv
-import redis
 import json
-from logger_config import get_module_logger
+import math
+import asyncio
+from functools import partial
+from logger_config import get_module_logger, request_id_enabled
+from redis_pool import RedisConnectionManager, get_redis, set_circuit_breaker
+from circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, is_connection_failure
+from write_buffer import WriteBuffer, BufferedChatMessageHistory
+from history_archive import HistoryMaintainer
+from cluster import ClusterBus, LeaderLease, DEFAULT_CHANNEL
+from chat_history import AsyncRedisChatMessageHistory, DEFAULT_KEY_PREFIX, HistoryWriteBatcher, aget_context_messages
+from session_summary import SessionSummarizer
+from local_store import LocalSessionStore, LocalChatMessageHistory
+from session_cache import SessionCache
+from response_cache import ResponseCache, make_cache_key
+from rate_limiter import RateLimiter
+from token_counter import count_tokens, count_message_tokens, preload_encoding
+from llm_scheduler import AdmissionScheduler, SchedulerTimeout, INTERACTIVE, BATCH
+from llm_router import LLMRouter, Endpoint, load_endpoint_config
+from metrics import (REGISTRY, CONTENT_TYPE, MetricsMiddleware, stage_timer, observe_stage, CHAT_PROMPT_TOKENS,
+                     CHAT_COMPLETION_TOKENS, CHAT_TURNS, CHAT_TOKENS_PER_SECOND, APP_STARTUP_SECONDS)
+from singleflight import (SingleFlight, SessionLocks, TokenBroadcast, flight_key, aclaim_flight,
+                          apublish_flight_result, arelease_flight, await_flight_result)
+from batch_chat import BatchItem, BatchJobManager, parse_items, run_batch
+from chat_socket import ChatSocket, SocketSession
+from redis_cleanup import BulkDeleter, DEFAULT_BATCH_SIZE, adelete_session, session_patterns
 
 # 获取模块日志记录器
 logger = get_module_logger("main")
@@ -18,188 +44,678 @@ load_dotenv()
 
 
 
-# Redis连接池配置
-REDIS_POOL = None
-def get_redis_connection(retries=3, delay=2):
-    """获取Redis连接，支持重试和超时设置"""
-    global REDIS_POOL
-    
-    # 如果连接池已存在且有效，直接使用
-    if REDIS_POOL and REDIS_POOL.connection_kwargs.get('password') == os.getenv("REDIS_PASSWORD"):
-        conn = redis.Redis(connection_pool=REDIS_POOL)
-        try:
-            if conn.ping():
-                return conn
-        except:
-            pass
-            
-    for attempt in range(retries):
-        try:
-            # 创建或更新连接池
-            REDIS_POOL = redis.ConnectionPool(
-                host='redis-17542.c323.us-east-1-2.ec2.redns.redis-cloud.com',
-                port=17542,
-                decode_responses=True,
-                username="default",
-                password=os.getenv("REDIS_PASSWORD"),  # 从环境变量获取Redis密码
-                max_connections=50,
-                socket_timeout=15,
-                socket_connect_timeout=15,
-                health_check_interval=30,
-                retry_on_timeout=True
+# 全局存储模式标志，由Redis熔断器的状态决定：熔断期间，以及恢复后缓冲的写入回放完成之前为True
+USE_LOCAL_MODE = True
+
+# 会话历史过期时间（秒），每轮对话写入时刷新，默认30天无写入后过期，0表示不过期
+CHAT_HISTORY_TTL = int(os.getenv("CHAT_HISTORY_TTL", 30 * 86400)) or None
+
+# 会话历史的存储格式：compact 只保存类型、内容和token数；json 为完整的LangChain消息JSON（两种格式均可读取）
+CHAT_HISTORY_COMPACT = os.getenv("CHAT_HISTORY_FORMAT", "compact").lower() != "json"
+# 会话空闲超过该秒数后归档为一个压缩字符串，下次访问时自动恢复，0表示不归档
+CHAT_ARCHIVE_IDLE_SECONDS = int(os.getenv("CHAT_ARCHIVE_IDLE_SECONDS", 0))
+
+# 工作进程数（uvicorn和gunicorn都读取WEB_CONCURRENCY），每个工作进程启动后创建自己的连接池和后台任务
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+# 集群模式：通过Redis发布/订阅在工作进程和节点之间协调缓存失效、Redis恢复和会话锁，
+# 后台维护任务只由持有租约的一个进程执行。多个工作进程时默认开启，多节点部署时需设置 CLUSTER_MODE=1
+CLUSTER_MODE = os.getenv("CLUSTER_MODE", "1" if WEB_CONCURRENCY > 1 else "0").lower() in ("1", "true", "yes")
+cluster_bus = ClusterBus(os.getenv("CLUSTER_CHANNEL", DEFAULT_CHANNEL)) if CLUSTER_MODE else None
+
+# 会话历史的后台维护：迁移旧格式的消息（CHAT_HISTORY_MIGRATE=1）、归档空闲会话
+CHAT_MAINTENANCE_INTERVAL = float(os.getenv("CHAT_MAINTENANCE_INTERVAL", 60))
+history_maintainer = HistoryMaintainer(
+    migrate=os.getenv("CHAT_HISTORY_MIGRATE", "0").lower() in ("1", "true", "yes"),
+    archive_idle_seconds=CHAT_ARCHIVE_IDLE_SECONDS,
+    interval=CHAT_MAINTENANCE_INTERVAL,
+    batch_size=int(os.getenv("CHAT_MAINTENANCE_BATCH", 100)),
+    lease=LeaderLease("history_maintenance", max(CHAT_MAINTENANCE_INTERVAL * 3, 30)) if CLUSTER_MODE else None
+)
+
+# 上下文记忆模式：buffer 发送全部历史；token_window 只发送token预算内的最近消息；
+# summary 发送滚动摘要 + 最近的原始消息，旧消息在后台增量压缩进摘要
+CHAT_MEMORY_MODE = os.getenv("CHAT_MEMORY_MODE", "buffer").lower()
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", 4000))
+
+# 客户端断开后是否取消上游生成（合并的重复请求全部断开后才取消）
+CHAT_CANCEL_ON_DISCONNECT = os.getenv("CHAT_CANCEL_ON_DISCONNECT", "1").lower() in ("1", "true", "yes")
+# 检查客户端是否断开的间隔（秒）
+CHAT_DISCONNECT_POLL_INTERVAL = float(os.getenv("CHAT_DISCONNECT_POLL_INTERVAL", 0.5))
+# 生成被取消时已输出的部分回答的处理方式：discard 不写入历史；save 写入用户消息和部分回答；
+# save_marked 写入时在部分回答末尾追加中断标记
+CHAT_PARTIAL_RESPONSE_POLICY = os.getenv("CHAT_PARTIAL_RESPONSE_POLICY", "save").lower()
+PARTIAL_RESPONSE_MARKER = "\n\n[回答已中断]"
+
+# WebSocket对话：服务端心跳间隔、客户端无消息后关闭连接的秒数、每个连接保留的会话数、会话上下文空闲回收秒数
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", 20))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", 60))
+WS_MAX_SESSIONS = int(os.getenv("WS_MAX_SESSIONS", 32))
+WS_SESSION_IDLE = float(os.getenv("WS_SESSION_IDLE", 600))
+
+# 批量对话：单次流式请求和后台任务的最大条数、同时执行的会话数上限、批量项排队等待模型名额的最长秒数
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+BATCH_JOB_MAX_ITEMS = int(os.getenv("BATCH_JOB_MAX_ITEMS", 10000))
+BATCH_MAX_PARALLELISM = int(os.getenv("BATCH_MAX_PARALLELISM", 8))
+BATCH_QUEUE_WAIT = float(os.getenv("BATCH_QUEUE_WAIT", 600))
+
+# 本地模式下使用的进程内会话存储（LRU + TTL淘汰，总量有上限）
+local_store = LocalSessionStore(
+    max_sessions=int(os.getenv("LOCAL_STORE_MAX_SESSIONS", 1000)),
+    max_messages=int(os.getenv("LOCAL_STORE_MAX_MESSAGES", 50000)),
+    max_bytes=int(os.getenv("LOCAL_STORE_MAX_BYTES", 64 * 1024 * 1024)),
+    ttl=int(os.getenv("LOCAL_STORE_TTL", 3600)) or None
+)
+
+# Redis会话历史前的进程内读缓存（SESSION_CACHE_MAX_SESSIONS=0 时关闭）
+session_cache = None
+if int(os.getenv("SESSION_CACHE_MAX_SESSIONS", 1000)) > 0:
+    session_cache = SessionCache(
+        max_sessions=int(os.getenv("SESSION_CACHE_MAX_SESSIONS", 1000)),
+        max_messages=int(os.getenv("SESSION_CACHE_MAX_MESSAGES", 100000))
+    )
+
+# LLM响应缓存（RESPONSE_CACHE_ENABLED=1 时启用，按模型参数和完整上下文精确匹配）
+response_cache = None
+if os.getenv("RESPONSE_CACHE_ENABLED", "0").lower() in ("1", "true", "yes"):
+    response_cache = ResponseCache(
+        ttl=int(os.getenv("RESPONSE_CACHE_TTL", 3600)),
+        local_ttl=int(os.getenv("RESPONSE_CACHE_LOCAL_TTL", 600)),
+        local_max_entries=int(os.getenv("RESPONSE_CACHE_LOCAL_MAX_ENTRIES", 1000))
+    )
+
+# LLM客户端和摘要压缩器在应用启动后于后台线程中创建，不阻塞服务启动
+chat = None
+summarizer = None
+
+def create_llm():
+    """
+    根据环境变量创建LLM客户端（单个ChatOpenAI或多端点路由器），失败时返回None
+    """
+    try:
+        if os.getenv("LLM_ENDPOINTS"):
+            # 配置了多个上游端点时，通过路由器按延迟/错误率选择端点，并可对慢请求发起对冲
+            llm = LLMRouter(
+                [
+                    Endpoint(
+                        endpoint["name"],
+                        ChatOpenAI(
+                            streaming=True,
+                            model=endpoint["model"],
+                            temperature=0.2,
+                            openai_api_base=endpoint["base_url"],
+                            openai_api_key=endpoint["api_key"] or os.getenv(endpoint["api_key_env"]),
+                            max_retries=int(os.getenv("LLM_MAX_RETRIES", 2))
+                        ),
+                        weight=endpoint["weight"]
+                    )
+                    for endpoint in load_endpoint_config(os.getenv("LLM_ENDPOINTS"))
+                ],
+                hedge_after=float(os.getenv("LLM_HEDGE_AFTER", 0))
             )
-            conn = redis.Redis(connection_pool=REDIS_POOL)
-            # 测试连接
-            if conn.ping():
-                logger.info("Redis连接成功")
-                return conn
-        except redis.AuthenticationError as e:
-            logger.error(f"Redis认证失败，请检查密码是否正确: {str(e)}")
-            raise
-        except redis.ConnectionError as e:
-            if attempt < retries - 1:
-                logger.warning(f"Redis连接失败，第{attempt+1}次重试...")
-                from time import sleep
-                sleep(delay)
-                continue
-            logger.error(f"Redis连接失败: {str(e)}")
-            return None
-        except Exception as e:
-            logger.error(f"Redis连接未知错误: {str(e)}")
-            return None
-    return None
-
-# 全局存储模式标志
-USE_LOCAL_MODE = False
-
-# 尝试连接Redis，如果失败则使用内存存储
-try:
-    redis_conn = get_redis_connection()
-    if not redis_conn:
-        logger.warning("Redis连接失败，将使用内存存储作为备选方案")
-        # 设置一个标志，表示使用本地模式
-        USE_LOCAL_MODE = True
-    else:
-        USE_LOCAL_MODE = False
-except Exception as e:
-    logger.error(f"Redis初始化错误: {str(e)}")
-    USE_LOCAL_MODE = True
-    redis_conn = None
-
-# 初始化LLM
-try:
-    chat = ChatOpenAI(
-    streaming=True,
-    model="deepseek-chat",
-    temperature=0.2,
-    openai_api_base="https://api.deepseek.com/v1"
+            logger.info("LLM路由初始化成功，共 %s 个上游端点", len(llm.endpoints))
+            return llm
+        else:
+            llm = ChatOpenAI(
+                streaming=True,
+                model="deepseek-chat",
+                temperature=0.2,
+                openai_api_base=os.getenv("OPENAI_API_BASE", "https://api.deepseek.com/v1"),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", 2))
+            )
+            logger.info("LLM初始化成功")
+            return llm
+    except Exception as e:
+        if "Incorrect API key" in str(e):
+            logger.error("API密钥无效，请检查.env文件中的OPENAI_API_KEY配置")
+        elif "Connection error" in str(e):
+            logger.error(f"无法连接到API服务，请检查网络或API地址: {os.getenv('OPENAI_API_BASE')}")
+        else:
+            logger.error(f"LLM初始化失败: {str(e)}")
+        return None
+
+def init_llm():
+    """
+    创建LLM客户端和会话摘要压缩器（已设置时保持不变）
+    """
+    global chat, summarizer
+
+    if chat is None:
+        chat = create_llm()
+    # 会话摘要压缩器（仅summary模式、Redis存储时使用）
+    if summarizer is None and CHAT_MEMORY_MODE == "summary" and chat is not None:
+        summarizer = SessionSummarizer(
+            chat,
+            keep_recent=int(os.getenv("CHAT_SUMMARY_KEEP_RECENT", 20)),
+            compact_threshold=int(os.getenv("CHAT_SUMMARY_THRESHOLD", 10)),
+            scheduler=llm_scheduler
+        )
+
+# 上游模型调用的准入调度器（并发上限、按用户公平排队、429自适应降级）
+llm_scheduler = AdmissionScheduler(
+    max_inflight=int(os.getenv("LLM_MAX_INFLIGHT", 16)),
+    min_inflight=int(os.getenv("LLM_MIN_INFLIGHT", 1)),
+    max_queue_wait=float(os.getenv("LLM_MAX_QUEUE_WAIT", 30)),
+    batch_share=float(os.getenv("LLM_BATCH_SHARE", 0.5))
 )
-    logger.info("LLM初始化成功")
-except Exception as e:
-    if "Incorrect API key" in str(e):
-        logger.error("API密钥无效，请检查.env文件中的OPENAI_API_KEY配置")
-    elif "Connection error" in str(e):
-        logger.error(f"无法连接到API服务，请检查网络或API地址: {os.getenv('OPENAI_API_BASE')}")
-    else:
-        logger.error(f"LLM初始化失败: {str(e)}")
-    chat = None
+
+# 按user_host和会话的令牌桶限流（RATE_LIMIT_ENABLED=1 时启用，各项限额为0表示不限制）
+rate_limiter = None
+if os.getenv("RATE_LIMIT_ENABLED", "0").lower() in ("1", "true", "yes"):
+    rate_limiter = RateLimiter(
+        user_rpm=int(os.getenv("RATE_LIMIT_USER_RPM", 60)),
+        user_tpm=int(os.getenv("RATE_LIMIT_USER_TPM", 100000)),
+        session_rpm=int(os.getenv("RATE_LIMIT_SESSION_RPM", 30)),
+        session_tpm=int(os.getenv("RATE_LIMIT_SESSION_TPM", 50000))
+    )
 
 from contextlib import asynccontextmanager
 
-app = FastAPI()
+# 启动状态：LLM和Redis的初始化在后台完成，完成后才通过就绪检查
+startup_state = {
+    "ready": False,
+    "llm": "pending",
+    "redis": "pending",
+    "import_seconds": None,
+    "ready_seconds": None
+}
+
+# 保护所有Redis命令的熔断器：连续失败或超时后直接拒绝，不再等待套接字超时
+redis_breaker = CircuitBreaker(
+    "redis",
+    failure_threshold=int(os.getenv("REDIS_BREAKER_FAILURE_THRESHOLD", 5)),
+    call_timeout=float(os.getenv("REDIS_BREAKER_CALL_TIMEOUT", 2))
+)
+set_circuit_breaker(redis_breaker)
+
+# 熔断期间的会话历史写入缓冲（有界，写入文件，恢复后按顺序回放到Redis）
+write_buffer = WriteBuffer(
+    path=os.getenv("REDIS_WRITE_BUFFER_PATH", "data/redis_write_buffer.jsonl") or None,
+    max_entries=int(os.getenv("REDIS_WRITE_BUFFER_MAX_ENTRIES", 10000)),
+    track_activity=CHAT_ARCHIVE_IDLE_SECONDS > 0
+)
+
+# 正在回放缓冲写入的后台任务
+replay_task = None
+
+async def replay_write_buffer():
+    """
+    将熔断期间缓冲的写入按顺序回放到Redis，全部完成后切回Redis存储
+
+    回放期间新的写入仍进入缓冲并在同一轮回放中写入，保证同一会话的消息顺序不变；
+    已回放的会话从进程内存储中移除，之后从Redis读取。
+    """
+    global USE_LOCAL_MODE
+
+    try:
+        while len(write_buffer) and redis_breaker.closed:
+            pending = len(write_buffer)
+            sessions = await write_buffer.replay(get_redis())
+            for session_key in sessions:
+                local_store.clear(session_key)
+            logger.info("已回放 %s 条缓冲的写入，涉及 %s 个会话", pending, len(sessions))
+    except Exception as e:
+        logger.error(f"回放缓冲的写入失败，等待Redis恢复后重试: {str(e) or type(e).__name__}")
+        return
+    if redis_breaker.closed:
+        USE_LOCAL_MODE = False
+        logger.info("Redis已连接，使用Redis存储")
+
+def on_redis_state_change(old_state: str, new_state: str):
+    """
+    Redis熔断器状态变化时切换存储模式：打开时立即改用本地存储并缓冲写入，关闭时先回放缓冲的写入
+    """
+    global USE_LOCAL_MODE, replay_task
+
+    startup_state["redis"] = {CLOSED: "connected", OPEN: "disconnected"}.get(new_state, "probing")
+    if new_state == CLOSED:
+        if replay_task is None or replay_task.done():
+            replay_task = asyncio.create_task(replay_write_buffer())
+        # 通知其他工作进程立即试探，不必等到各自的退避结束
+        if cluster_bus is not None:
+            cluster_bus.publish("redis_recovered")
+    elif new_state == OPEN:
+        if not USE_LOCAL_MODE:
+            logger.warning("Redis不可用，应用将在本地模式下运行，会话写入进入缓冲，后台将持续重连")
+        USE_LOCAL_MODE = True
+
+redis_breaker.add_listener(on_redis_state_change)
+
+# 后台维护Redis连接：启动时快速探测一次，熔断后按带抖动的指数退避试探恢复
+redis_manager = RedisConnectionManager(
+    breaker=redis_breaker,
+    probe_timeout=float(os.getenv("REDIS_PROBE_TIMEOUT", 2)),
+    max_delay=float(os.getenv("REDIS_RECONNECT_MAX_DELAY", 30)),
+    health_check_interval=float(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 5))
+)
+
+def invalidate_sessions(session_key: Optional[str] = None, user_host: Optional[str] = None):
+    """
+    会话被删除后移除本进程中的缓存：指定session_key时只移除该会话，否则移除user_host的（或全部）会话
+    """
+    # 会话缓存的键是Redis列表的键（DEFAULT_KEY_PREFIX + 会话键）
+    if session_key is not None:
+        local_store.clear(session_key)
+        if session_cache is not None:
+            session_cache.invalidate(DEFAULT_KEY_PREFIX + session_key)
+    elif session_cache is not None:
+        session_cache.invalidate_prefix(DEFAULT_KEY_PREFIX + (f"{user_host}_" if user_host else ""))
+
+if cluster_bus is not None:
+    cluster_bus.on("redis_recovered", lambda data: redis_manager.check_now())
+    cluster_bus.on("sessions_cleared", lambda data: invalidate_sessions(data.get("session_key"), data.get("user_host")))
+
+async def startup():
+    """
+    后台完成启动：在线程中创建LLM客户端，同时等待第一次Redis探测，两者完成后标记就绪
+
+    Redis可用时先等待上次遗留的缓冲写入回放完成，再开始接受请求
+    """
+    async def start_llm():
+        await asyncio.to_thread(init_llm)
+        startup_state["llm"] = "ready" if chat is not None else "failed"
+
+    redis_manager.start()
+    await asyncio.gather(start_llm(), redis_manager.wait_checked())
+    if replay_task is not None:
+        await replay_task
+    startup_state["ready"] = True
+    startup_state["ready_seconds"] = time.perf_counter() - STARTUP_BEGAN
+    APP_STARTUP_SECONDS.set(startup_state["ready_seconds"], ("ready",))
+    logger.info("服务就绪，耗时 %.3f 秒，存储模式: %s", startup_state["ready_seconds"], "本地内存" if USE_LOCAL_MODE else "Redis")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期：立即开始服务，Redis连接和LLM初始化在后台进行；关闭时停止后台任务并释放连接池
+    """
+    startup_state["import_seconds"] = time.perf_counter() - STARTUP_BEGAN
+    APP_STARTUP_SECONDS.set(startup_state["import_seconds"], ("lifespan",))
+    # 在工作进程中打开写入缓冲文件（多个工作进程各自独占一个文件）
+    write_buffer.open()
+    # tiktoken编码在后台线程中加载，不计入启动耗时，加载完成前token数使用近似估算
+    preload_encoding()
+    startup_task = asyncio.create_task(startup())
+    history_maintainer.start(get_redis, lambda: not USE_LOCAL_MODE)
+    if cluster_bus is not None:
+        # 订阅恢复说明Redis已可用，立即试探
+        cluster_bus.start(get_redis, on_connect=redis_manager.check_now)
+    yield
+    startup_task.cancel()
+    await history_maintainer.stop(None if USE_LOCAL_MODE else get_redis())
+    if cluster_bus is not None:
+        await cluster_bus.stop()
+    await redis_manager.stop()
+    write_buffer.close()
+
+def not_ready_response() -> JSONResponse:
+    """服务尚未就绪时返回503，客户端稍后重试"""
+    return JSONResponse(
+        {"status": "error", "message": "服务正在启动，请稍后再试"},
+        status_code=503,
+        headers={"Retry-After": "1"}
+    )
+
+app = FastAPI(lifespan=lifespan)
+# 请求计数、耗时和可选的请求ID（LOG_REQUEST_ID=1 时写入日志和X-Request-ID响应头）
+app.add_middleware(MetricsMiddleware, trace_ids=request_id_enabled(), started_at=STARTUP_BEGAN)
+
+def model_params(llm) -> dict:
+    """
+    返回影响模型输出的参数，作为响应缓存键的一部分
+    """
+    return {
+        "model": getattr(llm, "model_name", None),
+        "temperature": getattr(llm, "temperature", None),
+        "base_url": getattr(llm, "openai_api_base", None)
+    }
+
+async def replay_tokens(tokens):
+    """
+    按缓存的token逐个回放，与实时生成走同一条流式输出路径
+    """
+    for token in tokens:
+        yield token
+
+async def stream_tokens(llm, messages):
+    """
+    调用模型的异步流式接口，逐个产出非空token
+    """
+    async for chunk in llm.astream(messages):
+        if chunk.content:
+            yield chunk.content
+
+async def watch_disconnect(request: Request, disconnected: asyncio.Event, broadcast):
+    """
+    定期检查客户端是否断开，断开时设置disconnected并唤醒订阅者
+
+    StreamingResponse只有在写入失败时才能发现断开，排队或等待首个token期间需要主动检查
+    """
+    while not broadcast.done:
+        if await request.is_disconnected():
+            disconnected.set()
+            broadcast.wake()
+            return
+        await asyncio.sleep(CHAT_DISCONNECT_POLL_INTERVAL)
+
+def sse_frame(data: str) -> str:
+    """
+    将文本封装为一个SSE事件帧，多行文本逐行添加data:前缀
+    """
+    return "".join(f"data: {line}\n" for line in data.split("\n")) + "\n"
+
+# 生成与取消统计，用于估算断开取消节省的上游容量
+generation_stats = {
+    "completed": 0,
+    "completion_tokens": 0,
+    "disconnects": 0,
+    "cancelled": 0,
+    "cancelled_completion_tokens": 0,
+    "cancelled_context_tokens": 0,
+    "partial_saved": 0
+}
+
+# 进程内的重复请求合并和会话锁
+chat_flights = SingleFlight(cancel_abandoned=CHAT_CANCEL_ON_DISCONNECT)
+session_locks = SessionLocks(
+    lock_ttl=int(os.getenv("SESSION_LOCK_TTL", 120)),
+    lock_timeout=int(os.getenv("SESSION_LOCK_TIMEOUT", 60)),
+    notifier=cluster_bus
+)
+
+# 是否使用Redis在多个工作进程之间同步会话锁和合并重复请求（集群模式下默认开启）
+SESSION_LOCK_REDIS = os.getenv("SESSION_LOCK_REDIS", "1" if CLUSTER_MODE else "0").lower() in ("1", "true", "yes")
+
+def buffered_history(session_key: str, user_host: Optional[str] = None) -> BufferedChatMessageHistory:
+    """
+    Redis熔断期间使用的会话历史：读写进程内存储，写入同时进入缓冲，恢复后回放到Redis
+    """
+    return BufferedChatMessageHistory(local_store, session_key, write_buffer, CHAT_HISTORY_TTL, CHAT_HISTORY_COMPACT,
+                                      user_host)
+
+def create_message_history(session_key: str, user_host: str, write_batcher: Optional[HistoryWriteBatcher] = None):
+    """
+    根据当前存储模式创建会话历史：Redis可用时使用共享连接池，否则使用进程内存储并缓冲写入
+
+    参数:
+        user_host: 会话所属的用户（写入时维护用户的会话索引）
+        write_batcher: 可选的合并写入器，批量对话使用
+    """
+    if USE_LOCAL_MODE:
+        return buffered_history(session_key, user_host)
+    return AsyncRedisChatMessageHistory(
+        redis_client=get_redis(),
+        session_id=session_key,
+        ttl=CHAT_HISTORY_TTL,
+        cache=session_cache,
+        compact=CHAT_HISTORY_COMPACT,
+        track_activity=CHAT_ARCHIVE_IDLE_SECONDS > 0,
+        write_batcher=write_batcher,
+        user_host=user_host
+    )
+
+def is_redis_outage(message_history, error: BaseException) -> bool:
+    """
+    判断Redis会话历史的读写是否因熔断、连接失败或超时而失败
+    """
+    return isinstance(message_history, AsyncRedisChatMessageHistory) and (
+        isinstance(error, CircuitOpenError) or is_connection_failure(error))
+
+async def load_context_messages(message_history):
+    """
+    按记忆模式读取上下文消息（token_window模式下只读取预算内的最近消息，summary模式下读取摘要和未压缩的消息）
+    """
+    if summarizer is not None and isinstance(message_history, AsyncRedisChatMessageHistory):
+        return await summarizer.aget_context_messages(message_history)
+    token_budget = CHAT_CONTEXT_TOKEN_BUDGET if CHAT_MEMORY_MODE == "token_window" else None
+    return await aget_context_messages(message_history, token_budget)
+
+async def run_chat_turn(broadcast, message_history, session_key, user_host, user_input, key, bypass_cache,
+                        priority: str = INTERACTIVE):
+    """
+    执行一轮对话并将token发布到broadcast
+
+    在会话锁内依次完成：读取上下文、查询响应缓存或调用模型、写入历史，
+    保证同一会话的多轮对话不会交错写入。priority为BATCH时以批量优先级排队等待模型名额。
+    key为None时不与其他工作进程的相同请求合并。
+    """
+    redis_conn = None if USE_LOCAL_MODE else get_redis()
+    cross_worker = SESSION_LOCK_REDIS and redis_conn is not None and isinstance(message_history, AsyncRedisChatMessageHistory)
+    share_flight = cross_worker and key is not None
+
+    # 其他工作进程正在处理完全相同的请求时，等待并回放它的结果；
+    # 对方失败时重新声明，期间又有其他进程声明成功则继续等待那一次生成
+    flight_id = None
+    if share_flight:
+        deadline = time.monotonic() + session_locks.lock_timeout
+        while True:
+            claimed, flight_id = await aclaim_flight(redis_conn, key, session_locks.lock_ttl)
+            if claimed:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"等待相同请求的结果超时: {key}")
+            tokens = await await_flight_result(redis_conn, key, flight_id, remaining, cluster_bus)
+            if tokens is not None:
+                logger.info("回放其他进程的生成结果: %s", key)
+                for token in tokens:
+                    broadcast.publish(token)
+                return
+
+    try:
+        async with session_locks.hold(session_key, redis_conn if cross_worker else None):
+            # 读取上下文消息；Redis在本轮开始后熔断或连接失败时改用本地会话，写入进入缓冲
+            try:
+                history_messages = await load_context_messages(message_history)
+            except Exception as e:
+                if not is_redis_outage(message_history, e):
+                    raise
+                logger.warning(f"读取Redis会话历史失败，改用本地会话: {str(e) or type(e).__name__}")
+                message_history = buffered_history(session_key, user_host)
+                history_messages = await load_context_messages(message_history)
+            use_summary = summarizer is not None and isinstance(message_history, AsyncRedisChatMessageHistory)
+
+            with stage_timer("prompt_build"):
+                messages = [*history_messages, HumanMessage(content=user_input)]
+                # 优先使用读取历史时按写入记录累加的token数，避免每轮重新计算整段上下文
+                history_tokens = getattr(message_history, "context_tokens", None)
+                if history_tokens is None:
+                    history_tokens = sum(count_message_tokens(m) for m in history_messages)
+                prompt_tokens = history_tokens + count_message_tokens(messages[-1])
+                cache_key = None
+                if response_cache is not None and not bypass_cache:
+                    cache_key = make_cache_key(model_params(chat), messages)
+
+            # 查询响应缓存，命中时回放缓存的token，否则调用模型
+            cached_tokens = None
+            if cache_key:
+                cached_tokens = await response_cache.aget(cache_key, redis_conn)
+            # 逐token发布；调用模型时需先从调度器获得执行名额
+            chunks = []
+            cancelled = False
+            first_token_at = None
+            try:
+                if cached_tokens is not None:
+                    logger.info("响应缓存命中，回放缓存的响应")
+                    async for token in replay_tokens(cached_tokens):
+                        chunks.append(token)
+                        broadcast.publish(token)
+                else:
+                    wait_start = time.perf_counter()
+                    queue_wait = BATCH_QUEUE_WAIT if priority == BATCH else None
+                    async with llm_scheduler.slot(user_host, priority, queue_wait):
+                        call_start = time.perf_counter()
+                        observe_stage("queue_wait", call_start - wait_start)
+                        CHAT_PROMPT_TOKENS.inc(prompt_tokens)
+                        async for token in stream_tokens(chat, messages):
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                                observe_stage("ttft", first_token_at - call_start)
+                            chunks.append(token)
+                            broadcast.publish(token)
+            except asyncio.CancelledError:
+                # 客户端已断开：上游流随任务取消而关闭，按策略决定是否保留部分回答
+                cancelled = True
+                response = "".join(chunks)
+                partial_tokens = count_tokens(response)
+                generation_stats["cancelled"] += 1
+                generation_stats["cancelled_completion_tokens"] += partial_tokens
+                generation_stats["cancelled_context_tokens"] += prompt_tokens
+                CHAT_COMPLETION_TOKENS.inc(partial_tokens)
+                CHAT_TURNS.inc(labels=("cancelled",))
+                logger.info("生成已取消，已输出 %s 个token，部分回答处理策略: %s", partial_tokens, CHAT_PARTIAL_RESPONSE_POLICY)
+                if CHAT_PARTIAL_RESPONSE_POLICY not in ("save", "save_marked") or not chunks:
+                    raise
+
+            response = "".join(chunks)
+            completion_tokens = count_tokens(response)
+            if cancelled:
+                if CHAT_PARTIAL_RESPONSE_POLICY == "save_marked":
+                    response += PARTIAL_RESPONSE_MARKER
+                generation_stats["partial_saved"] += 1
+            elif cached_tokens is not None:
+                CHAT_TURNS.inc(labels=("cached",))
+            else:
+                generation_stats["completed"] += 1
+                generation_stats["completion_tokens"] += completion_tokens
+                CHAT_TURNS.inc(labels=("completed",))
+                CHAT_COMPLETION_TOKENS.inc(completion_tokens)
+                if first_token_at is not None:
+                    generation_time = time.perf_counter() - first_token_at
+                    observe_stage("generation", generation_time)
+                    if generation_time > 0:
+                        CHAT_TOKENS_PER_SECOND.observe(completion_tokens / generation_time)
+                if cache_key and chunks:
+                    await response_cache.aset(cache_key, chunks, redis_conn)
+
+            # 流结束（或被取消）后一次性写入本轮的用户消息和AI响应，Redis写入失败时改为缓冲写入
+            turn = (HumanMessage(content=user_input), AIMessage(content=response))
+            with stage_timer("history_write"):
+                try:
+                    history_length = await message_history.aadd_turn(*turn)
+                except Exception as e:
+                    if not is_redis_outage(message_history, e):
+                        raise
+                    logger.warning(f"写入Redis会话历史失败，写入缓冲待恢复后回放: {str(e) or type(e).__name__}")
+                    message_history, use_summary = buffered_history(session_key, user_host), False
+                    history_length = await message_history.aadd_turn(*turn)
+            logger.info("已将用户消息和AI响应添加到历史记录，当前历史记录长度: %s", history_length)
+
+            # 在后台将老化的消息增量并入摘要
+            if use_summary:
+                summarizer.schedule_compaction(message_history, history_length)
+
+            # 补扣本轮实际消耗的token（上下文 + 输出，输入部分已在请求时预扣）
+            if rate_limiter is not None and cached_tokens is None:
+                used = history_tokens + completion_tokens
+                await rate_limiter.acharge(user_host, session_key, used, redis_conn)
+
+            if cancelled:
+                raise asyncio.CancelledError()
+    except BaseException as e:
+        if not isinstance(e, asyncio.CancelledError):
+            CHAT_TURNS.inc(labels=("error",))
+        if share_flight:
+            await arelease_flight(redis_conn, key, flight_id, cluster_bus)
+        raise
+
+    if share_flight:
+        await apublish_flight_result(redis_conn, key, flight_id, chunks, notifier=cluster_bus)
 
 @app.post("/chat")
 async def chat_endpoint(request: Request):
+    if not startup_state["ready"]:
+        return not_ready_response()
     body = await request.json()
     user_input = body["message"]
     session_id = body.get("session_id", "default")
     user_host = body.get("userHost", "unknown")
+    # 单次请求可通过 no_cache 字段或 Cache-Control: no-cache 请求头跳过响应缓存
+    bypass_cache = bool(body.get("no_cache")) or "no-cache" in request.headers.get("cache-control", "")
     
-    logger.info(f"收到用户请求: {user_input[:50]}...")
+    logger.info("收到用户请求: %s...", user_input[:50])
+
+    # 使用与/history接口相同的session_key格式
+    session_key = f"{user_host}_{session_id}"
+
+    # 超出限额时直接返回429，不占用模型调用名额
+    if rate_limiter is not None:
+        result = await rate_limiter.acheck(user_host, session_key, count_tokens(user_input),
+                                           None if USE_LOCAL_MODE else get_redis())
+        if not result.allowed:
+            logger.warning(f"用户 {user_host} 超出限额 {result.limit_name}，{result.retry_after:.1f}秒后可重试")
+            return JSONResponse(
+                {"status": "error", "message": "请求过于频繁，请稍后再试", "limit": result.limit_name,
+                 "retry_after": result.retry_after, "reset": result.reset_at},
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(result.retry_after)), "X-RateLimit-Reset": str(result.reset_at)}
+            )
     
     # 使用消息历史 - 根据Redis连接状态选择存储方式
     if not USE_LOCAL_MODE:
         try:
-            # 使用与/history接口完全相同的Redis连接参数
-            host = 'redis-17542.c323.us-east-1-2.ec2.redns.redis-cloud.com'
-            port = 17542
-            redis_url = f"redis://default:{os.getenv('REDIS_PASSWORD')}@{host}:{port}"
-            # 使用与/history接口相同的session_key格式
-            session_key = f"{user_host}_{session_id}"
-            logger.info(f"使用会话键: {session_key}")
-            
-            # 检查Redis中是否已存在该会话键
-            redis_key = f"message_store:{session_key}"
-            try:
-                if redis_conn and redis_conn.exists(redis_key):
-                    logger.info(f"在Redis中找到已存在的会话: {session_key}")
-                else:
-                    logger.info(f"在Redis中创建新会话: {session_key}")
-            except Exception as e:
-                logger.warning(f"检查Redis会话时出错: {str(e)}")
-                
-            message_history = RedisChatMessageHistory(
-                url=redis_url,
-                session_id=session_key
-            )
-            logger.info(f"为用户 {user_host} 创建Redis会话 {session_id}")
+            logger.debug("使用会话键: %s", session_key)
+
+            # 使用应用启动时创建的共享连接池
+            message_history = create_message_history(session_key, user_host)
+            logger.info("为用户 %s 创建Redis会话 %s", user_host, session_id)
             # 记录Redis键名，便于调试
-            redis_key = f"message_store:{session_key}"
-            logger.info(f"Redis存储键: {redis_key}")
+            logger.debug("Redis存储键: %s", message_history.key)
         except Exception as e:
             logger.error(f"创建Redis会话历史失败: {str(e)}")
-            # 失败时回退到内存存储
-            from langchain_community.chat_message_histories import ChatMessageHistory
-            message_history = ChatMessageHistory()
-            logger.warning(f"为用户 {user_host} 创建内存会话 {session_id}")
+            # 失败时回退到本地会话存储，写入进入缓冲
+            message_history = buffered_history(session_key, user_host)
+            logger.warning(f"为用户 {user_host} 使用本地会话 {session_id}")
     else:
-        # 本地模式 - 使用内存存储
-        from langchain_community.chat_message_histories import ChatMessageHistory
-        message_history = ChatMessageHistory()
-        logger.info(f"本地模式: 为用户 {user_host} 创建内存会话 {session_id}")
+        # 本地模式（Redis熔断期间）- 使用有界的进程内会话存储，写入进入缓冲，恢复后回放到Redis
+        message_history = buffered_history(session_key, user_host)
+        logger.info("本地模式: 为用户 %s 使用本地会话 %s", user_host, session_id)
         
-    # 创建带记忆的对话链
-    memory = ConversationBufferMemory(
-        chat_memory=message_history,
-        return_messages=True
-    )
-    conversation = ConversationChain(
-        llm=chat,
-        verbose=True,
-        memory=memory
-    )
-
     async def event_stream():
         try:
-            logger.info(f"开始处理用户输入: {user_input[:50]}...")
+            logger.debug("开始处理用户输入: %s...", user_input[:50])
             # 检查LLM是否初始化成功
             if chat is None:
                 logger.error("LLM模型初始化失败")
-                yield f"data: 系统错误：语言模型初始化失败，请联系管理员。\n\n"
+                yield sse_frame("系统错误：语言模型初始化失败，请联系管理员。")
                 return
-                
-            # 直接使用ConversationChain处理用户输入
+
             try:
-                # 先添加用户消息到历史记录
-                message_history.add_user_message(user_input)
-                
-                # 使用ConversationChain处理用户输入
-                response = conversation.predict(input=user_input)
-                
-                # 添加AI响应到历史记录
-                message_history.add_ai_message(response)
-                
-                # 记录消息添加情况
-                logger.info(f"已将用户消息和AI响应添加到历史记录，当前历史记录长度: {len(message_history.messages)}")
-                
-                yield f"{response}\n\n"
+                # 相同会话的相同输入并发到达时合并为一次生成，重复请求直接订阅同一个token流
+                key = flight_key(session_key, user_input)
+                broadcast = chat_flights.join(
+                    key,
+                    lambda b: run_chat_turn(b, message_history, session_key, user_host, user_input, key, bypass_cache)
+                )
+                disconnected = asyncio.Event()
+                watcher = None
+                if CHAT_CANCEL_ON_DISCONNECT:
+                    watcher = asyncio.create_task(watch_disconnect(request, disconnected, broadcast))
+                try:
+                    async for token in broadcast.subscribe(disconnected):
+                        yield sse_frame(token)
+                except (asyncio.CancelledError, GeneratorExit):
+                    # 响应流被取消（客户端断开），退出订阅时会取消无人订阅的生成
+                    generation_stats["disconnects"] += 1
+                    logger.info("客户端断开连接: %s", session_key)
+                    raise
+                finally:
+                    if watcher is not None:
+                        watcher.cancel()
+                if disconnected.is_set():
+                    generation_stats["disconnects"] += 1
+                    logger.info("客户端断开连接: %s", session_key)
+                    return
+                yield sse_frame("[DONE]")
+            except SchedulerTimeout as e:
+                logger.warning(f"请求排队超时: {str(e)}")
+                yield sse_frame("[ERROR] 当前请求较多，请稍后再试。")
             except Exception as e:
                 logger.error(f"处理请求时出错: {str(e)}")
-                yield f"data: [ERROR] 处理您的请求时出现错误，请稍后再试。\n\n"
-                
+                yield sse_frame("[ERROR] 处理您的请求时出现错误，请稍后再试。")
+
         except Exception as e:
             logger.error(f"处理请求时出错: {str(e)}")
-            yield f"data: [ERROR] 处理您的请求时出现错误，请稍后再试。\n\n"
+            yield sse_frame("[ERROR] 处理您的请求时出现错误，请稍后再试。")
 
     return StreamingResponse(
         event_stream(),
@@ -207,191 +723,563 @@ async def chat_endpoint(request: Request):
         headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
     )
 
-# 在应用启动时检查Redis连接状态
-if not USE_LOCAL_MODE and redis_conn:
+# 当前打开的WebSocket连接和累计统计
+chat_sockets = set()
+socket_stats = {
+    "opened": 0,
+    "idle_closed": 0,
+    "turns": 0,
+    "cancelled": 0,
+    "rate_limited": 0
+}
+
+async def run_socket_turn(conn: ChatSocket, session: SocketSession, turn_id: str, user_input: str, bypass_cache: bool):
+    """
+    执行WebSocket连接中的一轮对话，逐个发送token帧
+
+    与/chat走相同的限流、重复请求合并、会话锁和历史写入路径，但会话键、会话历史对象和
+    限流状态保存在连接的会话上下文中跨轮复用。
+    """
+    frame = {"turn_id": turn_id, "session_id": session.session_id}
+    socket_stats["turns"] += 1
+    if chat is None:
+        await conn.send({"type": "error", **frame, "message": "系统错误：语言模型初始化失败，请联系管理员。"})
+        return
+
+    if rate_limiter is not None:
+        # 上一次被限流且尚未到可重试时间时直接拒绝，不访问Redis
+        retry_after = session.retry_after()
+        limit_name = session.limit_name
+        if not retry_after:
+            result = await rate_limiter.acheck(session.user_host, session.session_key, count_tokens(user_input),
+                                               None if USE_LOCAL_MODE else get_redis())
+            if not result.allowed:
+                retry_after, limit_name = result.retry_after, result.limit_name
+                session.limited_until = time.monotonic() + retry_after
+                session.limit_name = limit_name
+        if retry_after:
+            socket_stats["rate_limited"] += 1
+            await conn.send({"type": "error", **frame, "message": "请求过于频繁，请稍后再试",
+                             "limit": limit_name, "retry_after": retry_after})
+            return
+
+    message_history = session.history(None if USE_LOCAL_MODE else get_redis(), create_message_history)
+    key = flight_key(session.session_key, user_input)
+    broadcast = chat_flights.join(
+        key,
+        lambda b: run_chat_turn(b, message_history, session.session_key, session.user_host, user_input, key,
+                                bypass_cache)
+    )
+    await conn.send({"type": "start", **frame})
     try:
-        if redis_conn.ping():
-            print("Redis连接成功")
-            # 打印Redis连接参数，便于调试
-            print(f"Redis连接参数: host={REDIS_POOL.connection_kwargs.get('host')}, port={REDIS_POOL.connection_kwargs.get('port')}")
-            # 打印环境变量中的Redis配置
-            print(f"环境变量Redis配置: REDIS_HOST={os.getenv('REDIS_HOST')}, REDIS_PORT={os.getenv('REDIS_PORT')}")
-        else:
-            print("Redis连接失败，但应用将继续在本地模式下运行")
+        async for token in broadcast.subscribe():
+            if not await conn.send({"type": "token", **frame, "data": token}):
+                return
+    except asyncio.CancelledError:
+        # 客户端取消或连接关闭，退出订阅时会取消无人订阅的生成
+        socket_stats["cancelled"] += 1
+        raise
+    except SchedulerTimeout as e:
+        logger.warning(f"请求排队超时: {str(e)}")
+        await conn.send({"type": "error", **frame, "message": "当前请求较多，请稍后再试。"})
+        return
+    await conn.send({"type": "done", **frame})
+
+@app.websocket("/chat/ws")
+async def chat_socket_endpoint(websocket: WebSocket, userHost: str = "unknown"):
+    """
+    WebSocket对话：一个连接内复用多个会话，每轮的token以带turn_id的帧推送
+
+    客户端消息（JSON）：
+        {"type": "chat", "session_id": "s1", "message": "...", "turn_id": 可选, "no_cache": 可选}
+        {"type": "cancel", "turn_id": "..."} 或 {"type": "cancel", "session_id": "s1", "userHost": "可选"}
+        {"type": "ping"} / {"type": "pong"}
+    服务端消息：start、token（data为token）、done、cancelled、error（均带turn_id和session_id），
+    ack（收到chat后返回分配的turn_id）以及心跳ping。
+    """
+    await websocket.accept()
+    if not startup_state["ready"]:
+        await websocket.send_text(json.dumps({"type": "error", "message": "服务正在启动，请稍后再试"}, ensure_ascii=False))
+        # 1013：稍后重试
+        await websocket.close(1013)
+        return
+
+    conn = ChatSocket(websocket, userHost, WS_HEARTBEAT_INTERVAL, WS_IDLE_TIMEOUT, WS_MAX_SESSIONS, WS_SESSION_IDLE)
+    chat_sockets.add(conn)
+    socket_stats["opened"] += 1
+    conn.start()
+    logger.info("用户 %s 建立WebSocket连接", userHost)
+    try:
+        while True:
+            message = await conn.receive()
+            if message is None:
+                continue
+            message_type = message.get("type", "chat")
+            if message_type == "ping":
+                await conn.send({"type": "pong"})
+            elif message_type == "cancel":
+                cancelled = conn.cancel(message.get("turn_id"), message.get("session_id"), message.get("userHost"))
+                if not cancelled:
+                    await conn.send({"type": "error", "turn_id": message.get("turn_id"),
+                                     "message": "没有可取消的进行中轮次"})
+            elif message_type == "chat":
+                user_input = message.get("message")
+                if not isinstance(user_input, str) or not user_input:
+                    await conn.send({"type": "error", "turn_id": message.get("turn_id"), "message": "缺少message"})
+                    continue
+                session_id = str(message.get("session_id", "default"))
+                session = conn.session(session_id, message.get("userHost"))
+                if session is None:
+                    await conn.send({"type": "error", "turn_id": message.get("turn_id"), "session_id": session_id,
+                                     "message": f"每个连接最多同时使用 {WS_MAX_SESSIONS} 个会话"})
+                    continue
+                bypass_cache = bool(message.get("no_cache"))
+                turn_id = conn.start_turn(
+                    session,
+                    partial(run_socket_turn, conn, session, user_input=user_input, bypass_cache=bypass_cache),
+                    message.get("turn_id")
+                )
+                if turn_id is None:
+                    await conn.send({"type": "error", "turn_id": message.get("turn_id"), "session_id": session_id,
+                                     "message": "turn_id与进行中的轮次重复"})
+                    continue
+                await conn.send({"type": "ack", "turn_id": turn_id, "session_id": session_id})
+            elif message_type != "pong":
+                await conn.send({"type": "error", "message": f"未知的消息类型: {message_type}"})
+    except (WebSocketDisconnect, RuntimeError):
+        # 客户端断开，或心跳超时后服务端已关闭连接
+        pass
+    finally:
+        if conn.idle_closed:
+            socket_stats["idle_closed"] += 1
+        await conn.close()
+        chat_sockets.discard(conn)
+        logger.info("用户 %s 的WebSocket连接已关闭", userHost)
+
+# 批量对话的历史写入合并为一次MULTI提交
+history_write_batcher = HistoryWriteBatcher(
+    max_batch=int(os.getenv("BATCH_HISTORY_WRITE_BATCH", 100)),
+    max_delay=float(os.getenv("BATCH_HISTORY_WRITE_DELAY", 0.02))
+)
+batch_jobs = BatchJobManager()
+
+if cluster_bus is not None:
+    cluster_bus.on("batch_job_cancel", lambda data: batch_jobs.cancel(data.get("job_id")))
+
+async def run_batch_item(item: BatchItem) -> dict:
+    """
+    执行批量对话中的一项，返回该项的结果（出错时返回错误结果，不抛出异常）
+
+    与/chat相同地读取上下文、写入历史和计入限额，但以批量优先级排队，超出限额时等待
+    而不是直接拒绝，不与交互请求合并。
+    """
+    start = time.perf_counter()
+    session_key = item.session_key
+    try:
+        if chat is None:
+            return item.result(status="error", message="语言模型初始化失败")
+        if rate_limiter is not None:
+            deadline = time.monotonic() + BATCH_QUEUE_WAIT
+            while True:
+                result = await rate_limiter.acheck(item.user_host, session_key, count_tokens(item.message),
+                                                   None if USE_LOCAL_MODE else get_redis())
+                if result.allowed:
+                    break
+                if time.monotonic() + result.retry_after > deadline:
+                    return item.result(status="error", message="请求过于频繁，请稍后再试", limit=result.limit_name)
+                await asyncio.sleep(result.retry_after)
+
+        broadcast = TokenBroadcast()
+        await run_chat_turn(broadcast, create_message_history(session_key, item.user_host, history_write_batcher), session_key,
+                            item.user_host, item.message, None, False, BATCH)
+        return item.result(status="success", response="".join(broadcast.tokens),
+                           latency=round(time.perf_counter() - start, 3))
+    except SchedulerTimeout as e:
+        logger.warning(f"批量对话排队超时: {str(e)}")
+        return item.result(status="error", message="当前请求较多，请稍后再试",
+                           latency=round(time.perf_counter() - start, 3))
     except Exception as e:
-        print(f"Redis连接测试失败: {str(e)}")
-        print("应用将在本地模式下运行")
-else:
-    print("应用将在本地模式下运行，不使用Redis")
+        logger.error(f"批量对话第{item.index}项出错: {str(e)}")
+        return item.result(status="error", message="处理请求时出现错误",
+                           latency=round(time.perf_counter() - start, 3))
+
+async def read_batch_request(request: Request, max_items: int, parallelism: Optional[int]):
+    """
+    解析批量请求，返回 (items, 并发数)，格式错误或超过条数上限时返回错误响应
+
+    请求体为 {"items": [...], "parallelism": n}、JSON数组，或Content-Type为application/x-ndjson时每行一项
+    """
+    body = await request.body()
+    ndjson = "ndjson" in request.headers.get("content-type", "")
+    try:
+        items = parse_items(body, ndjson)
+    except ValueError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+    if not items:
+        return JSONResponse({"status": "error", "message": "items不能为空"}, status_code=400)
+    if len(items) > max_items:
+        return JSONResponse({"status": "error", "message": f"单次最多提交 {max_items} 项"}, status_code=413)
+    if parallelism is None and not ndjson:
+        data = json.loads(body)
+        if isinstance(data, dict) and isinstance(data.get("parallelism"), int):
+            parallelism = data["parallelism"]
+    parallelism = min(max(parallelism or BATCH_MAX_PARALLELISM, 1), BATCH_MAX_PARALLELISM)
+    return items, parallelism
+
+@app.post("/chat/batch")
+async def chat_batch_endpoint(request: Request, parallelism: Optional[int] = None):
+    """
+    批量对话：并发执行多项 {session_id, userHost, message}，每项完成后立即以NDJSON返回一行结果
+
+    同一会话的多项按提交顺序依次执行；最后一行为汇总 {"status": "done", ...}。
+    客户端断开时取消尚未完成的项。
+    """
+    if not startup_state["ready"]:
+        return not_ready_response()
+    parsed = await read_batch_request(request, BATCH_MAX_ITEMS, parallelism)
+    if isinstance(parsed, JSONResponse):
+        return parsed
+    items, parallelism = parsed
+    logger.info("收到批量对话请求，共 %s 项，并发 %s", len(items), parallelism)
+
+    async def ndjson_stream():
+        start = time.perf_counter()
+        succeeded = 0
+        async for result in run_batch(items, run_batch_item, parallelism):
+            succeeded += result["status"] == "success"
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({"status": "done", "total": len(items), "succeeded": succeeded,
+                          "failed": len(items) - succeeded, "latency": round(time.perf_counter() - start, 3)}) + "\n"
+
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
+
+@app.post("/chat/batch/jobs")
+async def create_chat_batch_job(request: Request, parallelism: Optional[int] = None):
+    """
+    以后台任务执行大批量对话，立即返回job_id；通过 /chat/batch/jobs/{job_id} 查询进度，
+    通过 /chat/batch/jobs/{job_id}/results 分页读取结果
+    """
+    if not startup_state["ready"]:
+        return not_ready_response()
+    parsed = await read_batch_request(request, BATCH_JOB_MAX_ITEMS, parallelism)
+    if isinstance(parsed, JSONResponse):
+        return parsed
+    items, parallelism = parsed
+    job = batch_jobs.start(items, run_batch_item, parallelism, lambda: None if USE_LOCAL_MODE else get_redis())
+    return {"status": "success", "message": "已开始批量对话任务", "job_id": job.job_id, "total": job.total}
+
+@app.get("/chat/batch/jobs/{job_id}")
+async def get_chat_batch_job(job_id: str):
+    """
+    查询批量对话任务的进度
+    """
+    try:
+        job = await batch_jobs.aget_status(job_id, None if USE_LOCAL_MODE else get_redis())
+    except Exception as e:
+        logger.error(f"查询批量任务失败: {str(e)}")
+        return {"status": "error", "message": f"查询批量任务失败: {str(e)}"}
+    if job is None:
+        return {"status": "error", "message": "未找到批量任务"}
+    return {"status": "success", "job": job}
+
+@app.get("/chat/batch/jobs/{job_id}/results")
+async def get_chat_batch_results(job_id: str, offset: int = 0, limit: int = 100):
+    """
+    按完成顺序分页读取批量对话任务的结果，next_offset为下一页的起点
+    """
+    offset, limit = max(offset, 0), min(max(limit, 1), 1000)
+    try:
+        results = await batch_jobs.aget_results(job_id, offset, limit, None if USE_LOCAL_MODE else get_redis())
+    except Exception as e:
+        logger.error(f"读取批量任务结果失败: {str(e)}")
+        return {"status": "error", "message": f"读取批量任务结果失败: {str(e)}"}
+    if results is None:
+        return {"status": "error", "message": "未找到批量任务"}
+    return {"status": "success", "results": results, "next_offset": offset + len(results)}
+
+@app.delete("/chat/batch/jobs/{job_id}")
+async def cancel_chat_batch_job(job_id: str):
+    """
+    取消批量对话任务，已完成的结果保留；任务由其他工作进程执行时通过集群事件通知该进程
+    """
+    if batch_jobs.cancel(job_id):
+        return {"status": "success", "message": "已取消批量任务"}
+    if cluster_bus is not None and await cluster_bus.apublish("batch_job_cancel", job_id=job_id):
+        return {"status": "success", "message": "已通知执行该任务的进程取消"}
+    return {"status": "error", "message": "未找到正在执行的批量任务"}
+
+# 后台批量删除任务管理器
+bulk_deleter = BulkDeleter()
 
 @app.post("/clear-redis")
 @app.get("/clear-redis")
-async def clear_redis_data():
+async def clear_redis_data(user_host: Optional[str] = Query(None, alias="userHost"), session_id: Optional[str] = None,
+                           clear_all: bool = Query(False, alias="all"), batch_size: int = DEFAULT_BATCH_SIZE):
     """
-    清空Redis中的所有数据
+    清空Redis中的会话数据
+
+    指定session_id时直接删除该会话的键（userHost默认为unknown，与/chat一致）；只指定userHost时
+    启动后台任务按该用户的会话索引删除；all=true时启动后台任务，使用SCAN MATCH分批UNLINK全部会话的键。
+    后台任务返回job_id，可通过 /clear-redis/{job_id} 查询进度。三者都未指定时不删除任何数据。
     """
     try:
-        global USE_LOCAL_MODE, redis_conn
-        
         # 检查是否处于本地模式
         if USE_LOCAL_MODE:
             logger.warning("当前处于本地模式，无法清空Redis数据")
             return {"status": "error", "message": "当前处于本地模式，无法清空Redis数据"}
-            
-        # 检查Redis连接状态
-        if not redis_conn or not redis_conn.ping():
-            logger.warning("Redis连接不可用，尝试重新连接...")
-            redis_conn = get_redis_connection()
-            if not redis_conn:
-                return {"status": "error", "message": "无法连接到Redis服务器"}
-        
-        # 获取所有键并删除
-        all_keys = redis_conn.keys("*")
-        if all_keys:
-            logger.info(f"正在删除 {len(all_keys)} 个Redis键")
-            redis_conn.delete(*all_keys)
-            logger.info("Redis数据已清空")
-            return {"status": "success", "message": f"已成功删除 {len(all_keys)} 个键"}
+
+        if not session_id and not user_host and not clear_all:
+            return {"status": "error", "message": "请指定session_id、userHost，或使用all=true清空全部会话"}
+
+        # 使用共享连接池（连接由连接池按需重建，无需每次ping）
+        redis_conn = get_redis()
+        if not redis_conn:
+            return {"status": "error", "message": "无法连接到Redis服务器"}
+
+        # 单个会话：直接删除已知的键
+        if session_id:
+            user_host = user_host or "unknown"
+            session_key = f"{user_host}_{session_id}"
+            deleted = await adelete_session(redis_conn, session_key, user_host)
+            invalidate_sessions(session_key)
+            if cluster_bus is not None:
+                cluster_bus.publish("sessions_cleared", session_key=session_key)
+            logger.info("已删除会话 %s 的 %s 个Redis键", session_key, deleted)
+            return {"status": "success", "message": f"已成功删除 {deleted} 个键"}
+
+        def on_finish(job):
+            invalidate_sessions(user_host=user_host)
+            if cluster_bus is not None:
+                cluster_bus.publish("sessions_cleared", user_host=user_host)
+
+        if user_host:
+            job = bulk_deleter.start_user(redis_conn, user_host, batch_size, on_finish)
         else:
-            logger.info("没有找到需要删除的Redis键")
-            return {"status": "success", "message": "Redis中没有任何数据需要删除"}
+            job = bulk_deleter.start(redis_conn, session_patterns(), batch_size, on_finish)
+        return {"status": "success", "message": "已开始后台删除任务", "job_id": job.job_id}
     except Exception as e:
         logger.error(f"清空Redis数据失败: {str(e)}")
         return {"status": "error", "message": f"清空Redis数据失败: {str(e)}"}
 
+@app.get("/clear-redis/{job_id}")
+async def get_clear_redis_status(job_id: str):
+    """
+    查询后台批量删除任务的进度
+    """
+    try:
+        job = await bulk_deleter.aget_status(job_id, None if USE_LOCAL_MODE else get_redis())
+    except Exception as e:
+        logger.error(f"查询删除任务失败: {str(e)}")
+        return {"status": "error", "message": f"查询删除任务失败: {str(e)}"}
+    if job is None:
+        return {"status": "error", "message": "未找到删除任务"}
+    return {"status": "success", "job": job}
+
+# /redis-data 每个集合类型键最多返回的元素数、单次请求最多执行的SCAN次数
+REDIS_DATA_VALUE_LIMIT = 100
+REDIS_DATA_MAX_SCANS = 100
+
+def queue_value_commands(pipe, key, key_type, value_limit):
+    """
+    按键类型向管道中加入有界的取值命令，返回该键占用的命令数
+    """
+    if key_type == "string":
+        pipe.get(key)
+        return 1
+    if key_type == "list":
+        pipe.lrange(key, 0, value_limit - 1)
+        pipe.llen(key)
+        return 2
+    if key_type == "hash":
+        pipe.hscan(key, 0, count=value_limit)
+        pipe.hlen(key)
+        return 2
+    if key_type == "set":
+        pipe.sscan(key, 0, count=value_limit)
+        pipe.scard(key)
+        return 2
+    if key_type == "zset":
+        pipe.zrange(key, 0, value_limit - 1, withscores=True)
+        pipe.zcard(key)
+        return 2
+    return 0
+
+def format_key_value(key, key_type, replies):
+    """
+    将取值命令的返回结果整理为易读格式
+    """
+    if key_type == "string":
+        return {"key": key, "type": key_type, "value": replies[0]}
+    if key_type == "list":
+        return {"key": key, "type": key_type, "value": replies[0], "length": replies[1]}
+    if key_type == "hash":
+        return {"key": key, "type": key_type, "value": replies[0][1], "length": replies[1]}
+    if key_type == "set":
+        return {"key": key, "type": key_type, "value": list(replies[0][1]), "length": replies[1]}
+    if key_type == "zset":
+        return {"key": key, "type": key_type, "value": replies[0], "length": replies[1]}
+    return {"key": key, "type": key_type, "value": "未知类型数据"}
+
 @app.get("/redis-data")
-async def get_redis_data():
+async def get_redis_data(pattern: str = "*", cursor: int = 0, skip: int = 0, count: int = 100,
+                         max_keys: int = 1000, value_limit: int = REDIS_DATA_VALUE_LIMIT):
     """
-    获取Redis中的所有数据并以易读格式返回
+    以NDJSON流式返回Redis中匹配pattern的键及其值
+
+    使用SCAN增量遍历键空间，每批键的TYPE和取值分别通过一次管道获取，
+    集合类型最多返回value_limit个元素。单次请求最多返回max_keys个键、执行REDIS_DATA_MAX_SCANS次SCAN
+    （匹配很少的pattern不会一直遍历下去），最后一行为 {"cursor": ..., "skip": ...}，
+    cursor或skip非0时携带这两个值（和相同的count）再次请求即可继续遍历。
+    一批键超出max_keys时只返回前面的部分，skip为该批中已返回的键数，下次请求重新扫描该批并跳过它们。
     """
     try:
-        global USE_LOCAL_MODE, redis_conn
-        
         # 检查是否处于本地模式
         if USE_LOCAL_MODE:
             logger.warning("当前处于本地模式，无法获取Redis数据")
             return {"status": "error", "message": "当前处于本地模式，无法获取Redis数据"}
             
-        # 检查Redis连接状态
-        if not redis_conn or not redis_conn.ping():
-            logger.warning("Redis连接不可用，尝试重新连接...")
-            redis_conn = get_redis_connection()
-            if not redis_conn:
-                return {"status": "error", "message": "无法连接到Redis服务器"}
-        
-        # 获取所有键
-        all_keys = redis_conn.keys("*")
-        logger.info(f"在Redis中找到 {len(all_keys)} 个键")
-        
-        # 获取每个键的类型和值
-        result = {}
-        for key in all_keys:
-            # 处理键名，确保是字符串
-            key_str = key.decode('utf-8') if isinstance(key, bytes) else str(key)
-            
-            # 获取键类型并确保是字符串
-            key_type_raw = redis_conn.type(key)
-            key_type = key_type_raw.decode('utf-8') if isinstance(key_type_raw, bytes) else str(key_type_raw)
-            
-            # 根据键类型获取值
-            if key_type == "string":
-                value = redis_conn.get(key)
-                result[key_str] = {"type": key_type, "value": value}
-            elif key_type == "list":
-                values = redis_conn.lrange(key, 0, -1)
-                result[key_str] = {"type": key_type, "value": values, "length": len(values)}
-            elif key_type == "hash":
-                values = redis_conn.hgetall(key)
-                result[key_str] = {"type": key_type, "value": values}
-            elif key_type == "set":
-                values = redis_conn.smembers(key)
-                result[key_str] = {"type": key_type, "value": list(values)}
-            elif key_type == "zset":
-                values = redis_conn.zrange(key, 0, -1, withscores=True)
-                result[key_str] = {"type": key_type, "value": values}
-            else:
-                result[key_str] = {"type": key_type, "value": "未知类型数据"}
-        
-        return {"status": "success", "data": result}
+        # 使用共享连接池（连接由连接池按需重建，无需每次ping）
+        redis_conn = get_redis()
+        if not redis_conn:
+            return {"status": "error", "message": "无法连接到Redis服务器"}
+
+        count = max(count, 1)
+        max_keys = max(max_keys, 1)
+        value_limit = max(value_limit, 1)
+
+        async def key_stream():
+            next_cursor = cursor
+            next_skip = 0
+            returned = 0
+            scans = 0
+            try:
+                while returned < max_keys and scans < REDIS_DATA_MAX_SCANS:
+                    batch_cursor = next_cursor
+                    next_cursor, batch = await redis_conn.scan(batch_cursor, match=pattern, count=count)
+                    start = max(skip, 0) if scans == 0 else 0
+                    scans += 1
+                    keys = batch[start:start + max_keys - returned]
+                    if start + len(keys) < len(batch):
+                        # 该批没有返回完：下次从该批的游标重新扫描并跳过已返回的键
+                        next_cursor, next_skip = batch_cursor, start + len(keys)
+                    if keys:
+                        # 第一次往返：批量获取键类型
+                        async with redis_conn.pipeline(transaction=False) as pipe:
+                            for key in keys:
+                                pipe.type(key)
+                            key_types = await pipe.execute()
+
+                        # 第二次往返：批量获取有界的键值
+                        async with redis_conn.pipeline(transaction=False) as pipe:
+                            sizes = [queue_value_commands(pipe, key, key_type, value_limit) for key, key_type in zip(keys, key_types)]
+                            replies = await pipe.execute()
+
+                        offset = 0
+                        for key, key_type, size in zip(keys, key_types, sizes):
+                            entry = format_key_value(key, key_type, replies[offset:offset + size])
+                            offset += size
+                            yield json.dumps(entry, ensure_ascii=False) + "\n"
+                        returned += len(keys)
+                    if next_cursor == 0 or next_skip:
+                        break
+                logger.info("本次从Redis返回 %s 个键，下一游标: %s，跳过: %s", returned, next_cursor, next_skip)
+                yield json.dumps({"cursor": next_cursor, "skip": next_skip, "returned": returned}) + "\n"
+            except Exception as e:
+                logger.error(f"获取Redis数据失败: {str(e)}")
+                yield json.dumps({"status": "error", "message": f"获取Redis数据失败: {str(e)}"}, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(key_stream(), media_type="application/x-ndjson")
     except Exception as e:
         logger.error(f"获取Redis数据失败: {str(e)}")
         return {"status": "error", "message": f"获取Redis数据失败: {str(e)}"}
 
+# NDJSON流式输出历史记录时每次LRANGE读取的条数
+HISTORY_STREAM_CHUNK = 200
+
 @app.get("/history")
-async def get_history(session_id: str, user_host: str = "unknown"):
+async def get_history(request: Request, session_id: str, user_host: str = "unknown",
+                      start: int = 0, limit: Optional[int] = None, before: Optional[int] = None,
+                      format: str = "json"):
     """
     获取指定会话的历史聊天记录
+
+    消息按从新到旧排列，支持两种分页方式：
+        start/limit: 从最新消息开始的偏移量和条数
+        before/limit: 游标分页，返回从最旧消息数起下标小于before的消息，
+                      响应中的next_before用于继续向前翻页，不受新消息写入影响
+    format=ndjson 时以NDJSON逐行流式返回；响应带有基于会话长度和版本号的ETag，
+    If-None-Match命中时直接返回304，不读取消息列表。
     """
+    if not startup_state["ready"]:
+        return not_ready_response()
     try:
-        global USE_LOCAL_MODE, redis_conn
-        
         # 详细记录当前存储模式
-        logger.info(f"当前存储模式: {'本地内存' if USE_LOCAL_MODE else 'Redis'}")
+        logger.debug("当前存储模式: %s", '本地内存' if USE_LOCAL_MODE else 'Redis')
         
-        # 检查Redis连接状态
-        if not USE_LOCAL_MODE and not redis_conn:
-            logger.warning("Redis连接不可用，自动切换到本地模式")
-            USE_LOCAL_MODE = True
+        # 检查Redis连接状态（只影响本次请求，连接恢复由后台任务负责）
+        redis_conn = get_redis()
+        use_local = USE_LOCAL_MODE or not redis_conn
             
         # 根据存储模式获取消息历史
-        if not USE_LOCAL_MODE:
-            try:
-                # 确保使用与/chat接口完全相同的Redis连接参数
-                host = 'redis-17542.c323.us-east-1-2.ec2.redns.redis-cloud.com'
-                port = 17542
-                redis_url = f"redis://default:{os.getenv('REDIS_PASSWORD')}@{host}:{port}"
-                logger.info(f"尝试连接Redis: {redis_url}")
-                
-                if not redis_conn or not redis_conn.ping():
-                    logger.info("Redis连接不可用，尝试重新连接...")
-                    redis_conn = get_redis_connection()
-                    if not redis_conn:
-                        raise Exception("Redis连接失败")
-                    logger.info("Redis重新连接成功")
-                else:
-                    logger.info("Redis连接正常")
-                
-                # 使用与/chat接口完全相同的session_key格式
-                session_key = f"{user_host}_{session_id}"
-                logger.info(f"使用会话键: {session_key}")
-                
-                # 检查Redis中是否存在该会话数据
-                redis_key = f"message_store:{session_key}"
-                if redis_conn.exists(redis_key):
-                    logger.info(f"在Redis中找到会话 {session_key} 的数据")
-                    
-                    # 获取Redis中的原始数据
-                    raw_data = redis_conn.lrange(redis_key, 0, -1)
-                    
-                    # 解析JSON格式的消息
-                    messages = []
-                    for item in raw_data:
-                        try:
-                            data = json.loads(item)
-                            if isinstance(data, dict) and 'type' in data:
-                                if data['type'] == 'human':
-                                    content = data.get('data', {}).get('content', '')
-                                    messages.append({"type": "human", "content": content})
-                                elif data['type'] == 'ai':
-                                    content = data.get('data', {}).get('content', '')
-                                    messages.append({"type": "ai", "content": content})
-                        except json.JSONDecodeError as e:
-                            logger.warning(f"解析JSON消息失败: {str(e)}")
-                            continue
-                    
-                    logger.info(f"成功解析 {len(messages)} 条消息")
-                    return {"status": "success", "messages": messages}
-                else:
-                    logger.warning(f"未在Redis中找到会话 {session_key} 的数据")
-                    return {"status": "error", "message": "未找到会话历史数据"}
-                
-            except Exception as e:
-                logger.error(f"获取Redis历史记录失败: {str(e)}")
-                return {"status": "error", "message": f"获取历史记录失败: {str(e)}"}
-        else:
-            # 本地模式 - 返回空数组
-            logger.info("本地模式: 返回空历史记录")
-            return {"status": "success", "messages": []}
+        try:
+            # 使用与/chat接口完全相同的session_key格式
+            session_key = f"{user_host}_{session_id}"
+            logger.debug("使用会话键: %s", session_key)
+            if use_local:
+                message_history = LocalChatMessageHistory(local_store, session_key)
+            else:
+                message_history = AsyncRedisChatMessageHistory(redis_client=redis_conn, session_id=session_key)
+
+            # 一次往返读取列表长度和版本号
+            total, version = await message_history.aget_state()
+            if not total:
+                logger.warning(f"未找到会话 {session_key} 的数据")
+                return {"status": "error", "message": "未找到会话历史数据"}
+
+            # 会话未变化时直接返回304
+            etag = f'"{version}-{total}"'
+            if request.headers.get("if-none-match") == etag:
+                logger.info("会话 %s 未变化，返回304", session_key)
+                return Response(status_code=304, headers={"ETag": etag})
+
+            # 将分页参数映射为LRANGE下标区间（下标0为最新消息）
+            page_size = total if limit is None else max(limit, 0)
+            if before is not None:
+                before = min(max(before, 0), total)
+                oldest = max(before - page_size, 0)
+                range_start, range_end = total - before, total - oldest - 1
+                cursor = {"next_before": oldest if oldest > 0 else None}
+            else:
+                range_start = max(start, 0)
+                range_end = min(range_start + page_size, total) - 1
+                cursor = {"next_start": range_end + 1 if range_end + 1 < total else None}
+
+            if format == "ndjson":
+                async def ndjson_stream():
+                    for chunk_start in range(range_start, range_end + 1, HISTORY_STREAM_CHUNK):
+                        chunk_end = min(chunk_start + HISTORY_STREAM_CHUNK - 1, range_end)
+                        for message in await message_history.aget_entries(chunk_start, chunk_end):
+                            yield json.dumps(message, ensure_ascii=False) + "\n"
+
+                return StreamingResponse(
+                    ndjson_stream(),
+                    media_type="application/x-ndjson",
+                    headers={"ETag": etag, "X-Total-Count": str(total)}
+                )
+
+            messages = []
+            if range_end >= range_start:
+                messages = await message_history.aget_entries(range_start, range_end)
+
+            logger.info("成功解析 %s 条消息", len(messages))
+            return JSONResponse(
+                {"status": "success", "messages": messages, "total": total, **cursor},
+                headers={"ETag": etag}
+            )
+            
+        except Exception as e:
+            logger.error(f"获取历史记录失败: {str(e)}")
+            return {"status": "error", "message": f"获取历史记录失败: {str(e)}"}
             
     except Exception as e:
         logger.error(f"获取历史记录时发生未知错误: {str(e)}")
@@ -401,6 +1289,122 @@ async def get_history(session_id: str, user_host: str = "unknown"):
         logger.error(f"获取历史记录失败: {str(e)}")
         return {"status": "error", "message": f"获取历史记录失败: {str(e)}"}
 
+@app.get("/health/live")
+async def liveness():
+    """
+    存活检查：进程能处理请求即返回200，不检查任何依赖
+    """
+    return {"status": "success", "alive": True}
+
+@app.get("/health/ready")
+async def readiness():
+    """
+    就绪检查：启动完成（LLM已创建、Redis已完成首次探测）后返回200，否则返回503
+
+    Redis断开时服务以本地模式继续运行，仍视为就绪，storage_mode中给出当前存储模式
+    """
+    body = {
+        "status": "success" if startup_state["ready"] else "error",
+        "ready": startup_state["ready"],
+        "storage_mode": "local" if USE_LOCAL_MODE else "redis",
+        **startup_state,
+        "redis_connection": redis_manager.stats()
+    }
+    return JSONResponse(body, status_code=200 if startup_state["ready"] else 503)
+
+def generation_summary() -> dict:
+    """
+    返回生成与取消统计，按已完成回答的平均长度估算取消节省的输出token数
+    """
+    completed = generation_stats["completed"]
+    average = generation_stats["completion_tokens"] / completed if completed else 0.0
+    estimated_saved = generation_stats["cancelled"] * average - generation_stats["cancelled_completion_tokens"]
+    return {
+        "cancel_on_disconnect": CHAT_CANCEL_ON_DISCONNECT,
+        "partial_response_policy": CHAT_PARTIAL_RESPONSE_POLICY,
+        "average_completion_tokens": average,
+        "estimated_saved_tokens": max(0, int(estimated_saved)),
+        **generation_stats
+    }
+
+@app.get("/stats")
+async def get_stats():
+    """
+    获取运行时统计信息
+    """
+    return {
+        "status": "success",
+        "storage_mode": "local" if USE_LOCAL_MODE else "redis",
+        "local_store": local_store.stats(),
+        "session_cache": session_cache.stats() if session_cache else None,
+        "response_cache": response_cache.stats() if response_cache else None,
+        "singleflight": chat_flights.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "rate_limiter": rate_limiter.stats() if rate_limiter else None,
+        "llm_router": chat.stats() if isinstance(chat, LLMRouter) else None,
+        "generation": generation_summary(),
+        "redis_connection": redis_manager.stats(),
+        "write_buffer": write_buffer.stats(),
+        "history_maintenance": history_maintainer.stats() if history_maintainer.enabled else None,
+        "cluster": cluster_bus.stats() if cluster_bus else None,
+        "batch": {**batch_jobs.stats(), "history_writes": history_write_batcher.stats()},
+        "websocket": {
+            "connections": len(chat_sockets),
+            "sessions": sum(conn.stats()["sessions"] for conn in chat_sockets),
+            "active_turns": sum(conn.stats()["turns"] for conn in chat_sockets),
+            **socket_stats
+        }
+    }
+
+def collect_app_metrics():
+    """
+    抓取指标时读取调度器、缓存和合并请求的当前状态
+    """
+    scheduler = llm_scheduler.stats()
+    families = [
+        ("llm_inflight", "gauge", "正在进行的上游补全数", [({}, scheduler["in_flight"])]),
+        ("llm_concurrency_limit", "gauge", "自适应并发上限", [({}, scheduler["limit"])]),
+        ("llm_queue_depth", "gauge", "等待上游名额的请求数", [({}, scheduler["queue_depth"])]),
+        ("llm_batch_inflight", "gauge", "正在进行的批量上游补全数", [({}, scheduler["batch_in_flight"])]),
+        ("llm_batch_queue_depth", "gauge", "等待上游名额的批量请求数", [({}, scheduler["batch_queue_depth"])]),
+        ("chat_singleflight_in_flight", "gauge", "进行中的合并生成数", [({}, chat_flights.stats()["in_flight"])]),
+        ("chat_websocket_connections", "gauge", "打开的WebSocket对话连接数", [({}, len(chat_sockets))]),
+        ("storage_local_mode", "gauge", "是否处于本地存储模式", [({}, 1 if USE_LOCAL_MODE else 0)]),
+        ("redis_circuit_open", "gauge", "Redis熔断器是否未关闭（打开或半开）", [({}, 0 if redis_breaker.closed else 1)]),
+        ("redis_write_buffer_pending", "gauge", "等待回放到Redis的缓冲写入数", [({}, len(write_buffer))]),
+        ("redis_write_buffer_dropped_total", "counter", "写入缓冲已满时丢弃的写入数", [({}, write_buffer.stats()["dropped"])])
+    ]
+    if cluster_bus is not None:
+        families.append(("cluster_bus_connected", "gauge", "是否已订阅集群事件频道", [({}, 1 if cluster_bus.connected else 0)]))
+    if session_cache is not None:
+        cache = session_cache.stats()
+        families.append(("session_cache_sessions", "gauge", "会话缓存中的会话数", [({}, cache["sessions"])]))
+        families.append(("session_cache_lookups_total", "counter", "会话缓存查询次数",
+                         [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])]))
+    if isinstance(chat, LLMRouter):
+        endpoints = chat.stats()["endpoints"]
+        families.append(("llm_endpoint_latency_seconds", "gauge", "上游端点首token延迟的EWMA",
+                         [({"endpoint": e["name"]}, e["latency"] or 0.0) for e in endpoints]))
+        families.append(("llm_endpoint_error_rate", "gauge", "上游端点错误率的EWMA",
+                         [({"endpoint": e["name"]}, e["error_rate"]) for e in endpoints]))
+    return families
+
+REGISTRY.add_collector(collect_app_metrics)
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    以Prometheus文本格式导出指标
+    """
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+
+    # 监听地址和端口；WEB_CONCURRENCY>1时启动多个工作进程，每个进程各自导入本模块并初始化
+    host = os.getenv("HOST", "127.0.0.1")
+    port = int(os.getenv("PORT", 8000))
+    if WEB_CONCURRENCY > 1:
+        uvicorn.run("main:app", host=host, port=port, workers=WEB_CONCURRENCY)
+    else:
+        uvicorn.run(app, host=host, port=port)
\ No newline at end of file
@@ -3,23 +3,39 @@ from langchain_community.chat_message_histories import RedisChatMessageHistory
 import hashlib
 import redis
 from logger_config import get_module_logger
+from chat_history import VERSION_KEY_PREFIX
+from redis_cleanup import DEFAULT_BATCH_SIZE, session_keys, session_patterns, queue_bump_versions
 
 # 获取模块日志记录器
 logger = get_module_logger("memory_store")
 
-def clear_all_redis_data(url: str):
-    """清除Redis中所有会话数据"""
+def _delete_batch(r, keys) -> int:
+    """删除一批键，版本号键改为递增（与redis_cleanup.BulkDeleter一致）"""
+    versions = [key for key in keys if key.decode().startswith(VERSION_KEY_PREFIX)]
+    others = [key for key in keys if not key.decode().startswith(VERSION_KEY_PREFIX)]
+    pipe = r.pipeline(transaction=False)
+    if others:
+        pipe.unlink(*others)
+    queue_bump_versions(pipe, versions)
+    results = pipe.execute()
+    return results[0] if others else 0
+
+def clear_all_redis_data(url: str, batch_size: int = DEFAULT_BATCH_SIZE):
+    """清除Redis中所有会话数据（SCAN MATCH分批UNLINK，不阻塞Redis，不影响其他数据）"""
     try:
         r = redis.Redis.from_url(url)
-        if not r.ping():
-            logger.error("Redis连接测试失败")
-            return False
-            
-        keys = r.keys('*')
-        if keys:
-            logger.info(f"正在删除{len(keys)}个Redis键")
-            r.delete(*keys)
-            logger.info("Redis数据清除完成")
+        deleted = 0
+        for pattern in session_patterns():
+            batch = []
+            for key in r.scan_iter(match=pattern, count=batch_size):
+                batch.append(key)
+                if len(batch) >= batch_size:
+                    deleted += _delete_batch(r, batch)
+                    batch = []
+            if batch:
+                deleted += _delete_batch(r, batch)
+        if deleted:
+            logger.info(f"Redis会话数据清除完成，共删除{deleted}个键")
             return True
         logger.info("没有找到需要删除的Redis键")
         return False
@@ -69,13 +85,15 @@ def get_memory(user_host: str, session_id: str, is_new_session: bool = False, cl
             logger.info(f"清空会话 {session_id[:8]}... 的历史记录")
             message_history.clear()
             
-            # 清除所有相关Redis键
+            # 直接删除该会话的相关键（摘要检查点、归档）并递增版本号，无需扫描键空间
             try:
                 r = redis.Redis.from_url(redis_url)
-                keys = r.keys(f"*{session_key}*")
-                if keys:
-                    r.delete(*keys)
-                    logger.info(f"已删除 {len(keys)} 个相关Redis键")
+                pipe = r.pipeline(transaction=False)
+                pipe.unlink(*session_keys(session_key))
+                queue_bump_versions(pipe, [VERSION_KEY_PREFIX + session_key])
+                deleted = pipe.execute()[0]
+                if deleted:
+                    logger.info(f"已删除 {deleted} 个相关Redis键")
             except Exception as e:
                 logger.warning(f"清除Redis键时出错: {str(e)}")
     except Exception as e:
@@ -0,0 +1,282 @@
+import bisect
+import os
+import time
+import uuid
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+from logger_config import get_module_logger, request_id_var
+
+# 获取模块日志记录器
+logger = get_module_logger("metrics")
+
+# 默认的延迟直方图分桶（秒）
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Redis命令延迟分桶（秒）
+REDIS_LATENCY_BUCKETS = (0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# 生成速度分桶（token/秒）
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320)
+
+# Prometheus文本格式的Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Registry:
+    """
+    指标注册表，按注册顺序输出Prometheus文本格式
+
+    除了直接更新的指标外，还可以注册采集函数，在每次抓取时读取连接池、调度器等组件的当前状态。
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, List[Tuple[dict, float]]]]]):
+        """
+        注册采集函数，函数返回 (指标名, 类型, 说明, [(标签字典, 值), ...]) 的序列
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """按Prometheus文本格式输出所有指标"""
+        lines = []
+        for metric in self._metrics:
+            metric.render(lines)
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                logger.warning(f"采集指标失败: {str(e)}")
+                continue
+            for name, metric_type, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        lines.append("")
+        return "\n".join(lines)
+
+# 全局注册表
+REGISTRY = Registry()
+
+class Counter:
+    """只增不减的计数器"""
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        registry.register(self)
+
+    def inc(self, amount: float = 1.0, labels: tuple = ()):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self, lines: list):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} {self.metric_type}")
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+
+class Gauge(Counter):
+    """可增可减的当前值"""
+
+    metric_type = "gauge"
+
+    def dec(self, amount: float = 1.0, labels: tuple = ()):
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def set(self, value: float, labels: tuple = ()):
+        self._values[labels] = value
+
+class Histogram:
+    """
+    固定分桶的直方图
+
+    每次observe只做一次二分查找和几次加法，输出时再计算累计分桶
+    """
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS, registry: Registry = REGISTRY):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各分桶计数..., 超出最大分桶的计数, 总和, 次数]
+        self._values = {}
+        registry.register(self)
+
+    def observe(self, value: float, labels: tuple = ()):
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    def time(self, labels: tuple = ()) -> "Timer":
+        """返回一个计时上下文，退出时记录耗时"""
+        return Timer(self, labels)
+
+    def render(self, lines: list):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} histogram")
+        names = self.labelnames + ("le",)
+        for labels, data in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), data):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(data[-2])}")
+            lines.append(f"{self.name}_count{label_text} {data[-1]}")
+
+class Timer:
+    """记录一段代码耗时的上下文管理器"""
+
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: tuple = ()):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+        return False
+
+# 请求路径上的指标
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "正在处理的HTTP请求数")
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP请求耗时（流式响应包含整个流）",
+                                 ("method", "route", "status"))
+CHAT_STAGE_SECONDS = Histogram("chat_stage_duration_seconds",
+                               "一轮对话各阶段耗时：redis_lookup、history_decode、prompt_build、queue_wait、ttft、generation、history_write",
+                               ("stage",))
+CHAT_TOKENS_PER_SECOND = Histogram("chat_generation_tokens_per_second", "首个token之后的生成速度（token/秒）",
+                                   buckets=TOKENS_PER_SECOND_BUCKETS)
+CHAT_PROMPT_TOKENS = Counter("chat_prompt_tokens_total", "发送给模型的上下文token数（估算）")
+CHAT_COMPLETION_TOKENS = Counter("chat_completion_tokens_total", "模型输出的token数（估算）")
+CHAT_TURNS = Counter("chat_turns_total", "对话轮数，按结果区分：completed、cached、cancelled、error", ("result",))
+REDIS_COMMAND_SECONDS = Histogram("redis_command_duration_seconds", "Redis命令往返耗时（管道和事务按一次往返计）",
+                                  ("command",), buckets=REDIS_LATENCY_BUCKETS)
+REDIS_COMMAND_ERRORS = Counter("redis_command_errors_total", "失败的Redis命令数", ("command",))
+HISTORY_REHYDRATIONS = Counter("chat_history_rehydrations_total", "被访问时从归档恢复的会话数")
+APP_STARTUP_SECONDS = Gauge("app_startup_seconds",
+                           "从模块开始导入到各启动阶段的耗时：lifespan（开始服务）、ready（就绪）、first_request（首个请求完成）",
+                           ("phase",))
+
+def collect_process_metrics():
+    """
+    抓取指标时读取当前进程的内存占用（Linux读取/proc，其他平台只提供峰值）
+    """
+    families = []
+    try:
+        with open("/proc/self/statm") as f:
+            resident = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        families.append(("process_resident_memory_bytes", "gauge", "进程当前的常驻内存（字节）", [({}, resident)]))
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux以KB为单位，macOS以字节为单位
+        peak = peak if sys.platform == "darwin" else peak * 1024
+        families.append(("process_max_resident_memory_bytes", "gauge", "进程常驻内存的峰值（字节）", [({}, peak)]))
+    except ImportError:
+        pass
+    return families
+
+REGISTRY.add_collector(collect_process_metrics)
+
+def stage_timer(stage: str) -> Timer:
+    """
+    对一轮对话中的一个阶段计时
+
+    用法:
+        with stage_timer("history_write"):
+            ...
+    """
+    return Timer(CHAT_STAGE_SECONDS, (stage,))
+
+def observe_stage(stage: str, seconds: float):
+    """记录一个阶段的耗时（无法使用with包裹时使用）"""
+    CHAT_STAGE_SECONDS.observe(seconds, (stage,))
+
+class MetricsMiddleware:
+    """
+    ASGI中间件：统计进行中的请求数和请求耗时，以及冷启动后首个请求完成的时间
+
+    trace_ids为True时为每个请求设置请求ID（沿用客户端的X-Request-ID，否则新生成），
+    写入日志上下文并在响应头中返回，同一请求触发的后台任务也会继承该ID
+    """
+
+    def __init__(self, app, trace_ids: bool = False, started_at: Optional[float] = None):
+        self.app = app
+        self.trace_ids = trace_ids
+        # 冷启动计时起点（time.perf_counter()），用于记录首个请求完成的时间
+        self.started_at = started_at
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = None
+        if self.trace_ids:
+            request_id = None
+            for name, value in scope.get("headers", ()):
+                if name == b"x-request-id":
+                    request_id = value.decode("latin-1")[:64]
+                    break
+            request_id = request_id or uuid.uuid4().hex[:16]
+            token = request_id_var.set(request_id)
+            header = (b"x-request-id", request_id.encode("latin-1"))
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if token is not None:
+                    message["headers"] = [*message.get("headers", ()), header]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                (scope["method"], getattr(route, "path", "unmatched"), status[0])
+            )
+            if token is not None:
+                request_id_var.reset(token)
+            if self.started_at is not None:
+                APP_STARTUP_SECONDS.set(time.perf_counter() - self.started_at, ("first_request",))
+                self.started_at = None
@@ -0,0 +1,184 @@
+import math
+import time
+from typing import List, Optional, Tuple
+from logger_config import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("rate_limiter")
+
+# Redis中令牌桶的键前缀
+RATE_LIMIT_KEY_PREFIX = "ratelimit:"
+
+# 进程内令牌桶数量超过该值时清理已补满的桶
+MAX_LOCAL_BUCKETS = 10000
+
+# 原子地检查并扣减多个令牌桶：全部桶都有足够令牌时才一起扣减
+# KEYS: 各个桶的键；ARGV: 每个桶依次为 容量、每秒补充量、本次消耗，最后一个参数为force（1表示不检查直接扣减）
+# 返回: {是否允许, 最长需等待的毫秒数, 受限的桶下标（从1开始，0表示无）}
+_TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local force = tonumber(ARGV[#ARGV]) == 1
+local levels = {}
+local wait = 0
+local limited = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 1])
+    local rate = tonumber(ARGV[(i - 1) * 3 + 2])
+    local cost = tonumber(ARGV[(i - 1) * 3 + 3])
+    local data = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) / 1000 * rate)
+    levels[i] = tokens
+    if not force and tokens < cost then
+        local need = math.ceil((cost - tokens) / rate * 1000)
+        if need > wait then
+            wait = need
+            limited = i
+        end
+    end
+end
+local allowed = (force or limited == 0) and 1 or 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 1])
+    local rate = tonumber(ARGV[(i - 1) * 3 + 2])
+    local cost = tonumber(ARGV[(i - 1) * 3 + 3])
+    local tokens = levels[i]
+    if allowed == 1 then
+        tokens = tokens - cost
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil((capacity - tokens) / rate * 1000) + 1000)
+end
+return {allowed, wait, limited}
+"""
+
+class Bucket:
+    """
+    一个令牌桶的定义：键名、每分钟容量、本次消耗
+    """
+
+    def __init__(self, name: str, key: str, per_minute: int, cost: float):
+        self.name = name
+        self.key = key
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.cost = float(cost)
+
+class RateLimitResult:
+    """限流检查结果"""
+
+    def __init__(self, allowed: bool, retry_after: float = 0.0, limit_name: Optional[str] = None):
+        self.allowed = allowed
+        self.retry_after = retry_after
+        self.limit_name = limit_name
+
+    @property
+    def reset_at(self) -> int:
+        """可以再次请求的Unix时间戳（秒）"""
+        return math.ceil(time.time() + self.retry_after)
+
+class RateLimiter:
+    """
+    按user_host和会话的令牌桶限流
+
+    分别限制每分钟请求数（rpm）和每分钟token数（tpm），限流值为0表示不限制。
+    Redis可用时使用Lua脚本原子地检查并扣减所有桶，多个工作进程共享限额；
+    本地模式或Redis出错时使用进程内的令牌桶。
+    请求前按输入估算的token数预扣，补全结束后再补扣上下文和输出的token（允许透支）。
+    """
+
+    def __init__(self, user_rpm: int = 0, user_tpm: int = 0, session_rpm: int = 0, session_tpm: int = 0):
+        self.user_rpm = user_rpm
+        self.user_tpm = user_tpm
+        self.session_rpm = session_rpm
+        self.session_tpm = session_tpm
+        # 进程内令牌桶：键 -> (令牌数, 上次更新时间, 补满时间)
+        self._local = {}
+        self._stats = {"allowed": 0, "limited": 0, "redis_errors": 0}
+
+    def buckets(self, user_host: str, session_key: str, requests: int, tokens: float) -> List[Bucket]:
+        """
+        返回本次请求涉及的令牌桶
+        """
+        specs = [
+            ("user_rpm", f"user:{user_host}:rpm", self.user_rpm, requests),
+            ("user_tpm", f"user:{user_host}:tpm", self.user_tpm, tokens),
+            ("session_rpm", f"session:{session_key}:rpm", self.session_rpm, requests),
+            ("session_tpm", f"session:{session_key}:tpm", self.session_tpm, tokens)
+        ]
+        return [Bucket(name, RATE_LIMIT_KEY_PREFIX + key, limit, cost)
+                for name, key, limit, cost in specs if limit > 0 and cost > 0]
+
+    def _take_local(self, buckets: List[Bucket], force: bool) -> Tuple[bool, float, int]:
+        now = time.monotonic()
+        levels = []
+        wait = 0.0
+        limited = 0
+        for i, bucket in enumerate(buckets, 1):
+            tokens, ts, _ = self._local.get(bucket.key, (bucket.capacity, now, now))
+            tokens = min(bucket.capacity, tokens + (now - ts) * bucket.rate)
+            levels.append(tokens)
+            if not force and tokens < bucket.cost:
+                need = (bucket.cost - tokens) / bucket.rate
+                if need > wait:
+                    wait, limited = need, i
+        allowed = force or limited == 0
+        for bucket, tokens in zip(buckets, levels):
+            if allowed:
+                tokens -= bucket.cost
+            self._local[bucket.key] = (tokens, now, now + (bucket.capacity - tokens) / bucket.rate)
+        if len(self._local) > MAX_LOCAL_BUCKETS:
+            # 已补满的桶与不存在的桶等价，可以直接删除
+            self._local = {key: value for key, value in self._local.items() if value[2] > now}
+        return allowed, wait, limited
+
+    async def _take(self, buckets: List[Bucket], redis_client, force: bool) -> Tuple[bool, float, int]:
+        if redis_client is not None:
+            args = []
+            for bucket in buckets:
+                args.extend([bucket.capacity, bucket.rate, bucket.cost])
+            args.append(1 if force else 0)
+            try:
+                allowed, wait_ms, limited = await redis_client.eval(
+                    _TOKEN_BUCKET_SCRIPT, len(buckets), *[bucket.key for bucket in buckets], *args
+                )
+                return bool(allowed), int(wait_ms) / 1000.0, int(limited)
+            except Exception as e:
+                self._stats["redis_errors"] += 1
+                logger.warning(f"Redis限流检查失败，使用进程内令牌桶: {str(e)}")
+        return self._take_local(buckets, force)
+
+    async def acheck(self, user_host: str, session_key: str, tokens: float, redis_client=None) -> RateLimitResult:
+        """
+        检查并扣减一次请求和预估的token数
+        """
+        buckets = self.buckets(user_host, session_key, 1, tokens)
+        if not buckets:
+            return RateLimitResult(True)
+        allowed, wait, limited = await self._take(buckets, redis_client, force=False)
+        if allowed:
+            self._stats["allowed"] += 1
+            return RateLimitResult(True)
+        self._stats["limited"] += 1
+        return RateLimitResult(False, wait, buckets[limited - 1].name if limited else None)
+
+    async def acharge(self, user_host: str, session_key: str, tokens: float, redis_client=None):
+        """
+        补扣实际消耗的token（不检查余额，允许透支）
+        """
+        buckets = self.buckets(user_host, session_key, 0, tokens)
+        if buckets:
+            await self._take(buckets, redis_client, force=True)
+
+    def stats(self) -> dict:
+        """返回限流统计"""
+        return {
+            "user_rpm": self.user_rpm,
+            "user_tpm": self.user_tpm,
+            "session_rpm": self.session_rpm,
+            "session_tpm": self.session_tpm,
+            "local_buckets": len(self._local),
+            **self._stats
+        }
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import re
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, List, Optional
+from logger_config import get_module_logger
+from chat_history import (DEFAULT_KEY_PREFIX, VERSION_KEY_PREFIX, ARCHIVE_KEY_PREFIX, ACTIVITY_KEY,
+                          USER_SESSIONS_KEY_PREFIX)
+from session_summary import SUMMARY_KEY_PREFIX
+
+# 获取模块日志记录器
+logger = get_module_logger("redis_cleanup")
+
+# 删除会话时移除的键前缀：消息列表、摘要检查点、归档
+# 版本号键不删除而是递增，否则重新写入的会话会得到与已删除数据相同的(版本号, 长度)，
+# 其他进程的会话缓存和/history的ETag会把已删除的内容当作有效数据
+SESSION_KEY_PREFIXES = (DEFAULT_KEY_PREFIX, SUMMARY_KEY_PREFIX, ARCHIVE_KEY_PREFIX)
+
+# 默认每批SCAN/UNLINK的键数量、保留的任务记录数量
+DEFAULT_BATCH_SIZE = 500
+MAX_JOB_HISTORY = 100
+# 任务状态在Redis中的键前缀和保留时间（秒），任意工作进程都可以查询
+JOB_KEY_PREFIX = "bulk_delete_job:"
+JOB_STATUS_TTL = 86400
+
+_GLOB_SPECIAL = re.compile(r"([\\*?\[\]])")
+
+# 递增已存在的版本号键（保留其TTL），不存在时不创建
+_BUMP_VERSION_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCR', KEYS[1])
+end
+return 0
+"""
+
+def queue_bump_versions(pipe, version_keys: List[str]):
+    """
+    向管道中加入递增一组版本号键的命令，使依赖版本号的缓存和ETag全部失效
+    """
+    for key in version_keys:
+        pipe.eval(_BUMP_VERSION_SCRIPT, 1, key)
+
+def escape_pattern(text: str) -> str:
+    """
+    转义SCAN MATCH中的通配符，使用户输入按字面匹配
+    """
+    return _GLOB_SPECIAL.sub(r"\\\1", text)
+
+def session_keys(session_key: str) -> List[str]:
+    """
+    返回删除一个会话时需要移除的键名（不含版本号键）
+    """
+    return [prefix + session_key for prefix in SESSION_KEY_PREFIXES]
+
+def session_patterns() -> List[str]:
+    """
+    返回删除全部会话时使用的SCAN MATCH模式（包括会话写入时间集合和用户的会话索引）
+
+    匹配到的版本号键由BulkDeleter递增而不是删除。按用户删除不使用模式匹配，
+    见BulkDeleter.start_user。
+    """
+    prefixes = SESSION_KEY_PREFIXES + (VERSION_KEY_PREFIX, USER_SESSIONS_KEY_PREFIX)
+    return [prefix + "*" for prefix in prefixes] + [ACTIVITY_KEY]
+
+def queue_delete_sessions(pipe, session_ids: List[str], user_host: Optional[str] = None):
+    """
+    向管道中加入删除一组会话的命令：UNLINK会话的键、递增版本号、移除写入时间和用户索引中的记录
+
+    第一条命令（UNLINK）的结果为删除的键数量
+    """
+    pipe.unlink(*(key for session_id in session_ids for key in session_keys(session_id)))
+    queue_bump_versions(pipe, [VERSION_KEY_PREFIX + session_id for session_id in session_ids])
+    pipe.zrem(ACTIVITY_KEY, *session_ids)
+    if user_host is not None:
+        pipe.srem(USER_SESSIONS_KEY_PREFIX + user_host, *session_ids)
+
+async def adelete_session(redis_client, session_key: str, user_host: Optional[str] = None) -> int:
+    """
+    直接删除单个会话的全部键（O(1)，不扫描键空间），并递增其版本号
+
+    参数:
+        user_host: 会话所属的用户，指定时同时从该用户的会话索引中移除
+
+    返回:
+        实际删除的键数量
+    """
+    async with redis_client.pipeline(transaction=True) as pipe:
+        queue_delete_sessions(pipe, [session_key], user_host)
+        results = await pipe.execute()
+    return results[0]
+
+class BulkDeleteJob:
+    """
+    一次后台批量删除任务的状态
+    """
+
+    def __init__(self, patterns: List[str], batch_size: int, user_host: Optional[str] = None):
+        self.job_id = uuid.uuid4().hex
+        self.patterns = patterns
+        # 按用户删除时为该用户，遍历其会话索引而不是匹配模式
+        self.user_host = user_host
+        self.batch_size = batch_size
+        self.status = "pending"
+        self.scanned = 0
+        self.deleted = 0
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "patterns": self.patterns,
+            "user_host": self.user_host,
+            "status": self.status,
+            "scanned": self.scanned,
+            "deleted": self.deleted,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+class BulkDeleter:
+    """
+    基于SCAN MATCH + UNLINK的后台批量删除
+
+    每批最多扫描batch_size个键并用UNLINK异步释放（版本号键改为递增），批次之间让出事件循环，
+    不会像KEYS + DEL那样长时间阻塞Redis服务器。按用户删除时用SSCAN遍历该用户的会话索引，
+    只删除索引中的会话；该用户还没有索引时按键名前缀扫描。任务状态保存在进程内（保留最近MAX_JOB_HISTORY个），
+    同时在每批之后写入Redis，多个工作进程时由其他进程处理的查询也能读到进度。
+    """
+
+    def __init__(self, max_history: int = MAX_JOB_HISTORY):
+        self.max_history = max_history
+        self.jobs = OrderedDict()
+        self._tasks = set()
+
+    def start(self, redis_client, patterns: List[str], batch_size: int = DEFAULT_BATCH_SIZE,
+              on_finish: Optional[Callable[[BulkDeleteJob], None]] = None) -> BulkDeleteJob:
+        """
+        启动一个后台删除任务并立即返回任务对象
+
+        参数:
+            on_finish: 任务成功完成后调用
+        """
+        return self._start(redis_client, BulkDeleteJob(patterns, max(batch_size, 1)), on_finish)
+
+    def start_user(self, redis_client, user_host: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                   on_finish: Optional[Callable[[BulkDeleteJob], None]] = None) -> BulkDeleteJob:
+        """
+        启动一个删除指定用户全部会话的后台任务并立即返回任务对象
+        """
+        job = BulkDeleteJob([USER_SESSIONS_KEY_PREFIX + user_host], max(batch_size, 1), user_host)
+        return self._start(redis_client, job, on_finish)
+
+    def _start(self, redis_client, job: BulkDeleteJob, on_finish) -> BulkDeleteJob:
+        self.jobs[job.job_id] = job
+        while len(self.jobs) > self.max_history:
+            self.jobs.popitem(last=False)
+        task = asyncio.create_task(self._run(redis_client, job, on_finish))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id: str) -> Optional[BulkDeleteJob]:
+        """查询本进程的任务状态"""
+        return self.jobs.get(job_id)
+
+    async def aget_status(self, job_id: str, redis_client=None) -> Optional[dict]:
+        """
+        查询任务状态，本进程中没有时从Redis读取（任务可能由其他工作进程执行）
+        """
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if redis_client is None:
+            return None
+        value = await redis_client.get(JOB_KEY_PREFIX + job_id)
+        return json.loads(value) if value is not None else None
+
+    async def _save(self, redis_client, job: BulkDeleteJob):
+        try:
+            await redis_client.set(JOB_KEY_PREFIX + job.job_id, json.dumps(job.to_dict(), ensure_ascii=False),
+                                   ex=JOB_STATUS_TTL)
+        except Exception as e:
+            logger.warning(f"保存删除任务 {job.job_id} 的状态失败: {str(e) or type(e).__name__}")
+
+    @staticmethod
+    async def _delete_keys(redis_client, keys: List[str]) -> int:
+        versions = [key for key in keys if key.startswith(VERSION_KEY_PREFIX)]
+        others = [key for key in keys if not key.startswith(VERSION_KEY_PREFIX)]
+        async with redis_client.pipeline(transaction=False) as pipe:
+            if others:
+                pipe.unlink(*others)
+            queue_bump_versions(pipe, versions)
+            results = await pipe.execute()
+        return results[0] if others else 0
+
+    async def _delete_user_sessions(self, redis_client, job: BulkDeleteJob):
+        index_key = USER_SESSIONS_KEY_PREFIX + job.user_host
+        if not await redis_client.exists(index_key):
+            # 会话索引之前写入的用户没有索引，改为按键名前缀扫描
+            await self._delete_legacy_user_sessions(redis_client, job)
+            return
+        cursor = 0
+        while True:
+            cursor, session_ids = await redis_client.sscan(index_key, cursor, count=job.batch_size)
+            job.scanned += len(session_ids)
+            if session_ids:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    queue_delete_sessions(pipe, session_ids, job.user_host)
+                    results = await pipe.execute()
+                job.deleted += results[0]
+                await self._save(redis_client, job)
+            if cursor == 0:
+                break
+            await asyncio.sleep(0)
+        await redis_client.unlink(index_key)
+
+    async def _delete_legacy_user_sessions(self, redis_client, job: BulkDeleteJob):
+        """
+        删除没有会话索引的用户的会话：SCAN MATCH "{userHost}_*"匹配会话键
+
+        userHost以"{userHost}_"开头的其他用户的键也会被匹配到，其中记录在这些用户会话索引里的会话会被跳过
+        """
+        prefix = escape_pattern(job.user_host) + "_*"
+        other_indexes = [key async for key in redis_client.scan_iter(
+            match=USER_SESSIONS_KEY_PREFIX + prefix, count=job.batch_size)]
+        for key_prefix in SESSION_KEY_PREFIXES:
+            cursor = 0
+            while True:
+                cursor, keys = await redis_client.scan(cursor, match=key_prefix + prefix, count=job.batch_size)
+                job.scanned += len(keys)
+                session_ids = [key[len(key_prefix):] for key in keys]
+                if session_ids and other_indexes:
+                    async with redis_client.pipeline(transaction=False) as pipe:
+                        for session_id in session_ids:
+                            for index_key in other_indexes:
+                                pipe.sismember(index_key, session_id)
+                        owned = await pipe.execute()
+                    n = len(other_indexes)
+                    session_ids = [session_id for i, session_id in enumerate(session_ids)
+                                   if not any(owned[i * n:(i + 1) * n])]
+                if session_ids:
+                    async with redis_client.pipeline(transaction=False) as pipe:
+                        queue_delete_sessions(pipe, session_ids)
+                        results = await pipe.execute()
+                    job.deleted += results[0]
+                    await self._save(redis_client, job)
+                if cursor == 0:
+                    break
+                await asyncio.sleep(0)
+
+    async def _run(self, redis_client, job: BulkDeleteJob, on_finish=None):
+        job.status = "running"
+        logger.info(f"开始批量删除任务 {job.job_id}: {job.patterns}")
+        try:
+            await self._save(redis_client, job)
+            if job.user_host is not None:
+                await self._delete_user_sessions(redis_client, job)
+            for pattern in job.patterns if job.user_host is None else ():
+                cursor = 0
+                while True:
+                    cursor, keys = await redis_client.scan(cursor, match=pattern, count=job.batch_size)
+                    job.scanned += len(keys)
+                    if keys:
+                        job.deleted += await self._delete_keys(redis_client, keys)
+                        await self._save(redis_client, job)
+                    if cursor == 0:
+                        break
+                    await asyncio.sleep(0)
+            job.status = "done"
+            logger.info(f"批量删除任务 {job.job_id} 完成，共删除 {job.deleted} 个键")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"批量删除任务 {job.job_id} 失败: {str(e)}")
+        finally:
+            job.finished_at = time.time()
+            await self._save(redis_client, job)
+        if job.status == "done" and on_finish is not None:
+            on_finish(job)
@@ -0,0 +1,297 @@
+import asyncio
+import os
+import random
+import time
+from typing import Optional
+import redis.asyncio as aioredis
+from redis.asyncio.client import Pipeline
+from logger_config import get_module_logger
+from metrics import REGISTRY, REDIS_COMMAND_SECONDS, REDIS_COMMAND_ERRORS
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+# 获取模块日志记录器
+logger = get_module_logger("redis_pool")
+
+# 默认Redis配置
+DEFAULT_REDIS_HOST = "redis-17542.c323.us-east-1-2.ec2.redns.redis-cloud.com"
+DEFAULT_REDIS_PORT = 17542
+DEFAULT_REDIS_USERNAME = "default"
+DEFAULT_MAX_CONNECTIONS = 50
+DEFAULT_SOCKET_TIMEOUT = 15
+
+# 后台连接管理的默认配置（秒）：启动时单次探测的超时、重连退避的初始值和上限、连接后的健康检查间隔
+DEFAULT_PROBE_TIMEOUT = 2.0
+DEFAULT_RECONNECT_BASE_DELAY = 0.5
+DEFAULT_RECONNECT_MAX_DELAY = 30.0
+DEFAULT_HEALTH_CHECK_INTERVAL = 5.0
+
+# 全局异步连接池及客户端（每个进程一份，由应用启动时创建）
+REDIS_POOL = None
+redis_client = None
+
+# 请求路径上的熔断器（由set_circuit_breaker设置），为None时不做熔断
+circuit_breaker = None
+
+def set_circuit_breaker(breaker: Optional[CircuitBreaker]):
+    """
+    设置保护所有Redis命令的熔断器，熔断期间命令直接抛出CircuitOpenError
+    """
+    global circuit_breaker
+
+    circuit_breaker = breaker
+
+async def _guarded(awaitable, labels: tuple):
+    """
+    在熔断器保护下执行一次命令往返并记录耗时，被熔断拒绝的调用不计入命令指标
+    """
+    start = time.perf_counter()
+    try:
+        if circuit_breaker is not None:
+            return await circuit_breaker.call(awaitable)
+        return await awaitable
+    except CircuitOpenError:
+        start = None
+        raise
+    except Exception:
+        REDIS_COMMAND_ERRORS.inc(labels=labels)
+        raise
+    finally:
+        if start is not None:
+            REDIS_COMMAND_SECONDS.observe(time.perf_counter() - start, labels)
+
+class InstrumentedPipeline(Pipeline):
+    """记录每次管道/事务往返耗时的Pipeline"""
+
+    async def execute(self, raise_on_error: bool = True):
+        return await _guarded(super().execute(raise_on_error), ("MULTI" if self.is_transaction else "PIPELINE",))
+
+class InstrumentedRedis(aioredis.Redis):
+    """记录每条命令往返耗时、并受熔断器保护的异步Redis客户端"""
+
+    async def execute_command(self, *args, **options):
+        return await _guarded(super().execute_command(*args, **options), (str(args[0]).upper(),))
+
+    async def probe(self):
+        """绕过熔断器发送PING，供后台探测使用"""
+        return await super().execute_command("PING")
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+def collect_pool_metrics():
+    """
+    抓取指标时读取连接池的使用情况
+    """
+    if REDIS_POOL is None:
+        return []
+    in_use = len(getattr(REDIS_POOL, "_in_use_connections", ()))
+    available = len(getattr(REDIS_POOL, "_available_connections", ()))
+    return [
+        ("redis_pool_connections_in_use", "gauge", "已借出的Redis连接数", [({}, in_use)]),
+        ("redis_pool_connections_idle", "gauge", "空闲的Redis连接数", [({}, available)]),
+        ("redis_pool_max_connections", "gauge", "Redis连接池的最大连接数", [({}, REDIS_POOL.max_connections)])
+    ]
+
+REGISTRY.add_collector(collect_pool_metrics)
+
+def create_redis_pool():
+    """
+    根据环境变量创建异步Redis连接池
+
+    返回:
+        redis.asyncio.ConnectionPool 实例（创建时不会建立网络连接）
+    """
+    return aioredis.ConnectionPool(
+        host=os.getenv("REDIS_HOST", DEFAULT_REDIS_HOST),
+        port=int(os.getenv("REDIS_PORT", DEFAULT_REDIS_PORT)),
+        username=os.getenv("REDIS_USERNAME", DEFAULT_REDIS_USERNAME),
+        password=os.getenv("REDIS_PASSWORD"),
+        db=int(os.getenv("REDIS_DB", 0)),
+        decode_responses=True,
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)),
+        socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", DEFAULT_SOCKET_TIMEOUT)),
+        socket_connect_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", DEFAULT_SOCKET_TIMEOUT)),
+        health_check_interval=30,
+        retry_on_timeout=True
+    )
+
+def ensure_redis_pool():
+    """
+    创建全局连接池和客户端（不建立网络连接），已创建时直接返回客户端
+    """
+    global REDIS_POOL, redis_client
+
+    if REDIS_POOL is None:
+        REDIS_POOL = create_redis_pool()
+        redis_client = InstrumentedRedis(connection_pool=REDIS_POOL)
+    return redis_client
+
+async def init_redis_pool(timeout: Optional[float] = None):
+    """
+    创建全局连接池并做一次连通性检查
+
+    参数:
+        timeout: 本次检查的超时秒数，None表示使用连接池的套接字超时
+
+    返回:
+        连接成功返回True，否则返回False
+    """
+    ensure_redis_pool()
+
+    try:
+        if timeout is None:
+            await redis_client.probe()
+        else:
+            await asyncio.wait_for(redis_client.probe(), timeout)
+        logger.info(f"Redis连接成功: host={REDIS_POOL.connection_kwargs.get('host')}, port={REDIS_POOL.connection_kwargs.get('port')}")
+        return True
+    except aioredis.AuthenticationError as e:
+        logger.error(f"Redis认证失败，请检查密码是否正确: {str(e)}")
+        return False
+    except Exception as e:
+        logger.error(f"Redis连接失败: {str(e) or type(e).__name__}")
+        return False
+
+class RedisConnectionManager:
+    """
+    在后台维护Redis连接状态，请求处理过程中不会阻塞在连接或重连上
+
+    连接状态由熔断器表示（closed为已连接）。启动后立即在后台探测一次（超时为probe_timeout），之后：
+    - 熔断器关闭时每health_check_interval秒PING一次，失败即熔断
+    - 熔断器打开时（健康检查失败，或请求路径上连续失败），按带随机抖动的指数退避
+      进入半开状态试探，成功即关闭熔断器
+    状态变化通过熔断器的回调通知。
+    """
+
+    def __init__(self, breaker: Optional[CircuitBreaker] = None,
+                 probe_timeout: float = DEFAULT_PROBE_TIMEOUT,
+                 base_delay: float = DEFAULT_RECONNECT_BASE_DELAY,
+                 max_delay: float = DEFAULT_RECONNECT_MAX_DELAY,
+                 health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL):
+        self.breaker = breaker or CircuitBreaker("redis")
+        self.breaker.add_listener(self._on_breaker_change)
+        self.probe_timeout = probe_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.health_check_interval = health_check_interval
+        self.checked = None
+        self.attempts = 0
+        self.reconnects = 0
+        self._wake = None
+        self._task = None
+
+    @property
+    def connected(self) -> bool:
+        return self.breaker.closed
+
+    def start(self):
+        """启动后台任务，立即返回"""
+        self.checked = asyncio.Event()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def wait_checked(self):
+        """等待第一次连通性探测完成"""
+        await self.checked.wait()
+
+    def _on_breaker_change(self, old_state: str, new_state: str):
+        # 请求路径上的失败使熔断器打开时，立即结束健康检查的等待，开始重连
+        if self._wake is not None:
+            self._wake.set()
+
+    def check_now(self):
+        """
+        立即进行一次检查：已连接时立即健康检查，断开时跳过剩余的退避立即试探
+        （例如其他工作进程报告Redis已恢复）
+        """
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _wait(self, seconds: float):
+        """等待seconds秒，熔断器状态变化或check_now时提前结束"""
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        delay = self.base_delay
+        while True:
+            if self.breaker.closed:
+                await self._wait(self.health_check_interval)
+                if self.breaker.closed:
+                    try:
+                        await asyncio.wait_for(redis_client.probe(), self.probe_timeout)
+                        continue
+                    except Exception as e:
+                        self.breaker.trip(f"健康检查失败: {str(e) or type(e).__name__}")
+                # 刚断开时先短暂退避再试探
+                delay = self.base_delay
+                await self._wait(random.uniform(0, delay))
+
+            self.attempts += 1
+            self.breaker.half_open()
+            ok = await init_redis_pool(self.probe_timeout)
+            if ok:
+                if self.checked.is_set():
+                    self.reconnects += 1
+                self.breaker.close()
+            else:
+                self.breaker.trip("重连失败")
+            self.checked.set()
+            if not ok:
+                # 全抖动的指数退避，避免多个工作进程同时重连
+                await self._wait(random.uniform(0, delay))
+                delay = min(self.max_delay, delay * 2)
+
+    async def stop(self):
+        """停止后台任务并关闭连接池"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await close_redis_pool()
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "attempts": self.attempts,
+            "reconnects": self.reconnects,
+            "circuit_breaker": self.breaker.stats()
+        }
+
+def _forget_pool_after_fork():
+    """
+    fork出的子进程不能复用父进程的连接（套接字和事件循环属于父进程），丢弃引用后由子进程重新创建
+    """
+    global REDIS_POOL, redis_client
+
+    REDIS_POOL = None
+    redis_client = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_pool_after_fork)
+
+def get_redis():
+    """
+    获取共享的异步Redis客户端，连接池未初始化时返回None
+    """
+    return redis_client
+
+async def close_redis_pool():
+    """
+    关闭全局连接池，释放所有连接
+    """
+    global REDIS_POOL, redis_client
+
+    if redis_client is not None:
+        await redis_client.aclose()
+    if REDIS_POOL is not None:
+        await REDIS_POOL.disconnect()
+    REDIS_POOL = None
+    redis_client = None
+    logger.info("Redis连接池已关闭")
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+from langchain_core.messages import BaseMessage
+from logger_config import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("response_cache")
+
+# Redis中缓存响应的键前缀
+RESPONSE_KEY_PREFIX = "response_cache:"
+
+# 默认过期时间（秒）和进程内缓存条数
+DEFAULT_TTL = 3600
+DEFAULT_LOCAL_TTL = 600
+DEFAULT_LOCAL_MAX_ENTRIES = 1000
+
+def make_cache_key(model_params: dict, messages: Sequence[BaseMessage]) -> str:
+    """
+    根据模型参数和完整的提示上下文（历史窗口 + 本轮输入）计算缓存键
+    """
+    payload = {
+        "params": model_params,
+        "messages": [[m.type, m.content] for m in messages]
+    }
+    digest = hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+    return RESPONSE_KEY_PREFIX + digest
+
+class ResponseCache:
+    """
+    LLM响应的精确匹配缓存
+
+    两级缓存：进程内LRU（带TTL）和Redis（SET EX）。缓存的值为模型输出的token列表，
+    命中时按原token逐帧回放，客户端看到的流与实时生成的完全一致。
+    """
+
+    def __init__(self, ttl: int = DEFAULT_TTL, local_ttl: int = DEFAULT_LOCAL_TTL,
+                 local_max_entries: int = DEFAULT_LOCAL_MAX_ENTRIES):
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local_max_entries = local_max_entries
+        self._local = OrderedDict()
+        self._stats = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "errors": 0
+        }
+
+    def _get_local(self, key: str) -> Optional[List[str]]:
+        item = self._local.get(key)
+        if item is None:
+            return None
+        expires_at, tokens = item
+        if expires_at < time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return tokens
+
+    def _set_local(self, key: str, tokens: List[str]):
+        if self.local_max_entries <= 0:
+            return
+        self._local[key] = (time.monotonic() + self.local_ttl, tokens)
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_max_entries:
+            self._local.popitem(last=False)
+
+    async def aget(self, key: str, redis_client=None) -> Optional[List[str]]:
+        """
+        依次查询进程内缓存和Redis，未命中返回None
+        """
+        tokens = self._get_local(key)
+        if tokens is not None:
+            self._stats["local_hits"] += 1
+            return tokens
+        if redis_client is not None:
+            try:
+                value = await redis_client.get(key)
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.warning(f"读取响应缓存失败: {str(e)}")
+                value = None
+            if value is not None:
+                tokens = json.loads(value)
+                self._set_local(key, tokens)
+                self._stats["redis_hits"] += 1
+                return tokens
+        self._stats["misses"] += 1
+        return None
+
+    async def aset(self, key: str, tokens: List[str], redis_client=None):
+        """
+        写入两级缓存
+        """
+        self._set_local(key, tokens)
+        if redis_client is not None:
+            try:
+                await redis_client.set(key, json.dumps(tokens, ensure_ascii=False), ex=self.ttl)
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.warning(f"写入响应缓存失败: {str(e)}")
+        self._stats["stores"] += 1
+
+    def stats(self) -> dict:
+        """返回缓存命中统计"""
+        return {"local_entries": len(self._local), **self._stats}
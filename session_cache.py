@@ -0,0 +1,112 @@
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from logger_config import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("session_cache")
+
+# 默认容量限制
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_MAX_MESSAGES = 100000
+
+class CachedSession:
+    """
+    缓存的会话：Redis中的版本号、列表长度，以及按时间顺序排列的 (消息, token数)
+    """
+
+    def __init__(self, version: int, entries: list):
+        self.version = version
+        self.entries = entries
+
+class SessionCache:
+    """
+    每个工作进程内的会话消息缓存，位于Redis会话历史之前
+
+    缓存反序列化后的消息列表，读取时只需用一次LLEN + GET版本号的往返校验，
+    版本号和长度都一致即命中，无需LRANGE和JSON解析；写入时在原列表上追加。
+    会话数或消息总数超出上限时按LRU淘汰。
+    """
+
+    def __init__(self, max_sessions: int = DEFAULT_MAX_SESSIONS, max_messages: int = DEFAULT_MAX_MESSAGES):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self._sessions = OrderedDict()
+        self._messages = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "appends": 0,
+            "invalidations": 0,
+            "evictions": 0
+        }
+
+    def get(self, key: str, version: int, length: int) -> Optional[list]:
+        """
+        校验并返回缓存的 (消息, token数) 列表，版本号或长度不一致时返回None
+        """
+        cached = self._sessions.get(key)
+        if cached is not None and cached.version == version and len(cached.entries) == length:
+            self._sessions.move_to_end(key)
+            self._stats["hits"] += 1
+            return cached.entries
+        self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, version: int, entries: list):
+        """
+        写入完整的会话消息列表
+        """
+        self.invalidate(key, count=False)
+        self._sessions[key] = CachedSession(version, entries)
+        self._messages += len(entries)
+        self._evict()
+
+    def append(self, key: str, old_version: int, new_version: int, old_length: int, entries: List[Tuple]):
+        """
+        写入成功后在原列表上追加新消息
+
+        只有缓存正好是写入前的版本和长度时才追加，否则说明有其他进程写入过，直接失效
+        """
+        cached = self._sessions.get(key)
+        if cached is None:
+            return
+        if cached.version != old_version or len(cached.entries) != old_length:
+            self.invalidate(key)
+            return
+        cached.entries.extend(entries)
+        cached.version = new_version
+        self._messages += len(entries)
+        self._sessions.move_to_end(key)
+        self._stats["appends"] += 1
+        self._evict()
+
+    def invalidate(self, key: str, count: bool = True):
+        """移除一个会话的缓存"""
+        cached = self._sessions.pop(key, None)
+        if cached is not None:
+            self._messages -= len(cached.entries)
+            if count:
+                self._stats["invalidations"] += 1
+
+    def invalidate_prefix(self, prefix: str = ""):
+        """移除键以prefix开头的所有会话的缓存（prefix为空时清空）"""
+        for key in [key for key in self._sessions if key.startswith(prefix)]:
+            self.invalidate(key)
+
+    def _evict(self):
+        while self._sessions and (len(self._sessions) > self.max_sessions or self._messages > self.max_messages):
+            _, cached = self._sessions.popitem(last=False)
+            self._messages -= len(cached.entries)
+            self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        """返回缓存占用和命中统计"""
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            "sessions": len(self._sessions),
+            "messages": self._messages,
+            "max_sessions": self.max_sessions,
+            "max_messages": self.max_messages,
+            "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            **self._stats
+        }
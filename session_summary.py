@@ -0,0 +1,203 @@
+import asyncio
+from typing import List
+from langchain_core.messages import BaseMessage, SystemMessage
+from logger_config import get_module_logger
+from chat_history import ARCHIVE_KEY_PREFIX, decode_item
+from llm_scheduler import BATCH, SchedulerTimeout
+from metrics import stage_timer
+from token_counter import count_message_tokens
+
+# 获取模块日志记录器
+logger = get_module_logger("session_summary")
+
+# 摘要检查点的键前缀，与message_store:使用相同的会话键
+SUMMARY_KEY_PREFIX = "summary_store:"
+
+# 默认保留的最近原始消息条数、触发压缩的阈值、单次送入模型的最大消息条数
+DEFAULT_KEEP_RECENT = 20
+DEFAULT_COMPACT_THRESHOLD = 10
+DEFAULT_MAX_BATCH = 40
+
+SUMMARY_PROMPT = """请在已有摘要的基础上，结合新增的对话内容，逐步更新对话摘要。
+保留用户的关键信息、偏好、已确认的结论和未完成的问题，返回更新后的完整摘要。
+
+已有摘要:
+{summary}
+
+新增对话:
+{new_lines}
+
+更新后的摘要:"""
+
+# 读取检查点以及尚未被摘要覆盖的消息（一次往返）
+# 列表头部为最新消息，从最旧一端数第covered条之前的消息已被摘要覆盖，
+# 因此未覆盖的消息为 LRANGE 0 -(covered+1)。检查点超出列表长度说明列表被清空过，视为失效。
+# 会话已归档（KEYS[3]存在）时返回covered=-1，由调用方恢复后重新读取。
+_READ_CONTEXT_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    return {'', -1, {}}
+end
+local covered = tonumber(redis.call('HGET', KEYS[2], 'covered') or '0')
+local summary = redis.call('HGET', KEYS[2], 'summary') or ''
+if covered > redis.call('LLEN', KEYS[1]) then
+    covered = 0
+    summary = ''
+end
+return {summary, covered, redis.call('LRANGE', KEYS[1], 0, -(covered + 1))}
+"""
+
+# 仅当检查点仍是压缩开始时读到的版本才写入，避免多个进程重复覆盖
+_WRITE_CHECKPOINT_SCRIPT = """
+local covered = tonumber(redis.call('HGET', KEYS[1], 'covered') or '0')
+if covered ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'summary', ARGV[2], 'covered', ARGV[3])
+if tonumber(ARGV[4]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+end
+return 1
+"""
+
+def format_lines(messages: List[BaseMessage]) -> str:
+    """
+    将消息格式化为摘要提示词中的对话文本
+    """
+    names = {"human": "用户", "ai": "助手"}
+    return "\n".join(f"{names.get(m.type, m.type)}: {m.content}" for m in messages)
+
+class SessionSummarizer:
+    """
+    会话滚动摘要压缩
+
+    每个会话在Redis中保存一个摘要检查点（summary_store:{session_key}哈希，
+    包含summary摘要文本和covered已覆盖的最旧消息条数）。超出最近keep_recent条的
+    旧消息在后台增量并入摘要，模型只处理新老化的消息，不会重新总结全部历史。
+    发送给模型的上下文为：摘要 + 尚未被覆盖的原始消息。
+
+    llm只需提供异步的ainvoke(prompt)方法，便于使用桩对象测试。指定scheduler时每次模型调用
+    以批量优先级占用一个执行名额，与对话共用并发上限和429降级，不会挤占交互请求。
+    """
+
+    def __init__(self, llm, keep_recent: int = DEFAULT_KEEP_RECENT, compact_threshold: int = DEFAULT_COMPACT_THRESHOLD,
+                 max_batch: int = DEFAULT_MAX_BATCH, key_prefix: str = SUMMARY_KEY_PREFIX, scheduler=None):
+        self.llm = llm
+        self.scheduler = scheduler
+        self.keep_recent = keep_recent
+        self.compact_threshold = compact_threshold
+        self.max_batch = max_batch
+        self.key_prefix = key_prefix
+        # 正在压缩的会话及其后台任务（保持引用，防止任务被回收）
+        self._running = set()
+        self._tasks = set()
+
+    def summary_key(self, message_history) -> str:
+        """摘要检查点的键名"""
+        return self.key_prefix + message_history.session_id
+
+    async def aget_checkpoint(self, message_history):
+        """
+        读取摘要检查点
+
+        返回:
+            (摘要文本, 已覆盖的消息条数)
+        """
+        summary, covered = await message_history.redis_client.hmget(self.summary_key(message_history), "summary", "covered")
+        return summary or "", int(covered or 0)
+
+    async def aget_context_messages(self, message_history) -> List[BaseMessage]:
+        """
+        获取发送给模型的上下文：摘要 + 尚未被摘要覆盖的原始消息（按时间顺序）
+        """
+        with stage_timer("redis_lookup"):
+            summary, covered, items = await message_history.redis_client.eval(
+                _READ_CONTEXT_SCRIPT, 3, message_history.key, self.summary_key(message_history),
+                ARCHIVE_KEY_PREFIX + message_history.session_id
+            )
+        if covered == -1 and await message_history.arehydrate():
+            return await self.aget_context_messages(message_history)
+        with stage_timer("history_decode"):
+            entries = [decode_item(item) for item in items[::-1]]
+        messages = [message for message, _ in entries]
+        context_tokens = sum(tokens for _, tokens in entries)
+        if summary:
+            messages.insert(0, SystemMessage(content=f"以下是之前对话的摘要：\n{summary}"))
+            context_tokens += count_message_tokens(messages[0])
+        message_history.context_tokens = context_tokens
+        return messages
+
+    def schedule_compaction(self, message_history, history_length: int):
+        """
+        根据写入后的列表长度判断是否需要压缩，需要时在后台启动压缩任务，不阻塞请求
+        """
+        if history_length - self.keep_recent < self.compact_threshold:
+            return
+        session_key = message_history.session_id
+        if session_key in self._running:
+            return
+        self._running.add(session_key)
+        task = asyncio.create_task(self._compact_in_background(message_history))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _compact_in_background(self, message_history):
+        try:
+            await self.acompact(message_history)
+        except SchedulerTimeout:
+            # 上游繁忙，下次写入后再压缩
+            logger.info("会话 %s 等待模型调用名额超时，推迟摘要压缩", message_history.session_id)
+        except Exception as e:
+            logger.error(f"会话 {message_history.session_id} 摘要压缩失败: {str(e)}")
+        finally:
+            self._running.discard(message_history.session_id)
+
+    async def acompact(self, message_history) -> int:
+        """
+        将新老化的消息增量并入摘要
+
+        返回:
+            本次并入摘要的消息条数
+        """
+        redis_client = message_history.redis_client
+        summary_key = self.summary_key(message_history)
+        summary, covered = await self.aget_checkpoint(message_history)
+        length = await redis_client.llen(message_history.key)
+        if covered > length:
+            summary, covered = "", 0
+
+        folded = 0
+        while length - self.keep_recent - covered >= self.compact_threshold:
+            # 从最旧一端数第covered到第aged-1条，使用负索引，不受并发LPUSH影响
+            aged = min(length - self.keep_recent, covered + self.max_batch)
+            items = await redis_client.lrange(message_history.key, -aged, -(covered + 1))
+            new_messages = [decode_item(item)[0] for item in items[::-1]]
+
+            result = await self._ainvoke(message_history, SUMMARY_PROMPT.format(
+                summary=summary or "（无）",
+                new_lines=format_lines(new_messages)
+            ))
+            new_summary = getattr(result, "content", result)
+
+            written = await redis_client.eval(
+                _WRITE_CHECKPOINT_SCRIPT, 1, summary_key,
+                covered, new_summary, aged, message_history.ttl or 0
+            )
+            if not written:
+                logger.info(f"会话 {message_history.session_id} 的摘要检查点已被其他进程更新，放弃本次压缩")
+                break
+            folded += aged - covered
+            summary, covered = new_summary, aged
+
+        if folded:
+            logger.info(f"会话 {message_history.session_id} 已将 {folded} 条旧消息并入摘要，覆盖 {covered} 条")
+        return folded
+
+    async def _ainvoke(self, message_history, prompt: str):
+        if self.scheduler is None:
+            return await self.llm.ainvoke(prompt)
+        async with self.scheduler.slot(getattr(message_history, "user_host", None) or "unknown", BATCH):
+            return await self.llm.ainvoke(prompt)
+
+    async def aclear(self, message_history):
+        """删除会话的摘要检查点"""
+        await message_history.redis_client.delete(self.summary_key(message_history))
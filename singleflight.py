@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Optional, Tuple
+from logger_config import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("singleflight")
+
+# Redis中的键前缀：会话锁、跨进程进行中标记、跨进程结果
+LOCK_KEY_PREFIX = "session_lock:"
+INFLIGHT_KEY_PREFIX = "singleflight:"
+RESULT_KEY_PREFIX = "singleflight_result:"
+
+# 默认的锁过期时间、等待锁的超时时间（秒）、跨进程结果保留时间（秒）
+DEFAULT_LOCK_TTL = 120
+DEFAULT_LOCK_TIMEOUT = 60
+DEFAULT_RESULT_TTL = 30
+
+# 释放锁时校验持有者，避免误删其他进程的锁
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# 声明一次生成：成功时返回{1, flight_id}，已有进行中的生成时返回{0, 其flight_id}
+_CLAIM_FLIGHT_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return {1, ARGV[1]}
+end
+return {0, redis.call('GET', KEYS[1])}
+"""
+
+def flight_key(session_key: str, user_input: str) -> str:
+    """
+    相同会话 + 相同输入的请求合并键
+    """
+    digest = hashlib.sha256(user_input.encode("utf-8")).hexdigest()[:32]
+    return f"{session_key}:{digest}"
+
+class TokenBroadcast:
+    """
+    一次生成的token广播
+
+    生成任务逐个发布token，任意数量的订阅者从头开始读取（已发布的token会先回放），
+    之后跟随实时输出，直到生成结束或出错。
+    cancel_when_abandoned为True时，最后一个订阅者中途离开会取消生成任务。
+    """
+
+    def __init__(self, cancel_when_abandoned: bool = False):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.cancelled = False
+        self.cancel_when_abandoned = cancel_when_abandoned
+        self.subscribers = 0
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, token: str):
+        """发布一个token"""
+        self.tokens.append(token)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        """结束广播，error不为空时订阅者会收到该异常"""
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def wake(self):
+        """唤醒等待中的订阅者，使其重新检查停止条件"""
+        self._notify()
+
+    def cancel(self):
+        """
+        取消生成任务；已取消的广播不会再被新的重复请求加入
+        """
+        if self.done or self.cancelled:
+            return
+        self.cancelled = True
+        if self.task is not None:
+            self.task.cancel()
+
+    async def subscribe(self, stop: Optional[asyncio.Event] = None):
+        """
+        订阅token流：先回放已发布的token，再跟随实时输出
+
+        参数:
+            stop: 可选的停止事件，被设置（并调用wake）后订阅立即结束，例如客户端已断开
+        """
+        self.subscribers += 1
+        try:
+            index = 0
+            while True:
+                while index < len(self.tokens):
+                    if stop is not None and stop.is_set():
+                        return
+                    yield self.tokens[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                if stop is not None and stop.is_set():
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done and self.cancel_when_abandoned:
+                logger.info("所有订阅者已断开，取消生成任务")
+                self.cancel()
+
+class SingleFlight:
+    """
+    进程内的并发请求合并
+
+    相同键的请求同时到达时，只有第一个请求（leader）启动生成任务，
+    后续重复请求（follower）直接订阅leader的token流，不会再次调用模型或写入历史。
+    cancel_abandoned为True时，所有订阅者都断开后取消进行中的生成。
+    """
+
+    def __init__(self, cancel_abandoned: bool = False):
+        self.cancel_abandoned = cancel_abandoned
+        self._flights = {}
+        self._stats = {"leaders": 0, "followers": 0, "cancelled": 0}
+
+    def join(self, key: str, run: Callable[[TokenBroadcast], Awaitable[None]]) -> TokenBroadcast:
+        """
+        加入一次生成：键不存在时创建广播并在后台执行run(broadcast)，否则返回进行中的广播
+        """
+        broadcast = self._flights.get(key)
+        if broadcast is not None and not broadcast.done and not broadcast.cancelled:
+            self._stats["followers"] += 1
+            logger.info(f"合并重复请求: {key}")
+            return broadcast
+
+        broadcast = TokenBroadcast(cancel_when_abandoned=self.cancel_abandoned)
+        self._flights[key] = broadcast
+        self._stats["leaders"] += 1
+
+        async def runner():
+            try:
+                await run(broadcast)
+                if not broadcast.done:
+                    broadcast.finish()
+            except BaseException as e:
+                broadcast.finish(e)
+                if isinstance(e, asyncio.CancelledError):
+                    self._stats["cancelled"] += 1
+                    raise
+            finally:
+                if self._flights.get(key) is broadcast:
+                    del self._flights[key]
+
+        broadcast.task = asyncio.create_task(runner())
+        return broadcast
+
+    def stats(self) -> dict:
+        """返回合并统计"""
+        return {"in_flight": len(self._flights), **self._stats}
+
+class SessionLocks:
+    """
+    会话级互斥锁，保证同一会话的多轮对话串行执行，历史写入不会交错
+
+    进程内使用asyncio.Lock；传入redis_client时再获取Redis锁（SET NX PX），
+    用于多个工作进程之间的互斥。指定notifier（cluster.ClusterBus）时，释放锁后通知其他进程，
+    等待方收到通知立即重试，不必等到下一次轮询。
+    """
+
+    def __init__(self, lock_ttl: int = DEFAULT_LOCK_TTL, lock_timeout: int = DEFAULT_LOCK_TIMEOUT, notifier=None):
+        self.lock_ttl = lock_ttl
+        self.lock_timeout = lock_timeout
+        self.notifier = notifier
+        self._locks = {}
+        self._waiters = {}
+
+    @asynccontextmanager
+    async def hold(self, session_key: str, redis_client=None):
+        """
+        持有会话锁执行一轮对话
+        """
+        lock = self._locks.setdefault(session_key, asyncio.Lock())
+        self._waiters[session_key] = self._waiters.get(session_key, 0) + 1
+        try:
+            async with lock:
+                if redis_client is None:
+                    yield
+                else:
+                    async with self._hold_redis(session_key, redis_client):
+                        yield
+        finally:
+            self._waiters[session_key] -= 1
+            if not self._waiters[session_key]:
+                del self._waiters[session_key]
+                del self._locks[session_key]
+
+    @asynccontextmanager
+    async def _hold_redis(self, session_key: str, redis_client):
+        key = LOCK_KEY_PREFIX + session_key
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.05
+        while not await redis_client.set(key, token, nx=True, px=self.lock_ttl * 1000):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"等待会话锁超时: {session_key}")
+            await _pause(self.notifier, key, delay)
+            delay = min(delay * 2, 1.0)
+        try:
+            yield
+        finally:
+            try:
+                await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, key, token)
+                if self.notifier is not None:
+                    self.notifier.notify(key)
+            except Exception as e:
+                logger.warning(f"释放会话锁失败: {str(e)}")
+
+async def _pause(notifier, topic: str, delay: float):
+    """轮询间隔：有notifier时等待topic的通知，最多delay秒"""
+    if notifier is None:
+        await asyncio.sleep(delay)
+    else:
+        await notifier.wait(topic, delay)
+
+async def aclaim_flight(redis_client, key: str, ttl: int = DEFAULT_LOCK_TTL) -> Tuple[bool, str]:
+    """
+    跨进程声明一次生成
+
+    每次声明使用新的flight_id，结果按flight_id保存，等待方只回放它观察到的那一次生成的结果，
+    不会把上一次相同输入的结果当作本次的结果。
+
+    返回:
+        (是否由本进程生成, flight_id)；未声明成功时flight_id为正在进行的那一次生成
+    """
+    flight_id = uuid.uuid4().hex
+    claimed, holder = await redis_client.eval(_CLAIM_FLIGHT_SCRIPT, 1, INFLIGHT_KEY_PREFIX + key, flight_id,
+                                              ttl * 1000)
+    return bool(claimed), holder
+
+def flight_result_key(key: str, flight_id: str) -> str:
+    """一次生成的结果键"""
+    return f"{RESULT_KEY_PREFIX}{key}:{flight_id}"
+
+async def apublish_flight_result(redis_client, key: str, flight_id: str, tokens: List[str],
+                                 ttl: int = DEFAULT_RESULT_TTL, notifier=None):
+    """
+    保存本次生成的结果供其他进程的重复请求回放，并清除进行中标记
+    """
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.set(flight_result_key(key, flight_id), json.dumps(tokens, ensure_ascii=False), ex=ttl)
+        pipe.eval(_RELEASE_LOCK_SCRIPT, 1, INFLIGHT_KEY_PREFIX + key, flight_id)
+        await pipe.execute()
+    if notifier is not None:
+        notifier.notify(INFLIGHT_KEY_PREFIX + key)
+
+async def arelease_flight(redis_client, key: str, flight_id: str, notifier=None):
+    """生成失败时清除进行中标记（只清除本次声明的标记）"""
+    await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, INFLIGHT_KEY_PREFIX + key, flight_id)
+    if notifier is not None:
+        notifier.notify(INFLIGHT_KEY_PREFIX + key)
+
+async def await_flight_result(redis_client, key: str, flight_id: str, timeout: float = DEFAULT_LOCK_TIMEOUT,
+                              notifier=None) -> Optional[List[str]]:
+    """
+    等待其他进程完成flight_id这一次生成并返回其结果；对方失败或超时返回None
+
+    指定notifier时在轮询间隔内等待对方完成的通知
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    while time.monotonic() < deadline:
+        # 结果写入和清除标记在同一个事务中完成，在事务中同时读取两者
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.get(flight_result_key(key, flight_id))
+            pipe.get(INFLIGHT_KEY_PREFIX + key)
+            result, holder = await pipe.execute()
+        if result is not None:
+            return json.loads(result)
+        if holder != flight_id:
+            return None
+        await _pause(notifier, INFLIGHT_KEY_PREFIX + key, delay)
+        delay = min(delay * 2, 0.5)
+    return None
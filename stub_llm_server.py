@@ -0,0 +1,156 @@
+"""
+OpenAI兼容接口的本地模拟服务，用于测试上游路由、对冲请求和故障切换
+
+用法:
+    python stub_llm_server.py --port 9001 --ttft 0.5 --token-interval 0.02 --error-rate 0.1
+    python stub_llm_server.py --port 9001 --ttft 0.2 --tokens-per-second 50 --reply-tokens 200
+
+之后将 OPENAI_API_BASE 或 LLM_ENDPOINTS 中的 base_url 指向 http://127.0.0.1:9001/v1
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_REPLY = "这是来自模拟服务的回答。"
+
+def make_reply(tokens: int) -> str:
+    """
+    生成指定token数（按字符计）的回答，用于控制输出长度
+    """
+    return "".join(itertools.islice(itertools.cycle(DEFAULT_REPLY), tokens))
+
+def create_app(ttft: float = 0.2, token_interval: float = 0.02, error_rate: float = 0.0, error_status: int = 500,
+               reply: str = DEFAULT_REPLY, retry_after: float = 0.0) -> FastAPI:
+    """
+    创建模拟服务
+
+    参数:
+        ttft: 首个token前的延迟（秒）
+        token_interval: 相邻token之间的间隔（秒）
+        error_rate: 以该概率直接返回错误
+        error_status: 错误时的HTTP状态码（例如429、500、503）
+        reply: 回答内容，按字符逐个作为token输出
+        retry_after: 返回429时附带的Retry-After秒数，0表示不附带
+
+    返回:
+        FastAPI应用，app.state.stats 中记录请求、错误和中途断开的次数
+    """
+    app = FastAPI()
+    app.state.stats = {"requests": 0, "errors": 0, "completed": 0, "aborted": 0}
+
+    def error_response():
+        app.state.stats["errors"] += 1
+        headers = {"Retry-After": str(retry_after)} if retry_after and error_status == 429 else None
+        return JSONResponse(
+            {"error": {"message": "模拟的上游错误", "type": "stub_error", "code": error_status}},
+            status_code=error_status,
+            headers=headers
+        )
+
+    @app.get("/stats")
+    async def get_stats():
+        return app.state.stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.stats["requests"] += 1
+        if random.random() < error_rate:
+            return error_response()
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "stub")
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft + token_interval * len(reply))
+            app.state.stats["completed"] += 1
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(reply), "total_tokens": len(reply)}
+            }
+
+        def chunk(delta: dict, finish_reason=None) -> str:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        async def stream():
+            try:
+                await asyncio.sleep(ttft)
+                yield chunk({"role": "assistant", "content": ""})
+                for index, token in enumerate(reply):
+                    if index:
+                        await asyncio.sleep(token_interval)
+                    yield chunk({"content": token})
+                yield chunk({}, "stop")
+                yield "data: [DONE]\n\n"
+                app.state.stats["completed"] += 1
+            except (asyncio.CancelledError, GeneratorExit):
+                app.state.stats["aborted"] += 1
+                raise
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+def serve_in_thread(app, host: str = "127.0.0.1", port: int = 0):
+    """
+    在后台线程中用uvicorn运行一个ASGI应用（供测试和基准测试使用）
+
+    参数:
+        port: 监听端口，0表示自动选择空闲端口
+
+    返回:
+        (uvicorn.Server, 实际端口)，结束时设置 server.should_exit = True
+    """
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("服务启动失败")
+        time.sleep(0.01)
+    return server, server.servers[0].sockets[0].getsockname()[1]
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI兼容接口的本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--ttft", type=float, default=0.2, help="首个token前的延迟（秒）")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="相邻token之间的间隔（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="输出速度，设置后覆盖--token-interval")
+    parser.add_argument("--reply-tokens", type=int, default=0, help="回答的token数，设置后覆盖--reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的概率")
+    parser.add_argument("--error-status", type=int, default=500, help="错误时的HTTP状态码")
+    parser.add_argument("--retry-after", type=float, default=0.0, help="返回429时附带的Retry-After秒数")
+    parser.add_argument("--reply", default=DEFAULT_REPLY, help="回答内容")
+    args = parser.parse_args()
+    token_interval = 1.0 / args.tokens_per_second if args.tokens_per_second > 0 else args.token_interval
+    reply = make_reply(args.reply_tokens) if args.reply_tokens > 0 else args.reply
+
+    uvicorn.run(
+        create_app(args.ttft, token_interval, args.error_rate, args.error_status, reply, args.retry_after),
+        host=args.host,
+        port=args.port
+    )
@@ -0,0 +1,45 @@
+import os
+import sys
+
+# 测试直接导入仓库根目录下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeredis.aioredis
+import httpx
+import pytest
+
+@pytest.fixture
+def redis_app(monkeypatch):
+    """
+    以Redis存储模式使用main.app（不运行lifespan）：get_redis返回同一个fakeredis客户端
+
+    返回:
+        (main模块, fakeredis客户端)
+    """
+    import main
+
+    redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(main, "get_redis", lambda: redis_client)
+    monkeypatch.setattr(main, "USE_LOCAL_MODE", False)
+    monkeypatch.setitem(main.startup_state, "ready", True)
+    return main, redis_client
+
+def asgi_client(app) -> httpx.AsyncClient:
+    """直接调用ASGI应用的HTTP客户端"""
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver")
+
+class FakeChunk:
+    def __init__(self, content):
+        self.content = content
+
+class FakeChat:
+    """按固定token流式输出的模型，记录调用次数"""
+
+    def __init__(self, tokens=("你", "好")):
+        self.tokens = tokens
+        self.calls = 0
+
+    async def astream(self, messages):
+        self.calls += 1
+        for token in self.tokens:
+            yield FakeChunk(token)
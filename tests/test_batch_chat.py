@@ -0,0 +1,71 @@
+import asyncio
+
+from batch_chat import BatchItem, BatchJobManager, run_batch
+from conftest import FakeChat
+
+def test_run_batch_keeps_session_order():
+    async def run():
+        order = []
+
+        async def run_item(item):
+            order.append(item.index)
+            await asyncio.sleep(0.01 if item.session_id == "a" else 0)
+            return item.result(status="success")
+
+        items = [BatchItem(0, "m", "a"), BatchItem(1, "m", "b"), BatchItem(2, "m", "a")]
+        results = [result async for result in run_batch(items, run_item, parallelism=2)]
+        assert sorted(result["index"] for result in results) == [0, 1, 2]
+        assert order.index(0) < order.index(2)
+
+    asyncio.run(run())
+
+def test_running_jobs_are_not_evicted():
+    async def run():
+        release = asyncio.Event()
+
+        async def run_item(item):
+            await release.wait()
+            return item.result(status="success")
+
+        manager = BatchJobManager(max_history=2)
+        jobs = [manager.start([BatchItem(0, "m")], run_item) for _ in range(3)]
+        await asyncio.sleep(0)
+        # 超出保留数量但任务都在执行中：全部保留，最早的任务仍可查询和取消
+        assert list(manager.jobs) == [job.job_id for job in jobs]
+        assert manager.stats()["running"] == 3
+        assert manager.cancel(jobs[0].job_id)
+        await asyncio.sleep(0.05)
+        assert jobs[0].status == "cancelled"
+        assert list(manager.jobs) == [job.job_id for job in jobs[1:]]
+
+        release.set()
+        await asyncio.sleep(0.05)
+        assert [job.status for job in jobs[1:]] == ["done", "done"]
+
+        # 之后启动新任务时淘汰最早的已结束任务
+        manager.start([BatchItem(0, "m")], run_item)
+        assert len(manager.jobs) == 2 and jobs[1].job_id not in manager.jobs
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+
+def test_batch_items_do_not_join_interactive_flights(redis_app, monkeypatch):
+    main, redis_client = redis_app
+    claimed = []
+
+    async def aclaim_flight(redis_conn, key, ttl):
+        claimed.append(key)
+        return True, "flight"
+
+    monkeypatch.setattr(main, "chat", FakeChat(("批量", "回答")))
+    monkeypatch.setattr(main, "SESSION_LOCK_REDIS", True)
+    monkeypatch.setattr(main, "aclaim_flight", aclaim_flight)
+
+    async def run():
+        result = await main.run_batch_item(BatchItem(0, "你好", "s1", "u"))
+        assert result["status"] == "success" and result["response"] == "批量回答"
+        # 批量项不声明跨进程合并，不会回放交互请求的结果，也不会被交互请求回放
+        assert claimed == []
+        assert await redis_client.llen("message_store:u_s1") == 2
+
+    asyncio.run(run())
@@ -0,0 +1,68 @@
+import asyncio
+
+import fakeredis
+import fakeredis.aioredis
+import redis.asyncio
+from langchain_core.messages import AIMessage, HumanMessage
+
+from chat_history import AsyncRedisChatMessageHistory, sync_client_for
+from history_archive import HistoryMaintainer
+from session_cache import SessionCache
+
+def make_history(cache=None):
+    server = fakeredis.FakeServer()
+    return AsyncRedisChatMessageHistory(
+        redis_client=fakeredis.aioredis.FakeRedis(server=server, decode_responses=True),
+        session_id="alice_s1",
+        cache=cache,
+        user_host="alice",
+        sync_client=fakeredis.FakeRedis(server=server, decode_responses=True)
+    )
+
+def test_sync_and_async_interfaces_share_storage():
+    async def run():
+        cache = SessionCache()
+        history = make_history(cache)
+        history.add_messages([HumanMessage(content="问题1"), AIMessage(content="回答1")])
+        assert [m.content for m in history.messages] == ["问题1", "回答1"]
+
+        # 异步读取填充缓存后，同步写入使缓存失效
+        assert [m.content for m in await history.aget_messages()] == ["问题1", "回答1"]
+        version = history.version
+        history.add_message(HumanMessage(content="问题2"))
+        assert history.version > version
+        assert cache.stats()["sessions"] == 0
+        assert [m.content for m in await history.aget_messages()] == ["问题1", "回答1", "问题2"]
+
+        await history.aadd_messages([AIMessage(content="回答2")])
+        assert [m.content for m in history.messages] == ["问题1", "回答1", "问题2", "回答2"]
+        assert await history.redis_client.smembers("user_sessions:alice") == {"alice_s1"}
+
+        version = history.version
+        history.clear()
+        assert history.messages == []
+        assert history.version > version
+        assert await history.aget_messages() == []
+
+    asyncio.run(run())
+
+def test_sync_messages_rehydrate_archived_session():
+    async def run():
+        history = make_history()
+        await history.aadd_messages([HumanMessage(content="问题"), AIMessage(content="回答")])
+        assert await HistoryMaintainer().aarchive_session(history.redis_client, history.session_id)
+        assert not await history.redis_client.exists(history.key)
+
+        assert [m.content for m in history.messages] == ["问题", "回答"]
+        assert await history.redis_client.exists(history.key)
+
+    asyncio.run(run())
+
+def test_sync_client_uses_async_connection_parameters():
+    async_client = redis.asyncio.Redis(host="redis.internal", port=6380, db=2, password="secret",
+                                       decode_responses=True)
+    client = sync_client_for(async_client)
+    kwargs = client.connection_pool.connection_kwargs
+    assert (kwargs["host"], kwargs["port"], kwargs["db"], kwargs["password"]) == ("redis.internal", 6380, 2, "secret")
+    assert kwargs["decode_responses"] is True
+    assert sync_client_for(async_client) is client
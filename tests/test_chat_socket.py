@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+from chat_socket import ChatSocket, IDLE_CLOSE_CODE
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+async def hang(turn_id):
+    await asyncio.Event().wait()
+
+def test_evicts_least_recent_idle_session():
+    async def run():
+        conn = ChatSocket(FakeWebSocket(), "u", heartbeat_interval=0, max_sessions=2)
+        busy = conn.session("a")
+        conn.start_turn(busy, hang)
+        conn.session("b")
+        # a有进行中的轮次，回收b
+        assert conn.session("c") is not None
+        assert list(conn.sessions) == [("u", "a"), ("u", "c")]
+
+        conn.start_turn(conn.session("c"), hang)
+        assert conn.session("d") is None
+        await conn.close()
+
+    asyncio.run(run())
+
+def test_cancel_by_turn_or_session():
+    async def run():
+        websocket = FakeWebSocket()
+        conn = ChatSocket(websocket, "u", heartbeat_interval=0)
+        first = conn.start_turn(conn.session("s1"), hang, "t1")
+        conn.start_turn(conn.session("s1"), hang, "t2")
+        conn.start_turn(conn.session("s1", "other"), hang, "t3")
+        await asyncio.sleep(0)
+
+        assert conn.cancel(first) == 1
+        await asyncio.sleep(0)
+        # 按会话取消时只匹配连接userHost下的s1，不取消其他用户的同名会话
+        assert conn.cancel(session_id="s1") == 1
+        await asyncio.sleep(0)
+        assert sorted(conn.turns) == ["t3"]
+        assert [frame["turn_id"] for frame in websocket.sent if frame["type"] == "cancelled"] == ["t1", "t2"]
+
+        assert conn.cancel(session_id="s1", user_host="other") == 1
+        await asyncio.sleep(0)
+        assert conn.turns == {}
+
+    asyncio.run(run())
+
+def test_idle_connection_is_closed():
+    async def run():
+        websocket = FakeWebSocket()
+        conn = ChatSocket(websocket, "u", heartbeat_interval=0.01, idle_timeout=0.03)
+        conn.start_turn(conn.session("s1"), hang, "t1")
+        conn.start()
+        await asyncio.sleep(0.1)
+        assert conn.idle_closed and conn.closed
+        assert websocket.close_code == IDLE_CLOSE_CODE
+        assert conn.turns == {} and conn.sessions == {}
+
+    asyncio.run(run())
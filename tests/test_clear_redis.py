@@ -0,0 +1,94 @@
+import asyncio
+
+from langchain_core.messages import HumanMessage
+
+from chat_history import AsyncRedisChatMessageHistory
+from conftest import asgi_client
+
+async def seed(redis_client, *session_keys):
+    for user_host, session_id in session_keys:
+        history = AsyncRedisChatMessageHistory(redis_client=redis_client, session_id=f"{user_host}_{session_id}",
+                                               user_host=user_host)
+        await history.aadd_messages([HumanMessage(content="hi")])
+
+async def seed_legacy(redis_client, *session_keys):
+    """写入会话索引引入之前的会话（不记录到user_sessions:{userHost}）"""
+    for user_host, session_id in session_keys:
+        history = AsyncRedisChatMessageHistory(redis_client=redis_client, session_id=f"{user_host}_{session_id}")
+        await history.aadd_messages([HumanMessage(content="hi")])
+
+async def sessions(redis_client):
+    return sorted(key[len("message_store:"):] for key in await redis_client.keys("message_store:*"))
+
+async def wait_job(main, job_id):
+    for _ in range(100):
+        if main.bulk_deleter.jobs[job_id].status in ("done", "failed"):
+            return main.bulk_deleter.jobs[job_id]
+        await asyncio.sleep(0.01)
+    raise AssertionError("删除任务未完成")
+
+def test_clear_single_session(redis_app):
+    main, redis_client = redis_app
+
+    async def run():
+        await seed(redis_client, ("u", "s1"), ("u", "s2"), ("unknown", "s1"))
+        async with asgi_client(main.app) as client:
+            body = (await client.post("/clear-redis", params={"userHost": "u", "session_id": "s1"})).json()
+            assert body["status"] == "success"
+            assert await sessions(redis_client) == ["u_s2", "unknown_s1"]
+
+            # 没有userHost时与/chat一样使用unknown，而不是清空全部会话
+            body = (await client.post("/clear-redis", params={"session_id": "s1"})).json()
+            assert body["status"] == "success"
+            assert await sessions(redis_client) == ["u_s2"]
+
+    asyncio.run(run())
+
+def test_clear_user_keeps_users_sharing_the_prefix(redis_app):
+    main, redis_client = redis_app
+
+    async def run():
+        await seed(redis_client, ("u", "s1"), ("u", "s2"), ("u_b", "s1"), ("v", "s1"))
+        async with asgi_client(main.app) as client:
+            body = (await client.post("/clear-redis", params={"userHost": "u"})).json()
+            assert body["status"] == "success"
+            job = await wait_job(main, body["job_id"])
+        assert job.status == "done" and job.user_host == "u"
+        assert await sessions(redis_client) == ["u_b_s1", "v_s1"]
+
+    asyncio.run(run())
+
+def test_clear_user_without_index_scans_legacy_sessions(redis_app):
+    main, redis_client = redis_app
+
+    async def run():
+        await seed_legacy(redis_client, ("u", "s1"), ("u", "s2"), ("v", "s1"))
+        await seed(redis_client, ("u_b", "s1"))
+        await redis_client.set("summary_store:u_s1", "{}")
+        async with asgi_client(main.app) as client:
+            body = (await client.post("/clear-redis", params={"userHost": "u"})).json()
+            job = await wait_job(main, body["job_id"])
+        assert job.status == "done"
+        # u_b_s1记录在u_b的会话索引中，不属于u
+        assert await sessions(redis_client) == ["u_b_s1", "v_s1"]
+        assert await redis_client.exists("summary_store:u_s1") == 0
+
+    asyncio.run(run())
+
+def test_clear_all_requires_explicit_flag(redis_app):
+    main, redis_client = redis_app
+
+    async def run():
+        await seed(redis_client, ("u", "s1"), ("v", "s1"))
+        async with asgi_client(main.app) as client:
+            body = (await client.post("/clear-redis")).json()
+            assert body["status"] == "error"
+            assert await sessions(redis_client) == ["u_s1", "v_s1"]
+
+            body = (await client.post("/clear-redis", params={"all": "true"})).json()
+            assert body["status"] == "success"
+            await wait_job(main, body["job_id"])
+        assert await sessions(redis_client) == []
+        assert await redis_client.keys("user_sessions:*") == []
+
+    asyncio.run(run())
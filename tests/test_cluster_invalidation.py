@@ -0,0 +1,51 @@
+import asyncio
+
+import fakeredis.aioredis
+from langchain_core.messages import AIMessage, HumanMessage
+
+import main
+from chat_history import AsyncRedisChatMessageHistory
+from redis_cleanup import adelete_session
+from session_cache import SessionCache
+
+def history(redis_client, cache, session_key="alice_s1"):
+    return AsyncRedisChatMessageHistory(redis_client=redis_client, session_id=session_key, cache=cache,
+                                        user_host="alice")
+
+def test_sessions_cleared_drops_cached_session(monkeypatch):
+    """工作进程B删除会话后，A收到sessions_cleared时移除缓存，B再写入时A读到的是新消息"""
+    async def run():
+        redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        cache_a, cache_b = SessionCache(), SessionCache()
+        monkeypatch.setattr(main, "session_cache", cache_a)
+
+        await history(redis_client, cache_a).aadd_messages([HumanMessage(content="旧问题"), AIMessage(content="旧回答")])
+        assert [m.content for m in await history(redis_client, cache_a).aget_messages()] == ["旧问题", "旧回答"]
+        assert cache_a.stats()["sessions"] == 1
+
+        # 工作进程B删除会话并广播，A的处理函数移除对应的缓存
+        await adelete_session(redis_client, "alice_s1", "alice")
+        main.invalidate_sessions("alice_s1")
+        assert cache_a.stats()["sessions"] == 0
+
+        await history(redis_client, cache_b).aadd_messages([HumanMessage(content="新问题"), AIMessage(content="新回答")])
+        assert [m.content for m in await history(redis_client, cache_a).aget_messages()] == ["新问题", "新回答"]
+
+    asyncio.run(run())
+
+def test_user_clear_drops_only_that_users_sessions(monkeypatch):
+    async def run():
+        redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        cache = SessionCache()
+        monkeypatch.setattr(main, "session_cache", cache)
+        for session_key in ("alice_s1", "alice_s2", "bob_s1"):
+            await history(redis_client, cache, session_key).aadd_messages([HumanMessage(content=session_key)])
+            await history(redis_client, cache, session_key).aget_messages()
+        assert cache.stats()["sessions"] == 3
+
+        main.invalidate_sessions(user_host="alice")
+        assert cache.stats()["sessions"] == 1
+        main.invalidate_sessions()
+        assert cache.stats()["sessions"] == 0
+
+    asyncio.run(run())
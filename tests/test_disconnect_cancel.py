@@ -0,0 +1,71 @@
+import asyncio
+
+from conftest import FakeChunk
+from singleflight import SingleFlight
+
+class StallingChat:
+    """输出一个token后一直等待，模拟生成中的模型"""
+
+    async def astream(self, messages):
+        yield FakeChunk("部分")
+        await asyncio.Event().wait()
+
+async def read(broadcast, stop, received):
+    async for token in broadcast.subscribe(stop):
+        received.append(token)
+
+def start_turn(main, flights, session_key):
+    history = main.create_message_history(session_key, "u")
+    return flights.join("k", lambda b: main.run_chat_turn(b, history, session_key, "u", "你好", None, True))
+
+async def disconnect(broadcast, stop, reader):
+    stop.set()
+    broadcast.wake()
+    await reader
+
+def test_generation_is_cancelled_after_the_last_subscriber_leaves(redis_app, monkeypatch):
+    main, redis_client = redis_app
+    monkeypatch.setattr(main, "chat", StallingChat())
+    monkeypatch.setattr(main, "CHAT_PARTIAL_RESPONSE_POLICY", "save_marked")
+
+    async def run():
+        flights = SingleFlight(cancel_abandoned=True)
+        broadcast = start_turn(main, flights, "u_s1")
+        stops = [asyncio.Event(), asyncio.Event()]
+        received = [[], []]
+        readers = [asyncio.create_task(read(broadcast, stop, tokens)) for stop, tokens in zip(stops, received)]
+        while not broadcast.tokens:
+            await asyncio.sleep(0.01)
+
+        # 还有其他订阅者时继续生成
+        await disconnect(broadcast, stops[0], readers[0])
+        await asyncio.sleep(0.01)
+        assert not broadcast.task.done()
+
+        await disconnect(broadcast, stops[1], readers[1])
+        await asyncio.gather(broadcast.task, return_exceptions=True)
+        assert broadcast.cancelled and received == [["部分"], ["部分"]]
+        assert flights.stats()["cancelled"] == 1
+        # 按save_marked策略保存带中断标记的部分回答
+        history = main.create_message_history("u_s1", "u")
+        assert [m.content for m in await history.aget_messages()] == ["你好", "部分" + main.PARTIAL_RESPONSE_MARKER]
+
+    asyncio.run(run())
+
+def test_discarded_partial_response_is_not_saved(redis_app, monkeypatch):
+    main, redis_client = redis_app
+    monkeypatch.setattr(main, "chat", StallingChat())
+    monkeypatch.setattr(main, "CHAT_PARTIAL_RESPONSE_POLICY", "discard")
+
+    async def run():
+        broadcast = start_turn(main, SingleFlight(cancel_abandoned=True), "u_s1")
+        stop = asyncio.Event()
+        reader = asyncio.create_task(read(broadcast, stop, []))
+        while not broadcast.tokens:
+            await asyncio.sleep(0.01)
+        await disconnect(broadcast, stop, reader)
+        await asyncio.gather(broadcast.task, return_exceptions=True)
+        assert broadcast.cancelled
+        assert not await redis_client.exists("message_store:u_s1")
+
+    asyncio.run(run())
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from chat_history import AsyncRedisChatMessageHistory
+from conftest import asgi_client
+
+async def seed(redis_client, count):
+    """写入count条消息，内容为 m0..m{count-1}（m0最旧）"""
+    history = AsyncRedisChatMessageHistory(redis_client=redis_client, session_id="u_s1")
+    await history.aadd_messages([(HumanMessage if i % 2 == 0 else AIMessage)(content=f"m{i}") for i in range(count)])
+    return history
+
+def contents(body):
+    return [message["content"] for message in body["messages"]]
+
+def test_history_pages_by_offset_and_cursor(redis_app):
+    main, redis_client = redis_app
+
+    async def run():
+        history = await seed(redis_client, 5)
+        async with asgi_client(main.app) as client:
+            params = {"session_id": "s1", "user_host": "u", "limit": 2}
+            body = (await client.get("/history", params=params)).json()
+            assert contents(body) == ["m4", "m3"] and body["total"] == 5 and body["next_start"] == 2
+            body = (await client.get("/history", params={**params, "start": 4})).json()
+            assert contents(body) == ["m0"] and body["next_start"] is None
+
+            # 游标分页：翻页期间写入的新消息不影响后续页
+            body = (await client.get("/history", params={**params, "before": 5})).json()
+            assert contents(body) == ["m4", "m3"] and body["next_before"] == 3
+            await history.aadd_messages([HumanMessage(content="m5")])
+            body = (await client.get("/history", params={**params, "before": body["next_before"]})).json()
+            assert contents(body) == ["m2", "m1"] and body["next_before"] == 1
+
+            response = await client.get("/history", params={**params, "format": "ndjson"})
+            assert [json.loads(line)["content"] for line in response.text.splitlines()] == ["m5", "m4"]
+            assert response.headers["x-total-count"] == "6"
+
+    asyncio.run(run())
+
+def test_history_etag_returns_304_until_the_session_changes(redis_app):
+    main, redis_client = redis_app
+
+    async def run():
+        history = await seed(redis_client, 2)
+        async with asgi_client(main.app) as client:
+            params = {"session_id": "s1", "user_host": "u"}
+            etag = (await client.get("/history", params=params)).headers["etag"]
+            response = await client.get("/history", params=params, headers={"If-None-Match": etag})
+            assert response.status_code == 304
+
+            await history.aadd_messages([HumanMessage(content="m2")])
+            response = await client.get("/history", params=params, headers={"If-None-Match": etag})
+            assert response.status_code == 200 and response.headers["etag"] != etag
+            assert contents(response.json())[0] == "m2"
+
+    asyncio.run(run())
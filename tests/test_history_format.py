@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import fakeredis.aioredis
+from langchain_core.messages import AIMessage, HumanMessage, message_to_dict
+
+from chat_history import (AsyncRedisChatMessageHistory, decode_archive, decode_item, encode_archive, encode_message,
+                          is_compact, parse_entry)
+from history_archive import HistoryMaintainer
+
+def legacy_item(message):
+    """会话历史改为紧凑格式之前写入的条目（完整message_to_dict JSON，没有tokens字段）"""
+    return json.dumps(message_to_dict(message))
+
+def test_compact_and_legacy_items_decode_to_the_same_message():
+    message = HumanMessage(content="你好")
+    compact = encode_message(message, tokens=3)
+    assert is_compact(compact) and json.loads(compact) == ["h", "你好", 3]
+    assert not is_compact(encode_message(message, compact=False))
+
+    for item in (compact, encode_message(message, tokens=3, compact=False)):
+        decoded, tokens = decode_item(item)
+        assert (decoded.type, decoded.content, tokens) == ("human", "你好", 3)
+        assert parse_entry(item) == {"type": "human", "content": "你好"}
+
+    # 旧数据没有token数时现场计算
+    decoded, tokens = decode_item(legacy_item(AIMessage(content="回答")))
+    assert (decoded.type, decoded.content) == ("ai", "回答") and tokens > 0
+
+    # 带额外字段的消息不能用紧凑格式表示
+    assert not is_compact(encode_message(AIMessage(content="", additional_kwargs={"tool_calls": []}), tokens=1))
+
+def test_mixed_formats_and_migration():
+    async def run():
+        redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        history = AsyncRedisChatMessageHistory(redis_client=redis_client, session_id="u_s1")
+        await redis_client.rpush(history.key, legacy_item(AIMessage(content="回答1")),
+                                 legacy_item(HumanMessage(content="问题1")))
+        await redis_client.expire(history.key, 600)
+        await history.aadd_messages([HumanMessage(content="问题2")])
+        assert [m.content for m in await history.aget_messages()] == ["问题1", "回答1", "问题2"]
+
+        _, version = await history.aget_state()
+        assert await HistoryMaintainer(migrate=True).amigrate_key(redis_client, history.key)
+        items = await redis_client.lrange(history.key, 0, -1)
+        assert all(is_compact(item) for item in items)
+        # 内容不变：版本号保留，TTL保留
+        assert (await history.aget_state())[1] == version
+        assert await redis_client.ttl(history.key) > 0
+        assert [decode_item(item)[0].content for item in reversed(items)] == ["问题1", "回答1", "问题2"]
+
+    asyncio.run(run())
+
+def test_archive_round_trip():
+    items = [encode_message(HumanMessage(content="问题" * 50), tokens=1), legacy_item(AIMessage(content="回答"))]
+    assert decode_archive(encode_archive(items)) == items
+
+    async def run():
+        redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        history = AsyncRedisChatMessageHistory(redis_client=redis_client, session_id="u_s1", ttl=600)
+        await history.aadd_messages([HumanMessage(content="问题"), AIMessage(content="回答")])
+        before = await redis_client.lrange(history.key, 0, -1)
+        state = await history.aget_state()
+
+        assert await HistoryMaintainer(archive_idle_seconds=1).aarchive_session(redis_client, history.session_id)
+        assert not await redis_client.exists(history.key)
+        assert await redis_client.ttl(history.archive_key) > 0
+
+        # 读取时自动恢复：条目、版本号与归档前一致，归档键删除
+        assert await history.aget_state() == state
+        assert await redis_client.lrange(history.key, 0, -1) == before
+        assert not await redis_client.exists(history.archive_key)
+        assert await redis_client.ttl(history.key) > 0
+
+    asyncio.run(run())
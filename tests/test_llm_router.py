@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from llm_router import Endpoint, LLMRouter
+
+class UpstreamError(Exception):
+    pass
+
+class StubLLM:
+    """
+    模拟上游模型：首个token前等待delay秒，fail为True时在首个token前出错
+
+    closed记录被关闭的流数，用于检查落败和被取消的请求都已释放
+    """
+
+    def __init__(self, delay=0.0, fail=False, tokens=("你", "好")):
+        self.delay = delay
+        self.fail = fail
+        self.tokens = tokens
+        self.calls = 0
+        self.closed = 0
+
+    async def ainvoke(self, input, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise UpstreamError("upstream failed")
+        return "".join(self.tokens)
+
+    async def astream(self, input, **kwargs):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                raise UpstreamError("upstream failed")
+            for token in self.tokens:
+                yield token
+        finally:
+            self.closed += 1
+
+def make_router(*llms, hedge_after=0.0):
+    endpoints = [Endpoint(f"e{index}", llm) for index, llm in enumerate(llms)]
+    # 关闭随机探索，按评分确定性地选择端点
+    return LLMRouter(endpoints, hedge_after=hedge_after, explore_ratio=0.0), endpoints
+
+async def collect(router):
+    return [token async for token in router.astream("hi")]
+
+def test_stream_fails_over_before_first_token():
+    async def run():
+        broken, healthy = StubLLM(fail=True), StubLLM()
+        router, endpoints = make_router(broken, healthy)
+        assert await collect(router) == ["你", "好"]
+        assert router.stats()["failovers"] == 1
+        assert endpoints[0].errors == 1 and endpoints[0].error_rate > 0
+        assert endpoints[1].requests == 1 and endpoints[1].errors == 0
+        assert [e.in_flight for e in endpoints] == [0, 0]
+
+        # 出错的端点评分变差，下一次直接选择健康的端点
+        assert router.choose() is endpoints[1]
+
+    asyncio.run(run())
+
+def test_stream_raises_last_error_when_all_endpoints_fail():
+    async def run():
+        router, endpoints = make_router(StubLLM(fail=True), StubLLM(fail=True))
+        with pytest.raises(UpstreamError):
+            await collect(router)
+        assert [e.errors for e in endpoints] == [1, 1]
+        assert [e.in_flight for e in endpoints] == [0, 0]
+
+    asyncio.run(run())
+
+def test_ainvoke_fails_over():
+    async def run():
+        router, endpoints = make_router(StubLLM(fail=True), StubLLM())
+        assert await router.ainvoke("hi") == "你好"
+        assert router.stats()["failovers"] == 1
+        assert [e.in_flight for e in endpoints] == [0, 0]
+
+    asyncio.run(run())
+
+def test_hedge_wins_and_cancels_slow_attempt():
+    async def run():
+        slow, fast = StubLLM(delay=5.0), StubLLM(delay=0.01)
+        router, endpoints = make_router(slow, fast, hedge_after=0.05)
+        assert await collect(router) == ["你", "好"]
+        stats = router.stats()
+        assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+        # 落败的请求被取消，并以已等待的时间作为延迟样本
+        assert slow.closed == 1 and endpoints[0].latency >= 0.05
+        assert [e.in_flight for e in endpoints] == [0, 0]
+
+    asyncio.run(run())
+
+def test_no_hedge_when_first_token_is_fast():
+    async def run():
+        first, second = StubLLM(delay=0.0), StubLLM()
+        router, endpoints = make_router(first, second, hedge_after=0.5)
+        assert await collect(router) == ["你", "好"]
+        assert router.stats()["hedges"] == 0
+        assert second.calls == 0
+
+    asyncio.run(run())
+
+def test_in_flight_counts_during_stream():
+    async def run():
+        router, endpoints = make_router(StubLLM())
+        stream = router.astream("hi")
+        assert await stream.__anext__() == "你"
+        assert endpoints[0].in_flight == 1
+        await stream.aclose()
+        assert endpoints[0].in_flight == 0
+
+    asyncio.run(run())
+
+@pytest.mark.parametrize("cancel_at", [0.01, 0.08])
+def test_cancelled_stream_decrements_each_endpoint_once(cancel_at):
+    """在对冲前或两个请求都在进行时取消外层任务，每个端点的in_flight都回到0"""
+    async def run():
+        first, second = StubLLM(delay=5.0), StubLLM(delay=5.0)
+        router, endpoints = make_router(first, second, hedge_after=0.05)
+        task = asyncio.create_task(collect(router))
+        await asyncio.sleep(cancel_at)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert [e.in_flight for e in endpoints] == [0, 0]
+
+    asyncio.run(run())
+
+def test_cancel_while_closing_losers_decrements_once():
+    """外层任务在等待落败请求结束时再次被取消，不会重复扣减in_flight"""
+    class SlowCloseLLM(StubLLM):
+        async def astream(self, input, **kwargs):
+            self.calls += 1
+            try:
+                await asyncio.sleep(self.delay)
+                yield "慢"
+            finally:
+                # 取消时关闭连接需要一段时间
+                await asyncio.sleep(0.2)
+                self.closed += 1
+
+    async def run():
+        slow, fast = SlowCloseLLM(delay=5.0), StubLLM(delay=0.01)
+        router, endpoints = make_router(slow, fast, hedge_after=0.05)
+        task = asyncio.create_task(collect(router))
+        # 快端点胜出后，外层任务在等待慢端点关闭时被取消
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert [e.in_flight for e in endpoints] == [0, 0]
+        assert fast.closed == 1
+
+    asyncio.run(run())
@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import pytest
+
+from llm_scheduler import AdmissionScheduler, BATCH, classify_error
+
+class RateLimited(Exception):
+    """模拟上游的429错误（与openai客户端的错误一样带status_code和response.headers）"""
+
+    def __init__(self, retry_after=None):
+        super().__init__("429 Too Many Requests")
+        self.status_code = 429
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after} if retry_after else {}})()
+
+def test_classify_error():
+    assert classify_error(RateLimited("2")) == (True, 2.0)
+    assert classify_error(asyncio.TimeoutError()) == (True, None)
+    assert classify_error(ValueError("bad request")) == (False, None)
+
+def test_overload_halves_limit_and_success_recovers():
+    async def run():
+        scheduler = AdmissionScheduler(max_inflight=8, decrease_cooldown=0)
+        with pytest.raises(RateLimited):
+            async with scheduler.slot("u"):
+                raise RateLimited()
+        assert scheduler.capacity == 4
+        assert scheduler.stats()["overloads"] == 1
+
+        # 加性增：每个并发窗口的成功请求使上限加1
+        for _ in range(4):
+            async with scheduler.slot("u"):
+                pass
+        assert scheduler.capacity == 5
+        assert scheduler.in_flight == 0
+
+    asyncio.run(run())
+
+def test_decrease_cooldown_limits_consecutive_decreases():
+    async def run():
+        scheduler = AdmissionScheduler(max_inflight=8, decrease_cooldown=60)
+        for _ in range(3):
+            await scheduler.acquire("u")
+        for _ in range(3):
+            scheduler.release(RateLimited())
+        assert scheduler.capacity == 4
+        assert scheduler.stats()["overloads"] == 3
+
+    asyncio.run(run())
+
+def test_retry_after_pauses_admission():
+    async def run():
+        scheduler = AdmissionScheduler(max_inflight=4, decrease_cooldown=0)
+        await scheduler.acquire("u")
+        scheduler.release(RateLimited("0.2"))
+        assert scheduler.stats()["paused_for"] > 0
+
+        start = time.monotonic()
+        async with scheduler.slot("u"):
+            waited = time.monotonic() - start
+        assert waited >= 0.15
+        assert scheduler.stats()["queue_depth"] == 0
+
+    asyncio.run(run())
+
+def test_cancelled_call_does_not_change_limit():
+    async def run():
+        scheduler = AdmissionScheduler(max_inflight=8, decrease_cooldown=0)
+        await scheduler.acquire("u")
+        scheduler.release(RateLimited())
+        assert scheduler.capacity == 4
+
+        started = asyncio.Event()
+
+        async def call():
+            async with scheduler.slot("u", BATCH):
+                started.set()
+                await asyncio.sleep(10)
+
+        for _ in range(10):
+            started.clear()
+            task = asyncio.create_task(call())
+            await started.wait()
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        stats = scheduler.stats()
+        assert scheduler.limit == 4.0
+        assert stats["successes"] == 0
+        assert stats["cancelled"] == 10
+        assert stats["in_flight"] == 0 and stats["batch_in_flight"] == 0
+
+    asyncio.run(run())
+
+def test_cancelled_waiter_leaves_queue():
+    async def run():
+        scheduler = AdmissionScheduler(max_inflight=1, min_inflight=1)
+        await scheduler.acquire("u")
+        waiter = asyncio.create_task(scheduler.acquire("v"))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queue_depth"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.stats()["queue_depth"] == 0
+        scheduler.release()
+        assert scheduler.in_flight == 0
+
+    asyncio.run(run())
@@ -0,0 +1,40 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+import local_store
+from local_store import LocalSessionStore
+
+def contents(store, key):
+    return [message.content for message, _, _ in store.get_entries(key)]
+
+def test_evicts_least_recently_used_session():
+    store = LocalSessionStore(max_sessions=2)
+    store.append("a", [HumanMessage(content="a1")])
+    store.append("b", [HumanMessage(content="b1")])
+    # 访问a后b成为最久未访问的会话
+    assert contents(store, "a") == ["a1"]
+    store.append("c", [HumanMessage(content="c1")])
+    assert contents(store, "b") == []
+    assert contents(store, "a") == ["a1"] and contents(store, "c") == ["c1"]
+    assert store.stats()["evicted_sessions"] == 1
+
+def test_trims_oldest_messages_of_the_only_session_over_capacity():
+    store = LocalSessionStore(max_messages=3)
+    store.append("a", [HumanMessage(content=f"m{i}") for i in range(2)])
+    store.append("b", [HumanMessage(content="b1"), AIMessage(content="b2")])
+    assert contents(store, "a") == []
+    store.append("b", [HumanMessage(content="b3"), AIMessage(content="b4")])
+    assert contents(store, "b") == ["b2", "b3", "b4"]
+    assert store.stats()["messages"] == 3
+
+def test_idle_sessions_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(local_store.time, "monotonic", lambda: now[0])
+    store = LocalSessionStore(ttl=60)
+    store.append("a", [HumanMessage(content="a1")])
+    store.append("b", [HumanMessage(content="b1")])
+    now[0] += 50
+    assert store.get_state("b") == (1, 1)
+    now[0] += 20
+    # a空闲70秒已过期，b在50秒时被访问过
+    assert store.get_entries("a") == [] and contents(store, "b") == ["b1"]
+    assert store.stats()["expired"] == 1
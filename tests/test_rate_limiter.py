@@ -0,0 +1,42 @@
+import asyncio
+
+import fakeredis.aioredis
+
+from rate_limiter import RateLimiter
+
+def clients():
+    """Redis令牌桶和进程内令牌桶两种实现"""
+    return [fakeredis.aioredis.FakeRedis(decode_responses=True), None]
+
+def test_request_limit_is_shared_and_per_user():
+    async def run():
+        for redis_client in clients():
+            limiter = RateLimiter(user_rpm=2)
+            assert (await limiter.acheck("u", "u_s1", 1, redis_client)).allowed
+            assert (await limiter.acheck("u", "u_s2", 1, redis_client)).allowed
+            result = await limiter.acheck("u", "u_s1", 1, redis_client)
+            assert not result.allowed and result.limit_name == "user_rpm"
+            # 每分钟补充2个，约30秒后可以重试
+            assert 25 < result.retry_after <= 30
+            assert (await limiter.acheck("v", "v_s1", 1, redis_client)).allowed
+            if redis_client is not None:
+                # 多个工作进程共享Redis中的限额
+                assert not (await RateLimiter(user_rpm=2).acheck("u", "u_s3", 1, redis_client)).allowed
+
+    asyncio.run(run())
+
+def test_buckets_are_taken_together_and_charges_overdraw():
+    async def run():
+        for redis_client in clients():
+            limiter = RateLimiter(user_tpm=100, session_rpm=1)
+            result = await limiter.acheck("u", "u_s1", 150, redis_client)
+            assert not result.allowed and result.limit_name == "user_tpm"
+            # 被拒绝的请求不扣减会话的请求数
+            assert (await limiter.acheck("u", "u_s1", 10, redis_client)).allowed
+
+            # 补扣实际消耗时允许透支，之后的请求等待token补回
+            await limiter.acharge("u", "u_s1", 200, redis_client)
+            result = await limiter.acheck("u", "u_s2", 10, redis_client)
+            assert not result.allowed and result.limit_name == "user_tpm" and result.retry_after > 60
+
+    asyncio.run(run())
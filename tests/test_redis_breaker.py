@@ -0,0 +1,42 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from circuit_breaker import CLOSED
+from local_store import LocalSessionStore
+from write_buffer import BufferedChatMessageHistory, WriteBuffer
+
+def test_breaker_switches_to_local_mode_and_back_after_replay(redis_app, monkeypatch):
+    main, redis_client = redis_app
+    monkeypatch.setattr(main, "write_buffer", WriteBuffer())
+    monkeypatch.setattr(main, "local_store", LocalSessionStore())
+    monkeypatch.setattr(main, "replay_task", None)
+    # 熔断器初始为打开状态（尚未探测），从已连接Redis开始
+    monkeypatch.setattr(main.redis_breaker, "state", CLOSED)
+
+    async def run():
+        main.redis_breaker.trip("测试")
+        try:
+            assert main.USE_LOCAL_MODE
+            history = main.create_message_history("u_s1", "u")
+            assert isinstance(history, BufferedChatMessageHistory)
+            await history.aadd_turn(HumanMessage(content="问题"), AIMessage(content="回答"))
+            assert len(main.write_buffer) == 1 and not await redis_client.exists("message_store:u_s1")
+
+            # 半开试探期间仍使用本地存储
+            main.redis_breaker.half_open()
+            assert main.USE_LOCAL_MODE
+        finally:
+            main.redis_breaker.close()
+        # 关闭后先回放缓冲的写入，完成后才切回Redis存储
+        assert main.USE_LOCAL_MODE
+        await main.replay_task
+        assert not main.USE_LOCAL_MODE
+        assert len(main.write_buffer) == 0
+        assert await redis_client.lrange("message_store:u_s1", 0, -1) and main.local_store.stats()["sessions"] == 0
+        assert await redis_client.smembers("user_sessions:u") == {"u_s1"}
+
+        history = main.create_message_history("u_s1", "u")
+        assert [m.content for m in await history.aget_messages()] == ["问题", "回答"]
+
+    asyncio.run(run())
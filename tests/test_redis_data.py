@@ -0,0 +1,42 @@
+import asyncio
+import json
+
+from conftest import asgi_client
+
+async def fetch(client, **params):
+    """请求/redis-data，返回 (键列表, 最后一行的分页信息)"""
+    lines = [json.loads(line) for line in (await client.get("/redis-data", params=params)).text.splitlines()]
+    return [line["key"] for line in lines[:-1]], lines[-1]
+
+def test_pages_are_sliced_to_max_keys_without_losing_keys(redis_app):
+    main, redis_client = redis_app
+
+    async def run():
+        for i in range(25):
+            await redis_client.set(f"k{i}", i)
+        async with asgi_client(main.app) as client:
+            seen = []
+            page = {"cursor": 0, "skip": 0}
+            for _ in range(10):
+                keys, page = await fetch(client, cursor=page["cursor"], skip=page["skip"], count=10, max_keys=7)
+                assert len(keys) <= 7 and page["returned"] == len(keys)
+                seen += keys
+                if page["cursor"] == 0 and page["skip"] == 0:
+                    break
+        assert sorted(seen) == sorted(f"k{i}" for i in range(25))
+
+    asyncio.run(run())
+
+def test_scan_calls_are_capped_per_request(redis_app, monkeypatch):
+    main, redis_client = redis_app
+    monkeypatch.setattr(main, "REDIS_DATA_MAX_SCANS", 3)
+
+    async def run():
+        for i in range(20):
+            await redis_client.set(f"k{i}", i)
+        async with asgi_client(main.app) as client:
+            # 没有匹配的键时也只扫描REDIS_DATA_MAX_SCANS批，返回游标供继续遍历
+            keys, page = await fetch(client, pattern="missing:*", count=2)
+        assert keys == [] and page["cursor"] != 0
+
+    asyncio.run(run())
@@ -0,0 +1,54 @@
+import asyncio
+
+import fakeredis.aioredis
+from langchain_core.messages import AIMessage, HumanMessage
+
+from response_cache import ResponseCache, make_cache_key
+from conftest import FakeChat
+from singleflight import TokenBroadcast
+
+def test_cache_key_covers_params_and_context():
+    messages = [HumanMessage(content="问题"), AIMessage(content="回答"), HumanMessage(content="你好")]
+    params = {"model": "m", "temperature": 0}
+    assert make_cache_key(params, messages) == make_cache_key(dict(params), list(messages))
+    assert make_cache_key(params, messages) != make_cache_key(params, messages[2:])
+    assert make_cache_key(params, messages) != make_cache_key({**params, "temperature": 1}, messages)
+
+def test_redis_entries_are_shared_and_local_entries_bounded():
+    async def run():
+        redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        await ResponseCache().aset("k1", ["a", "b"], redis_client)
+
+        # 其他工作进程从Redis命中后写入自己的进程内缓存
+        cache = ResponseCache(local_max_entries=1)
+        assert await cache.aget("k1", redis_client) == ["a", "b"]
+        assert await cache.aget("k1") == ["a", "b"]
+        await cache.aset("k2", ["c"])
+        assert await cache.aget("k1") is None
+        stats = cache.stats()
+        assert (stats["redis_hits"], stats["local_hits"], stats["misses"], stats["local_entries"]) == (1, 1, 1, 1)
+
+    asyncio.run(run())
+
+def test_identical_prompt_replays_cached_tokens(redis_app, monkeypatch):
+    main, redis_client = redis_app
+    chat = FakeChat()
+    monkeypatch.setattr(main, "chat", chat)
+    monkeypatch.setattr(main, "response_cache", ResponseCache())
+
+    async def turn(session_key, bypass_cache=False):
+        broadcast = TokenBroadcast()
+        await main.run_chat_turn(broadcast, main.create_message_history(session_key, "u"), session_key, "u",
+                                 "你好", None, bypass_cache)
+        return broadcast.tokens
+
+    async def run():
+        assert await turn("u_s1") == ["你", "好"]
+        # 新会话的上下文相同，回放缓存的token而不调用模型，历史照常写入
+        assert await turn("u_s2") == ["你", "好"]
+        assert chat.calls == 1
+        assert await redis_client.llen("message_store:u_s2") == 2
+        assert await turn("u_s3", bypass_cache=True) == ["你", "好"]
+        assert chat.calls == 2
+
+    asyncio.run(run())
@@ -0,0 +1,93 @@
+import asyncio
+
+import fakeredis.aioredis
+from langchain_core.messages import AIMessage, HumanMessage
+
+from chat_history import AsyncRedisChatMessageHistory
+from llm_scheduler import AdmissionScheduler
+from session_summary import SessionSummarizer
+
+class StubLLM:
+    """记录每次调用的提示词，返回递增编号的摘要；指定scheduler时同时记录调用时占用的名额"""
+
+    def __init__(self, scheduler=None):
+        self.prompts = []
+        self.scheduler = scheduler
+        self.slots = []
+
+    async def ainvoke(self, prompt):
+        self.prompts.append(prompt)
+        if self.scheduler is not None:
+            self.slots.append((self.scheduler.in_flight, self.scheduler.batch_in_flight))
+        return AIMessage(content=f"摘要{len(self.prompts)}")
+
+async def seed(count, user_host="alice"):
+    redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    history = AsyncRedisChatMessageHistory(redis_client=redis_client, session_id=f"{user_host}_s1", user_host=user_host)
+    await history.aadd_messages([HumanMessage(content=f"消息{i}") for i in range(count)])
+    return history
+
+def test_below_threshold_does_not_compact():
+    async def run():
+        llm = StubLLM()
+        summarizer = SessionSummarizer(llm, keep_recent=4, compact_threshold=3)
+        history = await seed(6)
+        summarizer.schedule_compaction(history, 6)
+        assert not summarizer._tasks
+        assert await summarizer.acompact(history) == 0
+        assert llm.prompts == []
+
+    asyncio.run(run())
+
+def test_compaction_folds_aged_messages_into_checkpoint():
+    async def run():
+        llm = StubLLM()
+        summarizer = SessionSummarizer(llm, keep_recent=4, compact_threshold=3)
+        history = await seed(7)
+        assert await summarizer.acompact(history) == 3
+        assert await summarizer.aget_checkpoint(history) == ("摘要1", 3)
+        assert "消息0" in llm.prompts[0] and "消息2" in llm.prompts[0] and "消息3" not in llm.prompts[0]
+
+        context = await summarizer.aget_context_messages(history)
+        assert context[0].content.endswith("摘要1")
+        assert [m.content for m in context[1:]] == ["消息3", "消息4", "消息5", "消息6"]
+
+        # 再新增不足阈值的消息不会压缩
+        await history.aadd_messages([HumanMessage(content="消息7"), HumanMessage(content="消息8")])
+        assert await summarizer.acompact(history) == 0
+        await history.aadd_messages([HumanMessage(content="消息9")])
+        assert await summarizer.acompact(history) == 3
+        assert await summarizer.aget_checkpoint(history) == ("摘要2", 6)
+        assert "摘要1" in llm.prompts[1]
+
+    asyncio.run(run())
+
+def test_compaction_splits_into_max_batch_calls():
+    async def run():
+        llm = StubLLM()
+        summarizer = SessionSummarizer(llm, keep_recent=2, compact_threshold=2, max_batch=4)
+        history = await seed(12)
+        assert await summarizer.acompact(history) == 10
+        assert len(llm.prompts) == 3
+        assert await summarizer.aget_checkpoint(history) == ("摘要3", 10)
+
+    asyncio.run(run())
+
+def test_background_compaction_runs_in_batch_slot():
+    async def run():
+        scheduler = AdmissionScheduler(max_inflight=4)
+        llm = StubLLM(scheduler)
+        summarizer = SessionSummarizer(llm, keep_recent=2, compact_threshold=2, scheduler=scheduler)
+        history = await seed(4)
+        summarizer.schedule_compaction(history, 4)
+        # 同一会话正在压缩时不重复启动
+        summarizer.schedule_compaction(history, 4)
+        assert len(summarizer._tasks) == 1
+        await asyncio.gather(*summarizer._tasks)
+
+        assert llm.slots == [(1, 1)]
+        assert scheduler.in_flight == 0 and scheduler.batch_in_flight == 0
+        assert scheduler.stats()["successes"] == 1
+        assert await summarizer.aget_checkpoint(history) == ("摘要1", 2)
+
+    asyncio.run(run())
@@ -0,0 +1,72 @@
+import asyncio
+
+import fakeredis.aioredis
+
+from singleflight import aclaim_flight, apublish_flight_result, arelease_flight, await_flight_result
+
+KEY = "alice_s1:digest"
+
+def test_waiter_replays_result_of_observed_flight():
+    async def run():
+        redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        claimed, flight_id = await aclaim_flight(redis_client, KEY)
+        assert claimed
+        again, observed = await aclaim_flight(redis_client, KEY)
+        assert not again and observed == flight_id
+
+        waiter = asyncio.create_task(await_flight_result(redis_client, KEY, observed, timeout=5))
+        await asyncio.sleep(0.1)
+        await apublish_flight_result(redis_client, KEY, flight_id, ["你", "好"])
+        assert await waiter == ["你", "好"]
+
+    asyncio.run(run())
+
+def test_finished_flight_is_not_replayed_for_new_request():
+    """上一次相同输入的结果仍未过期时，新的请求重新声明并自己生成，不回放旧结果"""
+    async def run():
+        redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        _, first = await aclaim_flight(redis_client, KEY)
+        await apublish_flight_result(redis_client, KEY, first, ["旧回答"])
+
+        claimed, second = await aclaim_flight(redis_client, KEY)
+        assert claimed and second != first
+
+        # 等待第二次生成的请求不会读到第一次的结果
+        _, observed = await aclaim_flight(redis_client, KEY)
+        assert observed == second
+        waiter = asyncio.create_task(await_flight_result(redis_client, KEY, observed, timeout=5))
+        await asyncio.sleep(0.1)
+        assert not waiter.done()
+        await apublish_flight_result(redis_client, KEY, second, ["新回答"])
+        assert await waiter == ["新回答"]
+
+    asyncio.run(run())
+
+def test_failed_flight_lets_waiter_reclaim_or_follow_new_holder():
+    async def run():
+        redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        _, first = await aclaim_flight(redis_client, KEY)
+        waiter = asyncio.create_task(await_flight_result(redis_client, KEY, first, timeout=5))
+        await asyncio.sleep(0.1)
+        await arelease_flight(redis_client, KEY, first)
+        assert await waiter is None
+
+        # 另一个进程抢先重新声明，等待方的重新声明失败并转而等待这一次生成
+        claimed, second = await aclaim_flight(redis_client, KEY)
+        assert claimed
+        claimed, observed = await aclaim_flight(redis_client, KEY)
+        assert not claimed and observed == second
+
+        # 旧的持有者释放时不会清除新一次生成的标记
+        await arelease_flight(redis_client, KEY, first)
+        assert await redis_client.get("singleflight:" + KEY) == second
+
+    asyncio.run(run())
+
+def test_wait_times_out_while_holder_is_running():
+    async def run():
+        redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        _, flight_id = await aclaim_flight(redis_client, KEY)
+        assert await await_flight_result(redis_client, KEY, flight_id, timeout=0.2) is None
+
+    asyncio.run(run())
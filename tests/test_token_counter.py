@@ -0,0 +1,49 @@
+import sys
+import threading
+import types
+
+import pytest
+
+import token_counter
+
+class FakeEncoding:
+    def encode(self, text):
+        return text.split()
+
+@pytest.fixture
+def fake_tiktoken(monkeypatch):
+    """用可控的tiktoken替身代替真实模块，并把加载状态重置为未加载"""
+    release = threading.Event()
+    release.set()
+
+    def get_encoding(name):
+        release.wait(5)
+        return FakeEncoding()
+
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(get_encoding=get_encoding))
+    monkeypatch.setattr(token_counter, "_ENCODING", None)
+    monkeypatch.setattr(token_counter, "_encoding_state", None)
+    return release
+
+def test_encoding_loads_on_first_use(fake_tiktoken):
+    assert token_counter._encoding_state is None
+    assert token_counter.count_tokens("one two three") == 3
+    assert token_counter._encoding_state == "done"
+
+def test_counts_approximately_while_preloading(fake_tiktoken):
+    fake_tiktoken.clear()
+    token_counter.preload_encoding()
+    # 后台加载尚未完成时不阻塞，使用近似估算（非CJK字符约每4个字符1个token）
+    assert token_counter.count_tokens("one two three") == 4
+    fake_tiktoken.set()
+    for thread in threading.enumerate():
+        if thread.name == "tiktoken-preload":
+            thread.join(5)
+    assert token_counter.count_tokens("one two three") == 3
+
+def test_falls_back_when_tiktoken_is_unavailable(monkeypatch):
+    monkeypatch.setitem(sys.modules, "tiktoken", None)
+    monkeypatch.setattr(token_counter, "_ENCODING", None)
+    monkeypatch.setattr(token_counter, "_encoding_state", None)
+    assert token_counter.count_tokens("你好，世界") == 5
+    assert token_counter.get_encoding() is None
@@ -0,0 +1,104 @@
+import re
+import threading
+from typing import List, Sequence
+from langchain_core.messages import BaseMessage
+from logger_config import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("token_counter")
+
+# 每条消息的固定开销（角色标记、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# CJK字符（中日韩统一表意文字及全角标点），近似按每字1个token计算
+_CJK_PATTERN = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+# tiktoken为可选依赖，安装后使用精确计数，否则使用近似估算。
+# 编码在第一次使用时（或由preload_encoding在后台线程中）加载，不在导入时读取BPE文件
+_ENCODING = None
+# 加载状态：None未加载，"loading"正在加载，"done"已完成（tiktoken不可用时_ENCODING仍为None）
+_encoding_state = None
+_encoding_lock = threading.Lock()
+
+def _load_encoding():
+    global _ENCODING, _encoding_state
+    try:
+        import tiktoken
+        _ENCODING = tiktoken.get_encoding("cl100k_base")
+        logger.info("已加载tiktoken编码，token数使用精确计数")
+    except Exception as e:
+        logger.info(f"tiktoken不可用（{str(e) or type(e).__name__}），token数使用近似估算")
+    _encoding_state = "done"
+
+def _claim_loading() -> bool:
+    global _encoding_state
+    with _encoding_lock:
+        if _encoding_state is not None:
+            return False
+        _encoding_state = "loading"
+        return True
+
+def preload_encoding():
+    """
+    在后台线程中加载tiktoken编码，加载完成前count_tokens使用近似估算，不阻塞调用方
+    """
+    if _claim_loading():
+        threading.Thread(target=_load_encoding, name="tiktoken-preload", daemon=True).start()
+
+def get_encoding():
+    """
+    返回tiktoken编码，第一次调用时在当前线程中加载
+
+    返回:
+        编码对象；tiktoken不可用或正在后台加载时返回None
+    """
+    if _encoding_state is None and _claim_loading():
+        _load_encoding()
+    return _ENCODING if _encoding_state == "done" else None
+
+def count_tokens(text: str) -> int:
+    """
+    估算一段文本的token数
+
+    参数:
+        text: 文本内容
+
+    返回:
+        token数
+    """
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+def count_message_tokens(message: BaseMessage) -> int:
+    """
+    估算一条消息的token数（包含固定开销）
+    """
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+def trim_to_token_budget(messages: Sequence[BaseMessage], token_budget: int) -> List[BaseMessage]:
+    """
+    从最新的消息开始向前保留，直到超出token预算
+
+    参数:
+        messages: 按时间顺序排列的消息
+        token_budget: token预算
+
+    返回:
+        按时间顺序排列的、在预算内的最近消息
+    """
+    total = 0
+    kept = []
+    for message in reversed(messages):
+        total += count_message_tokens(message)
+        if total > token_budget:
+            break
+        kept.append(message)
+    kept.reverse()
+    return kept
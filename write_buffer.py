@@ -0,0 +1,251 @@
+import glob
+import json
+import os
+from collections import deque
+from typing import List, Optional, Sequence, Set
+from langchain_core.messages import BaseMessage
+from logger_config import get_module_logger
+from chat_history import DEFAULT_KEY_PREFIX, encode_message, queue_append
+from local_store import LocalSessionStore, LocalChatMessageHistory
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 获取模块日志记录器
+logger = get_module_logger("write_buffer")
+
+# 默认配置
+DEFAULT_MAX_ENTRIES = 10000
+# 回放时每个MULTI事务包含的写入条数
+DEFAULT_REPLAY_BATCH = 100
+# 多个工作进程使用同一路径时，每个进程独占一个编号的文件，最多尝试的编号数
+MAX_FILE_SLOTS = 64
+
+class WriteBuffer:
+    """
+    Redis不可用期间的会话历史写入缓冲
+
+    每条记录为一次aadd_messages写入（会话ID、已序列化的消息、TTL），按到达顺序排队；
+    指定path时同时追加到JSONL文件，进程重启后从文件恢复。Redis恢复后按顺序分批回放，
+    回放完成的记录从队列和文件中移除。队列满时拒绝新的写入并计入dropped。
+
+    文件在open()时才打开（在工作进程中调用）。多个工作进程配置同一路径时，每个进程用文件锁
+    独占一个编号的文件（path、path.1、...），并接管没有进程持有的其他编号文件中遗留的记录
+    （例如工作进程数减少或进程异常退出后）。
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 key_prefix: str = DEFAULT_KEY_PREFIX, track_activity: bool = False):
+        self.base_path = path
+        # 本进程实际使用的文件（open之后确定）
+        self.path = None
+        self.max_entries = max_entries
+        self.key_prefix = key_prefix
+        # 回放时是否记录会话写入时间（与AsyncRedisChatMessageHistory的track_activity一致）
+        self.track_activity = track_activity
+        self._entries = deque()
+        self._file = None
+        self._lock_file = None
+        self._stats = {"buffered": 0, "replayed": 0, "dropped": 0, "replay_errors": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def open(self):
+        """
+        打开缓冲文件，恢复上次未回放的记录（未指定path时不做任何事）
+        """
+        if not self.base_path or self._file is not None:
+            return
+        directory = os.path.dirname(self.base_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path, self._lock_file = self._claim(self.base_path)
+        self._read(self.path)
+        orphans = self._adopt_orphans()
+        self._file = open(self.path, "a", encoding="utf-8")
+        if orphans:
+            self._rewrite()
+        if self._entries:
+            logger.info("从 %s 恢复 %s 条待回放的写入", self.path, len(self._entries))
+
+    @staticmethod
+    def _try_lock(path: str):
+        """尝试独占path对应的锁文件，成功返回打开的锁文件，已被其他进程持有时返回None"""
+        lock_file = open(path + ".lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _slot_path(self, slot: int) -> str:
+        root, ext = os.path.splitext(self.base_path)
+        return self.base_path if slot == 0 else f"{root}.{slot}{ext}"
+
+    def _claim(self, base_path: str):
+        """选择第一个没有被其他进程持有的编号文件（不支持文件锁的平台直接使用base_path）"""
+        if fcntl is None:
+            return base_path, None
+        for slot in range(MAX_FILE_SLOTS):
+            path = self._slot_path(slot)
+            lock_file = self._try_lock(path)
+            if lock_file is not None:
+                return path, lock_file
+        raise RuntimeError(f"写入缓冲文件的编号已用尽（{MAX_FILE_SLOTS}）: {base_path}")
+
+    def _read(self, path: str) -> int:
+        """将文件中的记录加入队列，返回读取的条数"""
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    self._entries.append(json.loads(line))
+                    count += 1
+                except json.JSONDecodeError:
+                    # 进程在写入中途退出时最后一行可能不完整
+                    logger.warning("跳过写入缓冲文件中无法解析的一行")
+        return count
+
+    def _adopt_orphans(self) -> int:
+        """
+        接管没有进程持有的其他编号文件：记录并入本进程的队列，之后删除该文件
+
+        返回:
+            接管的记录数
+        """
+        if fcntl is None:
+            return 0
+        root, ext = os.path.splitext(self.base_path)
+        adopted = 0
+        for path in [self.base_path] + sorted(glob.glob(glob.escape(root) + ".*" + glob.escape(ext))):
+            if path == self.path or path.endswith(".tmp") or not os.path.exists(path):
+                continue
+            lock_file = self._try_lock(path)
+            if lock_file is None:
+                continue
+            try:
+                count = self._read(path)
+                os.remove(path)
+            finally:
+                lock_file.close()
+            if count:
+                logger.info("接管 %s 中遗留的 %s 条写入", path, count)
+            adopted += count
+        return adopted
+
+    def _rewrite(self):
+        """回放部分记录后用剩余记录重写文件"""
+        if self._file is None:
+            return
+        self._file.close()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self._entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def append(self, session_id: str, items: List[str], ttl: Optional[int] = None,
+               user_host: Optional[str] = None) -> bool:
+        """
+        缓冲一次写入
+
+        参数:
+            session_id: 会话ID
+            items: 按时间顺序排列的已序列化消息（encode_message的结果）
+            ttl: 会话过期秒数
+            user_host: 会话所属的用户（回放时写入用户的会话索引）
+
+        返回:
+            是否已缓冲，队列已满时返回False
+        """
+        if len(self._entries) >= self.max_entries:
+            self._stats["dropped"] += 1
+            logger.error("写入缓冲已满（%s 条），丢弃会话 %s 的写入", self.max_entries, session_id)
+            return False
+        entry = {"session_id": session_id, "items": items, "ttl": ttl, "user_host": user_host}
+        self._entries.append(entry)
+        self._stats["buffered"] += 1
+        if self._file is not None:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+        return True
+
+    async def replay(self, redis_client, batch_size: int = DEFAULT_REPLAY_BATCH) -> Set[str]:
+        """
+        按顺序将缓冲的写入回放到Redis
+
+        每批写入在一个MULTI事务中提交（与正常写入相同的queue_append命令）。
+        连接失败时停止回放并抛出异常，该批及之后的记录保留在队列中；
+        单条命令的错误（例如键类型不符）只记录日志，不阻塞后续回放。
+
+        返回:
+            本次回放涉及的会话ID
+        """
+        replayed = 0
+        sessions = set()
+        try:
+            while self._entries:
+                batch = [self._entries[i] for i in range(min(batch_size, len(self._entries)))]
+                async with redis_client.pipeline(transaction=True) as pipe:
+                    for entry in batch:
+                        queue_append(pipe, entry["session_id"], entry["items"], entry["ttl"],
+                                     self.track_activity, self.key_prefix, entry.get("user_host"))
+                    results = await pipe.execute(raise_on_error=False)
+                errors = [result for result in results if isinstance(result, Exception)]
+                if errors:
+                    self._stats["replay_errors"] += len(errors)
+                    logger.error("回放写入时 %s 条命令失败: %s", len(errors), str(errors[0]))
+                for _ in batch:
+                    sessions.add(self._entries.popleft()["session_id"])
+                replayed += len(batch)
+                self._stats["replayed"] += len(batch)
+        finally:
+            if replayed:
+                self._rewrite()
+        return sessions
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def stats(self) -> dict:
+        """返回队列长度和回放统计"""
+        return {
+            "pending": len(self._entries),
+            "max_entries": self.max_entries,
+            "path": self.path or self.base_path,
+            **self._stats
+        }
+
+class BufferedChatMessageHistory(LocalChatMessageHistory):
+    """
+    Redis熔断期间使用的会话历史：读写进程内会话存储，同时将写入加入WriteBuffer，
+    Redis恢复后按顺序回放，熔断期间的对话不会丢失
+    """
+
+    def __init__(self, store: LocalSessionStore, session_id: str, buffer: WriteBuffer, ttl: Optional[int] = None,
+                 compact: bool = True, user_host: Optional[str] = None):
+        super().__init__(store, session_id)
+        self.buffer = buffer
+        self.ttl = ttl
+        self.compact = compact
+        self.user_host = user_host
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> int:
+        self.buffer.append(self.session_id, [encode_message(m, compact=self.compact) for m in messages], self.ttl,
+                           self.user_host)
+        return self.store.append(self.session_id, messages)
+
+    async def aadd_turn(self, user_message: BaseMessage, ai_message: BaseMessage) -> int:
+        return await self.aadd_messages([user_message, ai_message])